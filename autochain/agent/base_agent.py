@@ -2,13 +2,14 @@ from __future__ import annotations
 
 from abc import ABC, abstractmethod
 from string import Template
-from typing import Any, List, Optional, Sequence, Union
+from typing import Any, ClassVar, Iterator, List, Optional, Sequence, Union
 
 from autochain.agent.message import ChatMessageHistory
 from autochain.agent.prompt_formatter import JSONPromptTemplate
 from autochain.agent.structs import AgentAction, AgentFinish, AgentOutputParser
 from autochain.models.base import BaseLanguageModel
 from autochain.tools.base import Tool
+from autochain.utils import run_in_executor
 from pydantic import BaseModel
 
 
@@ -17,6 +18,10 @@ class BaseAgent(BaseModel, ABC):
     llm: BaseLanguageModel = None
     tools: Sequence[Tool] = []
 
+    plans_early: ClassVar[bool] = False
+    """Whether stream_plan yields planned actions before the completion finishes, so chain
+    could cancel the rest of the completion once they are planned"""
+
     @classmethod
     def from_llm_and_tools(
         cls,
@@ -36,13 +41,22 @@ class BaseAgent(BaseModel, ABC):
         query"""
         return None
 
+    async def ashould_answer(
+        self, should_answer_prompt_template: str = "", **kwargs
+    ) -> Optional[AgentFinish]:
+        """Async version of should_answer. Agents without native async support run the sync
+        implementation in the default executor"""
+        if should_answer_prompt_template:
+            kwargs["should_answer_prompt_template"] = should_answer_prompt_template
+        return await run_in_executor(self.should_answer, **kwargs)
+
     @abstractmethod
     def plan(
         self,
         history: ChatMessageHistory,
         intermediate_steps: List[AgentAction],
         **kwargs: Any,
-    ) -> Union[AgentAction, AgentFinish]:
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
         """
         Plan the next step. either taking an action with AgentAction or respond to user with AgentFinish
         Args:
@@ -51,8 +65,37 @@ class BaseAgent(BaseModel, ABC):
             **kwargs: key value pairs from chain, which contains query and other stored memories
 
         Returns:
-            AgentAction or AgentFinish
+            AgentAction or AgentFinish, or a list of independent AgentAction to take at the
+            same time
+        """
+
+    async def aplan(
+        self,
+        history: ChatMessageHistory,
+        intermediate_steps: List[AgentAction],
+        **kwargs: Any,
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
+        """Async version of plan"""
+        return await run_in_executor(
+            self.plan, history=history, intermediate_steps=intermediate_steps, **kwargs
+        )
+
+    def stream_plan(
+        self,
+        history: ChatMessageHistory,
+        intermediate_steps: List[AgentAction],
+        **kwargs: Any,
+    ) -> Iterator[Union[str, AgentAction, AgentFinish, List[AgentAction]]]:
         """
+        Stream the planning of next step. Yields text deltas of the response to user as soon as
+        agent is known to respond with AgentFinish, then the planned AgentAction or AgentFinish
+        as the last item. Agents could also yield planned actions early, before the full
+        planned output.
+        Agents without streaming support only yield the planned output.
+        """
+        yield self.plan(
+            history=history, intermediate_steps=intermediate_steps, **kwargs
+        )
 
     def clarify_args_for_agent_action(
         self,
@@ -78,12 +121,34 @@ class BaseAgent(BaseModel, ABC):
         """
         return agent_action
 
+    async def aclarify_args_for_agent_action(
+        self,
+        agent_action: AgentAction,
+        history: ChatMessageHistory,
+        intermediate_steps: List[AgentAction],
+        **kwargs: Any,
+    ) -> Union[AgentAction, AgentFinish]:
+        """Async version of clarify_args_for_agent_action"""
+        return await run_in_executor(
+            self.clarify_args_for_agent_action,
+            agent_action,
+            history=history,
+            intermediate_steps=intermediate_steps,
+            **kwargs,
+        )
+
     def fix_action_input(
         self, tool: Tool, action: AgentAction, error: str
     ) -> Optional[AgentAction]:
         """If the tool failed due to error, what should be the fix for inputs"""
         pass
 
+    async def afix_action_input(
+        self, tool: Tool, action: AgentAction, error: str
+    ) -> Optional[AgentAction]:
+        """Async version of fix_action_input"""
+        return await run_in_executor(self.fix_action_input, tool, action, error)
+
     @staticmethod
     def get_prompt_template(
         prompt: str = "",
@@ -107,8 +172,22 @@ class BaseAgent(BaseModel, ABC):
     def is_generation_confident(
         self,
         history: ChatMessageHistory,
-        agent_output: Union[AgentAction, AgentFinish],
+        agent_output: Union[AgentAction, AgentFinish, List[AgentAction]],
         min_confidence: int = 3,
     ) -> bool:
         """Check if the generation is confident enough to take action"""
         return True
+
+    async def ais_generation_confident(
+        self,
+        history: ChatMessageHistory,
+        agent_output: Union[AgentAction, AgentFinish, List[AgentAction]],
+        min_confidence: int = 3,
+    ) -> bool:
+        """Async version of is_generation_confident"""
+        return await run_in_executor(
+            self.is_generation_confident,
+            history=history,
+            agent_output=agent_output,
+            min_confidence=min_confidence,
+        )
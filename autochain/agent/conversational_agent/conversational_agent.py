@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import logging
 from string import Template
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, ClassVar, Dict, Iterator, List, Optional, Union
 
 from colorama import Fore
 
@@ -11,13 +11,19 @@ from autochain.agent.conversational_agent.output_parser import ConvoJSONOutputPa
 from autochain.agent.conversational_agent.prompt import (
     CLARIFYING_QUESTION_PROMPT_TEMPLATE,
     PLANNING_PROMPT_TEMPLATE,
+    PLANNING_WITH_CLARIFICATION_PROMPT_TEMPLATE,
     SHOULD_ANSWER_PROMPT_TEMPLATE,
     FIX_TOOL_INPUT_PROMPT_TEMPLATE,
 )
 from autochain.agent.message import BaseMessage, ChatMessageHistory, UserMessage
 from autochain.agent.prompt_formatter import JSONPromptTemplate
+from autochain.agent.streaming_json import StreamingJSONParser
 from autochain.agent.structs import AgentAction, AgentFinish
-from autochain.models.base import BaseLanguageModel, Generation
+from autochain.models.base import (
+    BaseLanguageModel,
+    Generation,
+    merge_generation_chunks,
+)
 from autochain.tools.base import Tool
 from autochain.utils import print_with_color
 
@@ -39,19 +45,32 @@ class ConversationalAgent(BaseAgent):
     # Optionally you could set a prompt for this conversational agent or directly update the prompt
     prompt: str = ""
 
+    single_pass_planning: bool = False
+    """Whether planning prompt also asks clarifying question for missing tool args, which
+    saves the separate LLM call in clarify_args_for_agent_action"""
+
+    plans_early: ClassVar[bool] = True
+
     @classmethod
     def from_llm_and_tools(
         cls,
         llm: BaseLanguageModel,
         tools: Optional[List[Tool]] = None,
         output_parser: Optional[ConvoJSONOutputParser] = None,
-        prompt_template: str = PLANNING_PROMPT_TEMPLATE,
+        prompt_template: Optional[str] = None,
         input_variables: Optional[List[str]] = None,
         prompt: str = "",
+        single_pass_planning: bool = False,
         **kwargs: Any,
     ) -> ConversationalAgent:
         """Construct an agent from an LLM and tools."""
         tools = tools or []
+        if prompt_template is None:
+            prompt_template = (
+                PLANNING_WITH_CLARIFICATION_PROMPT_TEMPLATE
+                if single_pass_planning
+                else PLANNING_PROMPT_TEMPLATE
+            )
 
         template = cls.get_prompt_template(
             template=prompt_template,
@@ -67,6 +86,7 @@ class ConversationalAgent(BaseAgent):
             prompt_template=template,
             tools=tools,
             prompt=prompt,
+            single_pass_planning=single_pass_planning,
             **kwargs,
         )
 
@@ -80,28 +100,47 @@ class ConversationalAgent(BaseAgent):
         if "history" not in kwargs or not kwargs["history"]:
             return None
 
+        prompt = self._format_should_answer_prompt(
+            should_answer_prompt_template, **kwargs
+        )
+        response = self.llm.generate(prompt).generations[0].message.content
+        return self._parse_should_answer_response(response)
+
+    async def ashould_answer(
+        self,
+        should_answer_prompt_template: str = SHOULD_ANSWER_PROMPT_TEMPLATE,
+        **kwargs,
+    ) -> Optional[AgentFinish]:
+        if "history" not in kwargs or not kwargs["history"]:
+            return None
+
+        prompt = self._format_should_answer_prompt(
+            should_answer_prompt_template, **kwargs
+        )
+        response = (await self.llm.agenerate(prompt)).generations[0].message.content
+        return self._parse_should_answer_response(response)
+
+    @staticmethod
+    def _format_should_answer_prompt(
+        should_answer_prompt_template: str, **kwargs
+    ) -> List[BaseMessage]:
         history = kwargs.pop("history")
         inputs = {
-            "history": history.format_message(),
+            "history": history.windowed().format_message(),
             **kwargs,
         }
-
-        def _parse_response(res: str):
-            if "yes" in res.lower():
-                return AgentFinish(
-                    message="Thank your for contacting",
-                    log="Thank your for contacting",
-                )
-            else:
-                return None
-
         prompt = Template(should_answer_prompt_template).substitute(**inputs)
-        response = (
-            self.llm.generate([UserMessage(content=prompt)])
-            .generations[0]
-            .message.content
-        )
-        return _parse_response(response)
+        return [UserMessage(content=prompt)]
+
+    @staticmethod
+    def _parse_should_answer_response(res: str) -> Optional[AgentFinish]:
+        if "yes" in res.lower():
+            return AgentFinish(
+                message="Thank your for contacting",
+                log="Thank your for contacting",
+            )
+        else:
+            return None
 
     @staticmethod
     def format_prompt(
@@ -149,7 +188,7 @@ class ConversationalAgent(BaseAgent):
         history: ChatMessageHistory,
         intermediate_steps: List[AgentAction],
         **kwargs: Any,
-    ) -> Union[AgentAction, AgentFinish]:
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
         """
         Plan the next step. either taking an action with AgentAction or respond to user with AgentFinish
         Args:
@@ -158,8 +197,78 @@ class ConversationalAgent(BaseAgent):
             **kwargs: key value pairs from chain, which contains query and other stored memories
 
         Returns:
-            AgentAction or AgentFinish
+            AgentAction or AgentFinish, or a list of independent AgentAction to take at the
+            same time
         """
+        final_prompt = self._format_planning_prompt(
+            history, intermediate_steps, **kwargs
+        )
+        full_output: Generation = self.llm.generate(final_prompt).generations[0]
+        return self._parse_planning_output(full_output)
+
+    async def aplan(
+        self,
+        history: ChatMessageHistory,
+        intermediate_steps: List[AgentAction],
+        **kwargs: Any,
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
+        final_prompt = self._format_planning_prompt(
+            history, intermediate_steps, **kwargs
+        )
+        full_output: Generation = (await self.llm.agenerate(final_prompt)).generations[
+            0
+        ]
+        return self._parse_planning_output(full_output)
+
+    def stream_plan(
+        self,
+        history: ChatMessageHistory,
+        intermediate_steps: List[AgentAction],
+        **kwargs: Any,
+    ) -> Iterator[Union[str, AgentAction, AgentFinish, List[AgentAction]]]:
+        """
+        Stream the planning of next step while the json output is generated. Planned actions
+        are yielded as soon as the tool object is complete, so chain could start running them
+        before the model finishes. Closing the generator after the planned actions stops the
+        rest of the completion. Otherwise the full planned output, with model_response of
+        actions, is yielded as new objects once the generation finishes, so actions already
+        being run are not modified. If agent responds to user, deltas of the response field
+        are yielded as they arrive and AgentFinish is yielded at the end.
+        """
+        final_prompt = self._format_planning_prompt(
+            history, intermediate_steps, **kwargs
+        )
+        parser = StreamingJSONParser()
+        chunks = []
+        planned_output = None
+        stream = self.llm.stream(final_prompt)
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                deltas = parser.feed(chunk.content)
+                if planned_output is not None:
+                    continue
+
+                if self.output_parser.is_responding(parser):
+                    for path, delta in deltas:
+                        if path == ("response",):
+                            yield delta
+                else:
+                    planned_output = self.output_parser.parse_partial(parser)
+                    if planned_output is not None:
+                        yield planned_output
+        finally:
+            # caller closing this generator after the planned output cancels the completion
+            stream.close()
+
+        yield self._parse_planning_output(merge_generation_chunks(chunks))
+
+    def _format_planning_prompt(
+        self,
+        history: ChatMessageHistory,
+        intermediate_steps: List[AgentAction],
+        **kwargs: Any,
+    ) -> List[BaseMessage]:
         print_with_color("Planning", Fore.LIGHTYELLOW_EX)
         tool_names = ", ".join([tool.name for tool in self.tools])
         tool_strings = "\n\n".join(
@@ -168,7 +277,7 @@ class ConversationalAgent(BaseAgent):
         inputs = {
             "tool_names": tool_names,
             "tools": tool_strings,
-            "history": history.format_message(),
+            "history": history.windowed().format_message(),
             "prompt": self.prompt,
             **kwargs,
         }
@@ -176,17 +285,23 @@ class ConversationalAgent(BaseAgent):
             self.prompt_template, intermediate_steps, **inputs
         )
         logger.info(f"\nPlanning Input: {final_prompt[0].content} \n")
+        return final_prompt
 
-        full_output: Generation = self.llm.generate(final_prompt).generations[0]
-        agent_output: Union[AgentAction, AgentFinish] = self.output_parser.parse(
-            full_output.message
-        )
+    def _parse_planning_output(
+        self, full_output: Generation
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
+        agent_output = self.output_parser.parse(full_output.message)
 
         print(f"Planning output: \n{repr(full_output.message.content)}", Fore.YELLOW)
         if isinstance(agent_output, AgentAction):
             print_with_color(
                 f"Plan to take action '{agent_output.tool}'", Fore.LIGHTYELLOW_EX
             )
+        elif isinstance(agent_output, list):
+            print_with_color(
+                f"Plan to take actions {[a.tool for a in agent_output]}",
+                Fore.LIGHTYELLOW_EX,
+            )
 
         return agent_output
 
@@ -212,42 +327,101 @@ class ConversationalAgent(BaseAgent):
         Returns:
             Either a clarifying question (AgentFinish) or take the planned action (AgentAction)
         """
+        # clarifying question is already checked during planning
+        if self.single_pass_planning:
+            return agent_action
+
         print_with_color("Deciding if need clarification", Fore.LIGHTYELLOW_EX)
         if not self.allowed_tools.get(agent_action.tool):
             return agent_action
-        else:
-            inputs = {
-                "tool_name": agent_action.tool,
-                "tool_desp": self.allowed_tools.get(agent_action.tool).description,
-                "history": history.format_message(),
-                **kwargs,
-            }
-
-            clarifying_template = self.get_prompt_template(
-                template=CLARIFYING_QUESTION_PROMPT_TEMPLATE
-            )
 
-            final_prompt = self.format_prompt(
-                clarifying_template, intermediate_steps, **inputs
-            )
-            logger.info(f"\nClarification inputs: {final_prompt[0].content}")
-            full_output: Generation = self.llm.generate(final_prompt).generations[0]
-            print(f"Clarification outputs: {repr(full_output.message.content)}")
-            return self.output_parser.parse_clarification(
-                full_output.message, agent_action=agent_action
-            )
+        final_prompt = self._format_clarifying_prompt(
+            agent_action, history, intermediate_steps, **kwargs
+        )
+        full_output: Generation = self.llm.generate(final_prompt).generations[0]
+        print(f"Clarification outputs: {repr(full_output.message.content)}")
+        return self.output_parser.parse_clarification(
+            full_output.message, agent_action=agent_action
+        )
+
+    async def aclarify_args_for_agent_action(
+        self,
+        agent_action: AgentAction,
+        history: ChatMessageHistory,
+        intermediate_steps: List[AgentAction],
+        **kwargs: Any,
+    ):
+        if self.single_pass_planning:
+            return agent_action
+
+        print_with_color("Deciding if need clarification", Fore.LIGHTYELLOW_EX)
+        if not self.allowed_tools.get(agent_action.tool):
+            return agent_action
+
+        final_prompt = self._format_clarifying_prompt(
+            agent_action, history, intermediate_steps, **kwargs
+        )
+        full_output: Generation = (await self.llm.agenerate(final_prompt)).generations[
+            0
+        ]
+        print(f"Clarification outputs: {repr(full_output.message.content)}")
+        return self.output_parser.parse_clarification(
+            full_output.message, agent_action=agent_action
+        )
+
+    def _format_clarifying_prompt(
+        self,
+        agent_action: AgentAction,
+        history: ChatMessageHistory,
+        intermediate_steps: List[AgentAction],
+        **kwargs: Any,
+    ) -> List[BaseMessage]:
+        inputs = {
+            "tool_name": agent_action.tool,
+            "tool_desp": self.allowed_tools.get(agent_action.tool).description,
+            "history": history.windowed().format_message(),
+            **kwargs,
+        }
+
+        clarifying_template = self.get_prompt_template(
+            template=CLARIFYING_QUESTION_PROMPT_TEMPLATE
+        )
+
+        final_prompt = self.format_prompt(
+            clarifying_template, intermediate_steps, **inputs
+        )
+        logger.info(f"\nClarification inputs: {final_prompt[0].content}")
+        return final_prompt
 
     def fix_action_input(
         self, tool: Tool, action: AgentAction, error: str
     ) -> AgentAction:
         """If the tool failed due to error, what should be the fix for inputs"""
+        messages = self._format_fix_action_input_prompt(tool, action, error)
+        output = self.llm.generate(messages).generations[0]
+        return self._parse_fixed_action_input(action, output)
+
+    async def afix_action_input(
+        self, tool: Tool, action: AgentAction, error: str
+    ) -> AgentAction:
+        messages = self._format_fix_action_input_prompt(tool, action, error)
+        output = (await self.llm.agenerate(messages)).generations[0]
+        return self._parse_fixed_action_input(action, output)
+
+    @staticmethod
+    def _format_fix_action_input_prompt(
+        tool: Tool, action: AgentAction, error: str
+    ) -> List[BaseMessage]:
         prompt = FIX_TOOL_INPUT_PROMPT_TEMPLATE.format(
             tool_description=tool.description, inputs=action.tool_input, error=error
         )
 
         logger.info(f"\nFixing tool input prompt: {prompt}")
-        messages = UserMessage(content=prompt)
-        output = self.llm.generate([messages]).generations[0]
+        return [UserMessage(content=prompt)]
+
+    def _parse_fixed_action_input(
+        self, action: AgentAction, output: Generation
+    ) -> AgentAction:
         new_tool_inputs = self.output_parser.load_json_output(output.message)
 
         logger.info(f"\nFixed tool output: {new_tool_inputs}")
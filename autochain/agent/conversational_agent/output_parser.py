@@ -1,24 +1,68 @@
 import json
-from typing import Union
+from typing import Any, Dict, List, Optional, Union
 
 from colorama import Fore
 
 from autochain.agent.message import BaseMessage
+from autochain.agent.streaming_json import StreamingJSONParser
 from autochain.agent.structs import AgentAction, AgentFinish, AgentOutputParser
 from autochain.errors import OutputParserException
 from autochain.utils import print_with_color
 
 
 class ConvoJSONOutputParser(AgentOutputParser):
-    def parse(self, message: BaseMessage) -> Union[AgentAction, AgentFinish]:
-        response = self.load_json_output(message)
+    def parse(
+        self, message: BaseMessage
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
+        return self._parse_response(self.load_json_output(message))
+
+    def parse_partial(
+        self, parser: StreamingJSONParser
+    ) -> Optional[Union[AgentAction, AgentFinish, List[AgentAction]]]:
+        """
+        Parse planning output while it is streamed. Planned actions are decided as soon as
+        thoughts.need_use_tool and the tool object are complete. Returns None if output is
+        not decided yet or agent responds to user, which needs the full response
+        """
+        if not parser.is_complete("thoughts", "need_use_tool"):
+            return None
+        if not parser.is_complete("tool") or self.is_responding(parser):
+            return None
+
+        tools = parser.get("tool")
+        if not isinstance(tools, list):
+            tools = [tools]
+        if not any(isinstance(tool, dict) and tool.get("name") for tool in tools):
+            return None
+        # response is generated after the tool, so model_response is left empty instead of
+        # the part streamed so far
+        return self._parse_response({**parser.value, "response": ""})
+
+    @staticmethod
+    def is_responding(parser: StreamingJSONParser) -> bool:
+        """Whether streamed planning output decides to respond to user without tools"""
+        if not parser.is_complete("thoughts", "need_use_tool"):
+            return False
+        need_use_tool = parser.get("thoughts", "need_use_tool")
+        return isinstance(need_use_tool, str) and "no" in need_use_tool.lower().strip()
 
-        action_name = response.get("tool", {}).get("name")
-        action_args = response.get("tool", {}).get("args")
+    def _parse_response(
+        self, response: Dict[str, Any]
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
+        # tool could also be a list of independent tools to be used at the same time
+        tools = response.get("tool", {})
+        if not isinstance(tools, list):
+            tools = [tools]
+        for tool in tools:
+            if not isinstance(tool, dict):
+                raise OutputParserException(
+                    f"Tool should be a JSON object with name and args, got: {tool}"
+                )
+        tools = [tool for tool in tools if tool.get("name")]
 
         if (
             "no" in response.get("thoughts", {}).get("need_use_tool").lower().strip()
-            or not action_name
+            or not tools
         ):
             output_message = response.get("response")
             if output_message:
@@ -28,21 +72,34 @@ class ConvoJSONOutputParser(AgentOutputParser):
                     message="Sorry, i don't understand", log=output_message
                 )
 
-        return AgentAction(
-            tool=action_name,
-            tool_input=action_args,
-            model_response=response.get("response", ""),
-        )
+        actions = []
+        for tool in tools:
+            # planning prompt could also check if tool args exist in a single pass
+            clarifying_output = self._parse_clarifying_question(tool)
+            if clarifying_output:
+                return clarifying_output
+
+            actions.append(
+                AgentAction(
+                    tool=tool.get("name"),
+                    tool_input=tool.get("args"),
+                    model_response=response.get("response", ""),
+                )
+            )
+
+        return actions[0] if len(actions) == 1 else actions
 
     def parse_clarification(
         self, message: BaseMessage, agent_action: AgentAction
     ) -> Union[AgentAction, AgentFinish]:
         response = self.load_json_output(message)
+        return self._parse_clarifying_question(response) or agent_action
 
+    @staticmethod
+    def _parse_clarifying_question(response: Dict[str, Any]) -> Optional[AgentFinish]:
         has_arg_value = response.get("has_arg_value", "")
         clarifying_question = response.get("clarifying_question", "")
 
         if "no" in has_arg_value.lower() and clarifying_question:
             return AgentFinish(message=clarifying_question, log=clarifying_question)
-        else:
-            return agent_action
+        return None
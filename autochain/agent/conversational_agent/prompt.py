@@ -1,9 +1,12 @@
 from __future__ import annotations
 
-PLANNING_PROMPT_TEMPLATE = """You are an assistant who tries to have helpful conversation 
-with user based on previous conversation and previous tools outputs from tools. 
+from string import Template
+
+_PLANNING_PROMPT = Template(
+    """You are an assistant who tries to have helpful conversation
+with user based on previous conversation and previous tools outputs from tools.
 ${prompt}
-Use tool when provided. If there is no tool available, respond with have a helpful and polite 
+Use tool when provided. If there is no tool available, respond with have a helpful and polite
 conversation. Find next step without using the same tool with same inputs.
 
 Assistant has access to the following tools:
@@ -26,13 +29,28 @@ RESPONSE FORMAT:
     "name": "tool name, should be one of [${tool_names}] or empty if tool is not needed",
     "args": {
       "arg_name": "arg value from conversation history or tools outputs to run tool"
-    }
+    }${clarification_fields}
   },
   "response": "response to user given tools outputs and conversations",
 }
+If multiple tools are needed and their inputs do not depend on each other's outputs, "tool"
+could be a list of tool objects in the format above, which are used at the same time.
 
 Ensure the response can be parsed by Python json.loads
 """
+)
+
+# fields checking if tool args are available, so clarifying question does not need a
+# separate call
+CLARIFICATION_FIELDS = """,
+    "has_arg_value": "Do values for all input args of the tool exist in the previous conversation or tools outputs? answer with Yes or No",
+    "clarifying_question": "clarifying question to user to ask for missing information\""""
+
+# other placeholders are left for the agent to substitute
+PLANNING_PROMPT_TEMPLATE = _PLANNING_PROMPT.safe_substitute(clarification_fields="")
+PLANNING_WITH_CLARIFICATION_PROMPT_TEMPLATE = _PLANNING_PROMPT.safe_substitute(
+    clarification_fields=CLARIFICATION_FIELDS
+)
 
 SHOULD_ANSWER_PROMPT_TEMPLATE = """You are a support agent. 
 Given the following conversation so far, has assistant finish helping user with all the 
@@ -0,0 +1,132 @@
+"""Local repair of malformed JSON generated by models"""
+import json
+import re
+from typing import List, Optional
+
+# code fence wrapping the whole text, whose closing fence could be missing if truncated
+CODE_FENCE_PATTERN = re.compile(r"\A```(?:json)?\s*(.*?)\s*(?:```)?\Z", re.DOTALL)
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSING_BRACKETS = {"{": "}", "[": "]"}
+STRING_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def extract_json_text(text: str) -> str:
+    """
+    Return the part of the text from the first opening brace to the last closing brace if
+    it is valid JSON. Otherwise code fence wrapping the whole text is removed, and text
+    ends at the last closing brace, or at the end if the JSON is truncated
+    """
+    start = text.find("{")
+    end = text.rfind("}")
+    if 0 <= start < end:
+        try:
+            json.loads(text[start : end + 1])
+            return text[start : end + 1]
+        except ValueError:
+            pass
+
+    fenced = CODE_FENCE_PATTERN.match(text.strip())
+    if fenced:
+        text = fenced.group(1)
+
+    start = text.find("{")
+    if start < 0:
+        return text.strip()
+    end = text.rfind("}")
+    if end < start:
+        return text[start:].strip()
+    # keep a truncated tail after the last closing brace if brackets are left open
+    tail = text[end + 1 :]
+    if tail.strip() and not _is_balanced(text[start : end + 1]):
+        return text[start:].strip()
+    return text[start : end + 1].strip()
+
+
+def repair_json(text: str) -> str:
+    """
+    Fix common mistakes of generated JSON in a single pass: single quoted strings,
+    unescaped control characters in strings, trailing commas, python literals and
+    truncated output missing closing quotes and brackets
+    """
+    output: List[str] = []
+    stack: List[str] = []
+    quote: Optional[str] = None
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote is not None:
+            if char == "\\" and i + 1 < len(text):
+                next_char = text[i + 1]
+                # \' is not a valid JSON escape
+                output.append(next_char if next_char == "'" else char + next_char)
+                i += 2
+                continue
+            if char == quote:
+                output.append('"')
+                quote = None
+            elif char == '"':
+                output.append('\\"')
+            else:
+                output.append(STRING_ESCAPES.get(char, char))
+        elif char in "\"'":
+            output.append('"')
+            quote = char
+        elif char in CLOSING_BRACKETS:
+            stack.append(char)
+            output.append(char)
+        elif char in "}]":
+            _remove_trailing_comma(output)
+            if stack:
+                stack.pop()
+            output.append(char)
+        elif char.isalpha():
+            j = i
+            while j < len(text) and text[j].isalpha():
+                j += 1
+            word = text[i:j]
+            output.append(PYTHON_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            output.append(char)
+        i += 1
+
+    # close truncated output
+    if quote is not None:
+        output.append('"')
+    _remove_trailing_comma(output)
+    if "".join(output).rstrip().endswith(":"):
+        output.append("null")
+    while stack:
+        output.append(CLOSING_BRACKETS[stack.pop()])
+    return "".join(output)
+
+
+def _remove_trailing_comma(output: List[str]) -> None:
+    i = len(output) - 1
+    while i >= 0 and output[i].isspace():
+        i -= 1
+    if i >= 0 and output[i] == ",":
+        del output[i:]
+
+
+def _is_balanced(text: str) -> bool:
+    """Whether all brackets outside of strings are closed"""
+    depth = 0
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+    return depth == 0
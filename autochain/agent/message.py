@@ -1,8 +1,9 @@
 import enum
+import threading
 from abc import abstractmethod
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 
 class MessageType(enum.Enum):
@@ -68,9 +69,33 @@ class FunctionMessage(BaseMessage):
         return "function"
 
 
+# guards updates of rendered conversations, which are short, so it is shared by all histories
+# instead of making them unable to be deep copied
+_RENDERED_LOCK = threading.Lock()
+
+
 class ChatMessageHistory(BaseModel):
     messages: List[BaseMessage] = []
 
+    # rendered conversation of the first messages, with their count and the last of them,
+    # extended as messages are appended, so formatting history repeatedly within a turn does
+    # not render it again. Replaced as a whole so concurrent readers see a consistent value
+    _rendered: Tuple[str, int, Optional[BaseMessage]] = PrivateAttr(
+        default=("", 0, None)
+    )
+
+    # window policy selecting the part of history included in prompts, and memory of the
+    # conversation it could keep state in
+    _window: Optional[Any] = PrivateAttr(default=None)
+    _window_memory: Optional[Any] = PrivateAttr(default=None)
+    _windowed: Optional["ChatMessageHistory"] = PrivateAttr(default=None)
+    _windowed_count: int = PrivateAttr(default=-1)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name == "messages":
+            self._reset_rendered()
+
     def save_message(self, message: str, message_type: MessageType, **kwargs):
         if message_type == MessageType.AIMessage:
             self.messages.append(AIMessage(content=message))
@@ -88,24 +113,74 @@ class ChatMessageHistory(BaseModel):
             self.messages.append(SystemMessage(content=message))
 
     def format_message(self):
-        string_messages = []
-        if len(self.messages) > 0:
-            for m in self.messages:
-                if isinstance(m, FunctionMessage):
-                    string_messages.append(f"Action: {m.conversational_message}")
-                    continue
-
-                if isinstance(m, UserMessage):
-                    role = "User"
-                elif isinstance(m, AIMessage):
-                    role = "Assistant"
-                elif isinstance(m, SystemMessage):
-                    role = "System"
-                else:
-                    continue
-                string_messages.append(f"{role}: {m.content}")
-            return "\n".join(string_messages) + "\n"
-        return ""
+        """
+        Render the conversation, extending the rendering of the previous call with messages
+        appended since. Messages are expected not to change once saved: rendering is only
+        rebuilt if messages are reassigned or removed, or the last rendered message is
+        replaced, so replacing earlier messages in place is not detected
+        """
+        rendered, count, last = self._rendered
+        if count and (
+            len(self.messages) < count or self.messages[count - 1] is not last
+        ):
+            # messages were removed or replaced in place
+            rendered, count = "", 0
+
+        new_messages = self.messages[count:]
+        if not new_messages:
+            return rendered
+
+        new_lines = [self.format_single_message(m) for m in new_messages]
+        rendered += "".join(line + "\n" for line in new_lines if line)
+        count += len(new_messages)
+        with _RENDERED_LOCK:
+            self._rendered = (rendered, count, new_messages[-1])
+        return rendered
+
+    @staticmethod
+    def format_single_message(message: BaseMessage) -> Optional[str]:
+        if isinstance(message, FunctionMessage):
+            return f"Action: {message.conversational_message}"
+
+        if isinstance(message, UserMessage):
+            role = "User"
+        elif isinstance(message, AIMessage):
+            role = "Assistant"
+        elif isinstance(message, SystemMessage):
+            role = "System"
+        else:
+            return None
+        return f"{role}: {message.content}"
+
+    def set_window(self, window: Optional[Any], memory: Optional[Any] = None) -> None:
+        """Set history window policy applied by windowed()"""
+        self._window = window
+        self._window_memory = memory
+        self._windowed = None
+        self._windowed_count = -1
+
+    def windowed(self) -> "ChatMessageHistory":
+        """History to include in prompts, after applying the window policy if set"""
+        if self._window is None:
+            return self
+
+        if self._windowed_count != len(self.messages):
+            self._windowed = self._window.apply(self, memory=self._window_memory)
+            self._windowed_count = len(self.messages)
+        return self._windowed
+
+    async def awindowed(self) -> "ChatMessageHistory":
+        """
+        Async version of windowed. The windowed history is cached, so later windowed()
+        calls of agents formatting prompts return it without applying the window again
+        """
+        if self._window is None:
+            return self
+
+        if self._windowed_count != len(self.messages):
+            self._windowed = await self._window.aapply(self, memory=self._window_memory)
+            self._windowed_count = len(self.messages)
+        return self._windowed
 
     def get_latest_user_message(self) -> UserMessage:
         for message in reversed(self.messages):
@@ -113,5 +188,20 @@ class ChatMessageHistory(BaseModel):
                 return message
         return UserMessage(content="n/a")
 
+    def snapshot(self) -> "ChatMessageHistory":
+        """
+        Copy of the history that could be appended to independently. Messages are never
+        modified once saved, so they are shared instead of copied, along with their
+        rendered conversation
+        """
+        history = ChatMessageHistory.construct(messages=list(self.messages))
+        history._rendered = self._rendered
+        history.set_window(self._window, self._window_memory)
+        return history
+
     def clear(self) -> None:
         self.messages = []
+
+    def _reset_rendered(self) -> None:
+        with _RENDERED_LOCK:
+            self._rendered = ("", 0, None)
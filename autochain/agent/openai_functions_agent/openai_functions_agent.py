@@ -1,17 +1,35 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import logging
+import math
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from string import Template
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple, Union
+
+from pydantic import PrivateAttr, root_validator
 
 from autochain.agent.base_agent import BaseAgent
-from autochain.agent.message import ChatMessageHistory, SystemMessage, UserMessage
+from autochain.agent.message import (
+    BaseMessage,
+    ChatMessageHistory,
+    SystemMessage,
+    UserMessage,
+)
 from autochain.agent.openai_functions_agent.output_parser import (
     OpenAIFunctionOutputParser,
 )
 from autochain.agent.openai_functions_agent.prompt import ESTIMATE_CONFIDENCE_PROMPT
 from autochain.agent.structs import AgentAction, AgentFinish
-from autochain.models.base import BaseLanguageModel, Generation
+from autochain.errors import OutputParserException
+from autochain.models.base import (
+    BaseLanguageModel,
+    Generation,
+    LLMResult,
+    merge_generation_chunks,
+)
 from autochain.tools.base import Tool
 from autochain.utils import print_with_color
 from colorama import Fore
@@ -32,6 +50,41 @@ class OpenAIFunctionsAgent(BaseAgent):
     tools: List[Tool] = []
     prompt: Optional[str] = None
     min_confidence: int = 3
+    confidence_mode: Literal["llm", "logprob", "sampling"] = "llm"
+    """How confidence of planned output is estimated, on the same 1-5 scale as
+    min_confidence.
+    llm: ask model to estimate the confidence with a separate request
+    logprob: average token probability of the planning completion, requested with logprobs
+    sampling: agreement between confidence_samples completions sampled in the planning
+    request, and the most common planned output is taken. Needs non zero temperature
+    logprob and sampling add no request, and fall back to llm when they are not available
+    """
+    confidence_samples: int = 3
+    """Number of completions sampled to estimate confidence in sampling mode"""
+    optimistic_execution: bool = False
+    """Run planned read only tools while confidence is estimated by model, so the latency of
+    the confidence request is hidden behind the tools. Tool outputs are discarded if the
+    generation is not confident"""
+
+    # model used for planning with the parameters confidence_mode needs, along with the llm
+    # and the confidence settings it was copied for
+    _planning_llm: Optional[
+        Tuple[BaseLanguageModel, Tuple[str, int], BaseLanguageModel]
+    ] = PrivateAttr(default=None)
+
+    @root_validator()
+    def validate_confidence_mode(cls, values: Dict) -> Dict:
+        """Validate that samples could disagree in sampling confidence mode"""
+        llm = values.get("llm")
+        if (
+            values.get("confidence_mode") == "sampling"
+            and getattr(llm, "temperature", None) == 0
+        ):
+            raise ValueError(
+                "Sampling confidence mode needs non zero temperature, otherwise all "
+                "samples agree and confidence is always the highest"
+            )
+        return values
 
     @classmethod
     def from_llm_and_tools(
@@ -65,37 +118,58 @@ class OpenAIFunctionsAgent(BaseAgent):
         **kwargs: Any,
     ) -> Union[AgentAction, AgentFinish]:
         while retries > 0:
-            print_with_color("Planning", Fore.LIGHTYELLOW_EX)
-
-            final_messages = []
-            if self.prompt:
-                final_messages.append(SystemMessage(content=self.prompt))
-            final_messages += history.messages
+            final_messages = self._format_planning_messages(history)
+            result = self._get_planning_llm().generate(final_messages, self.tools)
+            agent_output, confidence = self._parse_planning_result(result)
 
-            logger.info(f"\nPlanning Input: {[m.content for m in final_messages]} \n")
-            full_output: Generation = self.llm.generate(
-                final_messages, self.tools
-            ).generations[0]
-
-            agent_output: Union[AgentAction, AgentFinish] = self.output_parser.parse(
-                full_output.message
-            )
-            print(
-                f"Planning output: \nmessage content: {repr(full_output.message.content)}; "
-                f"function_call: "
-                f"{repr(full_output.message.function_call)}",
-                Fore.YELLOW,
-            )
-            if isinstance(agent_output, AgentAction):
+            if confidence is not None:
+                generation_is_confident = confidence >= self.min_confidence
+            elif self._can_run_optimistically(agent_output):
+                generation_is_confident = self._run_while_estimating_confidence(
+                    history, agent_output
+                )
+            else:
+                generation_is_confident = self.is_generation_confident(
+                    history=history,
+                    agent_output=agent_output,
+                    min_confidence=self.min_confidence,
+                )
+            if not generation_is_confident:
+                retries -= 1
                 print_with_color(
-                    f"Plan to take action '{agent_output.tool}'", Fore.LIGHTYELLOW_EX
+                    f"Generation is not confident, {retries} retries left",
+                    Fore.LIGHTYELLOW_EX,
                 )
+                continue
+            else:
+                return agent_output
 
-            generation_is_confident = self.is_generation_confident(
-                history=history,
-                agent_output=agent_output,
-                min_confidence=self.min_confidence,
+    async def aplan(
+        self,
+        history: ChatMessageHistory,
+        intermediate_steps: List[AgentAction],
+        retries: int = 2,
+        **kwargs: Any,
+    ) -> Union[AgentAction, AgentFinish]:
+        while retries > 0:
+            final_messages = self._format_planning_messages(history)
+            result = await self._get_planning_llm().agenerate(
+                final_messages, self.tools
             )
+            agent_output, confidence = self._parse_planning_result(result)
+
+            if confidence is not None:
+                generation_is_confident = confidence >= self.min_confidence
+            elif self._can_run_optimistically(agent_output):
+                generation_is_confident = await self._arun_while_estimating_confidence(
+                    history, agent_output
+                )
+            else:
+                generation_is_confident = await self.ais_generation_confident(
+                    history=history,
+                    agent_output=agent_output,
+                    min_confidence=self.min_confidence,
+                )
             if not generation_is_confident:
                 retries -= 1
                 print_with_color(
@@ -106,6 +180,216 @@ class OpenAIFunctionsAgent(BaseAgent):
             else:
                 return agent_output
 
+    def stream_plan(
+        self,
+        history: ChatMessageHistory,
+        intermediate_steps: List[AgentAction],
+        retries: int = 2,
+        **kwargs: Any,
+    ) -> Iterator[Union[str, AgentAction, AgentFinish]]:
+        """
+        Stream the planning of next step. Message content is streamed as soon as it arrives
+        without a function call, which means agent is responding to user.
+        Streamed responses are not checked for confidence since they are already delivered to
+        user, while actions are checked the same way as plan.
+        """
+        final_messages = self._format_planning_messages(history)
+        chunks = []
+        for chunk in self.llm.stream(final_messages, self.tools):
+            chunks.append(chunk)
+            if chunk.content and not any(c.function_call for c in chunks):
+                yield chunk.content
+
+        agent_output = self._parse_planning_output(merge_generation_chunks(chunks))
+        if isinstance(agent_output, AgentAction) and not self.is_generation_confident(
+            history=history,
+            agent_output=agent_output,
+            min_confidence=self.min_confidence,
+        ):
+            retries -= 1
+            print_with_color(
+                f"Generation is not confident, {retries} retries left",
+                Fore.LIGHTYELLOW_EX,
+            )
+            agent_output = self.plan(
+                history, intermediate_steps, retries=retries, **kwargs
+            )
+
+        yield agent_output
+
+    def _can_run_optimistically(
+        self, agent_output: Union[AgentAction, AgentFinish]
+    ) -> bool:
+        """Whether planned action uses a read only tool, which is safe to run before the
+        generation is known to be confident"""
+        return (
+            self.optimistic_execution
+            and isinstance(agent_output, AgentAction)
+            and agent_output.tool in self.allowed_tools
+            and self.allowed_tools[agent_output.tool].read_only
+        )
+
+    def _run_while_estimating_confidence(
+        self, history: ChatMessageHistory, agent_output: AgentAction
+    ) -> bool:
+        """
+        Run planned tool concurrently with the confidence request. Tool output is recorded
+        in the action if the generation is confident, so chain does not run it again
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(
+                self.allowed_tools[agent_output.tool].run, agent_output.tool_input
+            )
+            generation_is_confident = self.is_generation_confident(
+                history=history,
+                agent_output=agent_output,
+                min_confidence=self.min_confidence,
+            )
+            # failed tool is left for chain to run, which handles its errors
+            if generation_is_confident and future.exception() is None:
+                self._set_optimistic_output(agent_output, future.result())
+        finally:
+            # outputs of tools are discarded if the generation is not confident
+            executor.shutdown(wait=False)
+        return generation_is_confident
+
+    async def _arun_while_estimating_confidence(
+        self, history: ChatMessageHistory, agent_output: AgentAction
+    ) -> bool:
+        """Async version of _run_while_estimating_confidence"""
+        task = asyncio.ensure_future(
+            self.allowed_tools[agent_output.tool].arun(agent_output.tool_input)
+        )
+        try:
+            generation_is_confident = await self.ais_generation_confident(
+                history=history,
+                agent_output=agent_output,
+                min_confidence=self.min_confidence,
+            )
+            if generation_is_confident:
+                await asyncio.wait([task])
+                if task.exception() is None:
+                    self._set_optimistic_output(agent_output, task.result())
+        finally:
+            task.cancel()
+        return generation_is_confident
+
+    @staticmethod
+    def _set_optimistic_output(action: AgentAction, tool_output: str) -> None:
+        # tool_output is left for chain to set, which reruns tool if input is clarified
+        action.set_precomputed_output(tool_output)
+        print(
+            f"Took action '{action.tool}' with inputs '{action.tool_input}' while "
+            f"estimating confidence, and the tool_output is {tool_output}"
+        )
+
+    def _get_planning_llm(self) -> BaseLanguageModel:
+        """Model requesting log probabilities or samples of planning completion if
+        confidence_mode needs them. The copy is rebuilt when llm or the settings change
+        """
+        if self.confidence_mode == "llm":
+            return self.llm
+
+        settings = (self.confidence_mode, self.confidence_samples)
+        if self._planning_llm is not None:
+            llm, cached_settings, planning_llm = self._planning_llm
+            if llm is self.llm and cached_settings == settings:
+                return planning_llm
+
+        if self.confidence_mode == "logprob":
+            update = {"model_kwargs": {**self.llm.model_kwargs, "logprobs": True}}
+        else:
+            update = {"n": self.confidence_samples}
+            # samples could not be streamed, and copy skips validation of the model
+            if getattr(self.llm, "streaming", False):
+                update["streaming"] = False
+        planning_llm = self.llm.copy(update=update)
+        self._planning_llm = (self.llm, settings, planning_llm)
+        return planning_llm
+
+    def _parse_planning_result(
+        self, result: LLMResult
+    ) -> Tuple[Union[AgentAction, AgentFinish], Optional[float]]:
+        """
+        Parse planned output and estimate its confidence from the planning completion.
+        Confidence is None if it needs to be estimated by model
+        """
+        if self.confidence_mode == "sampling" and len(result.generations) > 1:
+            return self._select_sampled_output(result.generations)
+
+        agent_output = self._parse_planning_output(result.generations[0])
+        logprobs = result.generations[0].logprobs
+        if self.confidence_mode != "logprob" or not logprobs:
+            return agent_output, None
+
+        # geometric mean of token probabilities mapped to 1-5
+        probability = math.exp(sum(logprobs) / len(logprobs))
+        return agent_output, 1 + 4 * probability
+
+    def _select_sampled_output(
+        self, generations: List[Generation]
+    ) -> Tuple[Union[AgentAction, AgentFinish], float]:
+        """Take the most common planned output of sampled completions, and map the share of
+        completions agreeing with it to 1-5 confidence"""
+        first_generations: Dict[Any, Generation] = {}
+        votes = Counter()
+        for generation in generations:
+            try:
+                key = self._get_output_key(self.output_parser.parse(generation.message))
+            except (ValueError, OutputParserException):
+                # invalid completion counts as disagreement
+                continue
+            first_generations.setdefault(key, generation)
+            votes[key] += 1
+
+        if not votes:
+            # none of the samples could be parsed, raise the same error as plan
+            return self._parse_planning_output(generations[0]), 1
+
+        key, count = votes.most_common(1)[0]
+        agent_output = self._parse_planning_output(first_generations[key])
+        return agent_output, 1 + 4 * count / len(generations)
+
+    @staticmethod
+    def _get_output_key(agent_output: Union[AgentAction, AgentFinish]) -> Any:
+        """Planned outputs with the same key agree with each other. All responses to user
+        agree, since their wording differs between samples"""
+        if isinstance(agent_output, AgentAction):
+            return agent_output.tool, json.dumps(
+                agent_output.tool_input, sort_keys=True
+            )
+        return "respond"
+
+    def _format_planning_messages(
+        self, history: ChatMessageHistory
+    ) -> List[BaseMessage]:
+        print_with_color("Planning", Fore.LIGHTYELLOW_EX)
+
+        final_messages = []
+        if self.prompt:
+            final_messages.append(SystemMessage(content=self.prompt))
+        final_messages += history.windowed().messages
+
+        logger.info(f"\nPlanning Input: {[m.content for m in final_messages]} \n")
+        return final_messages
+
+    def _parse_planning_output(
+        self, full_output: Generation
+    ) -> Union[AgentAction, AgentFinish]:
+        agent_output = self.output_parser.parse(full_output.message)
+        print(
+            f"Planning output: \nmessage content: {repr(full_output.message.content)}; "
+            f"function_call: "
+            f"{repr(full_output.message.function_call)}",
+            Fore.YELLOW,
+        )
+        if isinstance(agent_output, AgentAction):
+            print_with_color(
+                f"Plan to take action '{agent_output.tool}'", Fore.LIGHTYELLOW_EX
+            )
+        return agent_output
+
     def is_generation_confident(
         self,
         history: ChatMessageHistory,
@@ -119,7 +403,39 @@ class OpenAIFunctionsAgent(BaseAgent):
             agent_output: the output from the agent
             min_confidence: minimum confidence score to be considered as confident
         """
+        message = self._format_confidence_prompt(history, agent_output)
+        full_output: Generation = self.llm.generate([message], self.tools).generations[
+            0
+        ]
+
+        estimated_confidence = self.output_parser.parse_estimated_confidence(
+            full_output.message
+        )
+
+        return estimated_confidence >= min_confidence
+
+    async def ais_generation_confident(
+        self,
+        history: ChatMessageHistory,
+        agent_output: Union[AgentAction, AgentFinish],
+        min_confidence: int = 3,
+    ) -> bool:
+        message = self._format_confidence_prompt(history, agent_output)
+        full_output: Generation = (
+            await self.llm.agenerate([message], self.tools)
+        ).generations[0]
+
+        estimated_confidence = self.output_parser.parse_estimated_confidence(
+            full_output.message
+        )
+
+        return estimated_confidence >= min_confidence
 
+    def _format_confidence_prompt(
+        self,
+        history: ChatMessageHistory,
+        agent_output: Union[AgentAction, AgentFinish],
+    ) -> UserMessage:
         def _format_assistant_message(action_output: Union[AgentAction, AgentFinish]):
             if isinstance(action_output, AgentFinish):
                 assistant_message = f"Assistant: {action_output.message}"
@@ -132,19 +448,9 @@ class OpenAIFunctionsAgent(BaseAgent):
 
         prompt = Template(ESTIMATE_CONFIDENCE_PROMPT).substitute(
             policy=self.prompt,
-            conversation_history=history.format_message(),
+            conversation_history=history.windowed().format_message(),
             assistant_message=_format_assistant_message(agent_output),
         )
         logger.info(f"\nEstimate confidence prompt: {prompt} \n")
 
-        message = UserMessage(content=prompt)
-
-        full_output: Generation = self.llm.generate([message], self.tools).generations[
-            0
-        ]
-
-        estimated_confidence = self.output_parser.parse_estimated_confidence(
-            full_output.message
-        )
-
-        return estimated_confidence >= min_confidence
+        return UserMessage(content=prompt)
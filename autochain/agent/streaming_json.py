@@ -0,0 +1,190 @@
+"""Incremental parsing of JSON objects streamed by models"""
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+Path = Tuple[Union[str, int], ...]
+
+WHITESPACE = " \t\n\r"
+ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class _Frame:
+    """Container being parsed, with the key its next value is assigned to"""
+
+    def __init__(self, container: Union[Dict[str, Any], List[Any]], path: Path):
+        self.container = container
+        self.path = path
+        self.key: Optional[str] = None
+
+    @property
+    def next_path(self) -> Path:
+        if isinstance(self.container, dict):
+            return self.path + (self.key,)
+        return self.path + (len(self.container),)
+
+
+class StreamingJSONParser:
+    """
+    Parse a JSON object from text deltas as they are generated, so fields that are
+    complete could be used before the model finishes. Text before the first opening brace,
+    such as code fences, and after the object is closed is ignored. Parsing stops without
+    raising if text is not valid JSON, and callers fall back to parsing the full output.
+
+    Example:
+    .. code-block:: python
+
+        parser = StreamingJSONParser()
+        for chunk in llm.stream(messages):
+            for path, delta in parser.feed(chunk.content):
+                if path == ("response",):
+                    print(delta, end="")
+            if parser.is_complete("tool"):
+                tool = parser.get("tool")
+    """
+
+    def __init__(self):
+        self.value: Optional[Dict[str, Any]] = None
+        """Object parsed so far. Containers are added when they open, other values when
+        they are complete"""
+        self.failed = False
+        """Whether text could not be parsed as JSON"""
+        self.done = False
+        """Whether the object is closed"""
+
+        self._completed: Set[Path] = set()
+        self._stack: List[_Frame] = []
+        self._string: Optional[List[str]] = None
+        self._string_is_key = False
+        self._escape: Optional[str] = None
+        self._literal: Optional[List[str]] = None
+
+    def feed(self, text: str) -> List[Tuple[Path, str]]:
+        """
+        Parse the next delta of text. Returns deltas of string values parsed from it with
+        paths of the values
+        """
+        deltas: List[Tuple[Path, str]] = []
+        if self.done or self.failed:
+            return deltas
+
+        try:
+            for char in text:
+                self._feed_char(char, deltas)
+                if self.done:
+                    break
+        except ValueError:
+            self.failed = True
+        return deltas
+
+    def is_complete(self, *path: Union[str, int]) -> bool:
+        """Whether value at the path is fully parsed"""
+        return tuple(path) in self._completed
+
+    def get(self, *path: Union[str, int], default: Any = None) -> Any:
+        """Value at the path parsed so far"""
+        value = self.value
+        for key in path:
+            try:
+                value = value[key]
+            except (KeyError, IndexError, TypeError):
+                return default
+        return value
+
+    def _feed_char(self, char: str, deltas: List[Tuple[Path, str]]) -> None:
+        if self._string is not None:
+            self._feed_string_char(char, deltas)
+            return
+
+        if self._literal is not None:
+            if char not in WHITESPACE and char not in ",}]":
+                self._literal.append(char)
+                return
+            self._add_value(json.loads("".join(self._literal)))
+            self._literal = None
+
+        if char in WHITESPACE:
+            return
+        if not self._stack:
+            # skip text before the object
+            if char == "{":
+                self.value = {}
+                self._stack.append(_Frame(self.value, ()))
+            return
+
+        frame = self._stack[-1]
+        if char in "{[":
+            container = {} if char == "{" else []
+            path = frame.next_path
+            self._add_value(container, complete=False)
+            self._stack.append(_Frame(container, path))
+        elif char in "}]":
+            if (char == "}") != isinstance(frame.container, dict):
+                raise ValueError(f"Unexpected {char}")
+            self._stack.pop()
+            self._completed.add(frame.path)
+            if not self._stack:
+                self.done = True
+        elif char == '"':
+            self._string = []
+            self._string_is_key = (
+                isinstance(frame.container, dict) and frame.key is None
+            )
+        elif char in ",:":
+            return
+        else:
+            self._literal = [char]
+
+    def _feed_string_char(self, char: str, deltas: List[Tuple[Path, str]]) -> None:
+        if self._escape is not None:
+            self._escape += char
+            if self._escape[0] == "u":
+                if len(self._escape) < 5:
+                    return
+                char = chr(int(self._escape[1:], 16))
+            elif char in ESCAPES:
+                char = ESCAPES[char]
+            else:
+                raise ValueError(f"Invalid escape \\{char}")
+            self._escape = None
+        elif char == "\\":
+            self._escape = ""
+            return
+        elif char == '"':
+            string = "".join(self._string)
+            self._string = None
+            if self._string_is_key:
+                self._stack[-1].key = string
+            else:
+                self._add_value(string)
+            return
+
+        self._string.append(char)
+        if not self._string_is_key:
+            path = self._stack[-1].next_path
+            if deltas and deltas[-1][0] == path:
+                deltas[-1] = (path, deltas[-1][1] + char)
+            else:
+                deltas.append((path, char))
+
+    def _add_value(self, value: Any, complete: bool = True) -> None:
+        frame = self._stack[-1]
+        path = frame.next_path
+        if isinstance(frame.container, dict):
+            if frame.key is None:
+                raise ValueError("Value without key")
+            frame.container[frame.key] = value
+            frame.key = None
+        else:
+            frame.container.append(value)
+
+        if complete:
+            self._completed.add(path)
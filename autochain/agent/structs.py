@@ -1,12 +1,19 @@
+import copy
 import json
+import logging
+import threading
 from abc import abstractmethod
-from typing import Any, Dict, List, Union
+from collections import Counter
+from typing import Any, ClassVar, Dict, List, Optional, Tuple, Union
 
+from autochain.agent.json_repair import extract_json_text, repair_json
 from autochain.agent.message import BaseMessage, UserMessage
 from autochain.chain import constants
 from autochain.models.base import Generation
 from autochain.models.chat_openai import ChatOpenAI
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+
+logger = logging.getLogger(__name__)
 
 
 class AgentAction(BaseModel):
@@ -23,6 +30,22 @@ class AgentAction(BaseModel):
     """model response or """
     model_response: str = ""
 
+    # input and output of the tool already run by agent while planning
+    _precomputed: Optional[Tuple[Union[str, dict], str]] = PrivateAttr(default=None)
+
+    def set_precomputed_output(self, tool_output: str) -> None:
+        """Record output of the tool agent ran with the current tool_input while planning"""
+        self._precomputed = (copy.deepcopy(self.tool_input), tool_output)
+
+    def get_precomputed_output(self) -> Optional[str]:
+        """
+        Output of the tool run by agent, or None if it was not run or tool_input changed
+        since, such as after clarification
+        """
+        if self._precomputed is None or self._precomputed[0] != self.tool_input:
+            return None
+        return self._precomputed[1]
+
     @property
     def response(self):
         """message to be stored in memory and shared with next prompt"""
@@ -51,34 +74,65 @@ class AgentFinish(BaseModel):
 
 
 class AgentOutputParser(BaseModel):
+    json_output_counts: ClassVar[Counter] = Counter()
+    """Number of json outputs loaded by each path: parsed directly, repaired locally or
+    fixed by model"""
+    _json_output_counts_lock: ClassVar[threading.Lock] = threading.Lock()
+
     @staticmethod
     def load_json_output(message: BaseMessage) -> Dict[str, Any]:
-        """If the message contains a json response, try to parse it into dictionary"""
-        text = message.content
-        clean_text = ""
-
-        try:
-            clean_text = text[text.index("{") : text.rindex("}") + 1].strip()
-            response = json.loads(clean_text)
-        except Exception:
-            llm = ChatOpenAI(temperature=0)
-            message = [
-                UserMessage(
-                    content=f"""Fix the following json into correct format
+        """
+        If the message contains a json response, try to parse it into dictionary. Malformed
+        json is repaired locally first, and only fixed by model if that does not work
+        """
+        clean_text = extract_json_text(message.content)
+
+        response = AgentOutputParser._loads_dict(clean_text)
+        if response is not None:
+            AgentOutputParser._count_json_output("parsed")
+            return response
+
+        response = AgentOutputParser._loads_dict(repair_json(clean_text))
+        if response is not None:
+            AgentOutputParser._count_json_output("repaired")
+            return response
+
+        logger.warning(f"Could not repair json output locally: {clean_text}")
+
+        llm = ChatOpenAI(temperature=0)
+        message = [
+            UserMessage(
+                content=f"""Fix the following json into correct format
 ```json
 {clean_text}
 ```
 """
-                )
-            ]
-            full_output: Generation = llm.generate(message).generations[0]
-            response = json.loads(full_output.message.content)
-
+            )
+        ]
+        full_output: Generation = llm.generate(message).generations[0]
+        response = json.loads(full_output.message.content)
+        AgentOutputParser._count_json_output("llm_fixed")
         return response
 
+    @staticmethod
+    def _loads_dict(text: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = json.loads(text)
+        except ValueError:
+            return None
+        return response if isinstance(response, dict) else None
+
+    @staticmethod
+    def _count_json_output(path: str) -> None:
+        with AgentOutputParser._json_output_counts_lock:
+            AgentOutputParser.json_output_counts[path] += 1
+
     @abstractmethod
-    def parse(self, message: BaseMessage) -> Union[AgentAction, AgentFinish]:
-        """Parse text into agent action/finish."""
+    def parse(
+        self, message: BaseMessage
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
+        """Parse text into agent action/finish. Agent could also plan a list of independent
+        actions to be taken at the same time"""
 
     def parse_clarification(
         self, message: BaseMessage, agent_action: AgentAction
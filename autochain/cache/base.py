@@ -0,0 +1,58 @@
+"""Base interface for caching responses of language models"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+from pydantic import BaseModel, PrivateAttr
+
+
+class BaseCache(BaseModel, ABC):
+    """Base interface for caching responses of identical requests to language models."""
+
+    ttl: Optional[int] = None
+    """Number of seconds before a cached response expires. Never expires if not set"""
+
+    hits: int = 0
+    """Number of lookups found in cache"""
+    misses: int = 0
+    """Number of lookups not found in cache"""
+
+    _stats_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    class Config:
+        """Configuration for this pydantic object."""
+
+        # models sharing a cache should update the same cache and counters
+        copy_on_model_validation = "none"
+
+    @staticmethod
+    def get_cache_key(**kwargs: Any) -> str:
+        """Canonical hash of request parameters"""
+        serialized = json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Optional[Any]:
+        """Return cached response, or None if not found"""
+        value = self._lookup(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    @abstractmethod
+    def _lookup(self, key: str) -> Optional[Any]:
+        """Return cached response from storage, or None if not found or expired"""
+
+    @abstractmethod
+    def update(self, key: str, value: Any) -> None:
+        """Save response to cache"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Clear cache contents."""
@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from pydantic import PrivateAttr
+
+from autochain.cache.base import BaseCache
+
+
+class InMemoryCache(BaseCache):
+    """LRU cache storing responses in RAM"""
+
+    max_size: int = 1000
+    """Maximum number of responses to keep, least recently used ones are evicted first"""
+
+    _cache: "OrderedDict[str, Tuple[Optional[float], Any]]" = PrivateAttr(
+        default_factory=OrderedDict
+    )
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _lookup(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key not in self._cache:
+                return None
+
+            expire_at, value = self._cache[key]
+            if expire_at is not None and expire_at < time.time():
+                del self._cache[key]
+                return None
+
+            self._cache.move_to_end(key)
+            return value
+
+    def update(self, key: str, value: Any) -> None:
+        expire_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._cache[key] = (expire_at, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,42 @@
+import json
+from typing import Any, Optional
+
+from redis import Redis
+
+from autochain.cache.base import BaseCache
+
+CLEAR_BATCH_SIZE = 500
+
+
+class RedisCache(BaseCache):
+    """Cache storing responses in redis, which could be shared by multiple server instances"""
+
+    redis_client: Redis
+    redis_key_prefix: str = "autochain:llm_cache"
+
+    class Config:
+        """Configuration for this pydantic object."""
+
+        arbitrary_types_allowed = True
+
+    def _lookup(self, key: str) -> Optional[Any]:
+        value = self.redis_client.get(f"{self.redis_key_prefix}:{key}")
+        if not value:
+            return None
+        return json.loads(value)
+
+    def update(self, key: str, value: Any) -> None:
+        self.redis_client.set(
+            f"{self.redis_key_prefix}:{key}", json.dumps(value), ex=self.ttl
+        )
+
+    def clear(self) -> None:
+        # unlink keys in batches as they are scanned, instead of a round trip per key
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for key in self.redis_client.scan_iter(
+            match=f"{self.redis_key_prefix}:*", count=CLEAR_BATCH_SIZE
+        ):
+            pipeline.unlink(key)
+            if len(pipeline) >= CLEAR_BATCH_SIZE:
+                pipeline.execute()
+        pipeline.execute()
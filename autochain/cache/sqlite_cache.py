@@ -0,0 +1,52 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from pydantic import PrivateAttr
+
+from autochain.cache.base import BaseCache
+
+
+class SQLiteCache(BaseCache):
+    """Cache storing responses in a local SQLite database, which persists across runs"""
+
+    database_path: str = ".autochain_cache.db"
+
+    _connection: sqlite3.Connection = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._connection = sqlite3.connect(self.database_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, value TEXT, expire_at REAL)"
+            )
+
+    def _lookup(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expire_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        value, expire_at = row
+        if expire_at is not None and expire_at < time.time():
+            return None
+        return json.loads(value)
+
+    def update(self, key: str, value: Any) -> None:
+        expire_at = time.time() + self.ttl if self.ttl else None
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expire_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expire_at),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM llm_cache")
@@ -4,8 +4,7 @@ Base interface that all chains should implement
 import logging
 import time
 from abc import ABC, abstractmethod
-from copy import deepcopy
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Union
 
 from autochain.agent.base_agent import BaseAgent
 from autochain.agent.message import ChatMessageHistory, MessageType
@@ -13,6 +12,7 @@ from autochain.agent.structs import AgentAction, AgentFinish
 from autochain.chain import constants
 from autochain.memory.base import BaseMemory
 from autochain.tools.base import Tool
+from autochain.utils import run_in_executor
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
@@ -37,17 +37,39 @@ class BaseChain(BaseModel, ABC):
             constants.INTERMEDIATE_STEPS: [],
         }
         if self.memory is not None:
-            intermediate_steps = self.memory.load_memory(
-                constants.INTERMEDIATE_STEPS, []
+            conversation, intermediate_steps = self.memory.save_conversation_and_load(
+                message=user_query,
+                message_type=MessageType.UserMessage,
+                key=constants.INTERMEDIATE_STEPS,
+                default=[],
             )
-            self.memory.save_conversation(
-                message=user_query, message_type=MessageType.UserMessage
+
+            inputs[constants.CONVERSATION_HISTORY] = self._set_history_window(
+                conversation.snapshot()
             )
+            inputs[constants.INTERMEDIATE_STEPS] = list(intermediate_steps)
 
-            inputs[constants.CONVERSATION_HISTORY] = deepcopy(
-                self.memory.load_conversation()
+        return inputs
+
+    async def aprep_inputs(self, user_query: str) -> Dict[str, str]:
+        """Async version of prep_inputs."""
+        inputs = {
+            constants.CONVERSATION_HISTORY: ChatMessageHistory(),
+            constants.INTERMEDIATE_STEPS: [],
+        }
+        if self.memory is not None:
+            loaded = await self.memory.asave_conversation_and_load(
+                message=user_query,
+                message_type=MessageType.UserMessage,
+                key=constants.INTERMEDIATE_STEPS,
+                default=[],
             )
-            inputs[constants.INTERMEDIATE_STEPS] = deepcopy(intermediate_steps)
+            conversation, intermediate_steps = loaded
+
+            inputs[constants.CONVERSATION_HISTORY] = await self._aset_history_window(
+                conversation.snapshot()
+            )
+            inputs[constants.INTERMEDIATE_STEPS] = list(intermediate_steps)
 
         return inputs
 
@@ -60,11 +82,32 @@ class BaseChain(BaseModel, ABC):
         """Save conversation into memory and prep outputs."""
         output_dict = output.format_output()
         if self.memory is not None:
-            self.memory.save_conversation(
-                message=output.message, message_type=MessageType.AIMessage
+            self.memory.save_conversation_and_memory(
+                message=output.message,
+                message_type=MessageType.AIMessage,
+                key=constants.INTERMEDIATE_STEPS,
+                value=output.intermediate_steps,
             )
-            self.memory.save_memory(
-                key=constants.INTERMEDIATE_STEPS, value=output.intermediate_steps
+
+        if return_only_outputs:
+            return output_dict
+        else:
+            return {**inputs, **output_dict}
+
+    async def aprep_output(
+        self,
+        inputs: Dict[str, str],
+        output: AgentFinish,
+        return_only_outputs: bool = False,
+    ) -> Dict[str, Any]:
+        """Async version of prep_output."""
+        output_dict = output.format_output()
+        if self.memory is not None:
+            await self.memory.asave_conversation_and_memory(
+                message=output.message,
+                message_type=MessageType.AIMessage,
+                key=constants.INTERMEDIATE_STEPS,
+                value=output.intermediate_steps,
             )
 
         if return_only_outputs:
@@ -96,6 +139,50 @@ class BaseChain(BaseModel, ABC):
 
         return self.prep_output(inputs, output, return_only_outputs)
 
+    async def arun(
+        self,
+        user_query: str,
+        return_only_outputs: bool = False,
+    ) -> Dict[str, Any]:
+        """Async version of run, so a single event loop could drive many conversations
+        concurrently
+
+        Args:
+            user_query: user query
+            return_only_outputs: boolean for whether to return only outputs in the
+                response. If True, only new keys generated by this chain will be
+                returned. If False, both input keys and new keys generated by this
+                chain will be returned. Defaults to False.
+
+        """
+        inputs = await self.aprep_inputs(user_query)
+        logger.info(f"\n Input to agent: {inputs}")
+        try:
+            output = await self._arun(inputs)
+        except (KeyboardInterrupt, Exception) as e:
+            raise e
+
+        return await self.aprep_output(inputs, output, return_only_outputs)
+
+    def stream(self, user_query: str) -> Iterator[str]:
+        """Stream the response to user query. Tokens of the final message are yielded as soon
+        as agent is known to respond with AgentFinish, and the concatenation of yielded tokens
+        is the final message. Memory is updated the same way as run
+
+        Args:
+            user_query: user query
+        """
+        inputs = self.prep_inputs(user_query)
+        logger.info(f"\n Input to agent: {inputs}")
+        output = None
+        for item in self._stream(inputs):
+            if isinstance(item, str):
+                yield item
+            else:
+                output = item
+
+        self.prep_output(inputs, output)
+
     def _run(
         self,
         inputs: Dict[str, Any],
@@ -117,15 +204,7 @@ class BaseChain(BaseModel, ABC):
         # We now enter the agent loop (until it returns something).
         while self._should_continue(iterations, time_elapsed):
             logger.info(f"\n Intermediate steps: {intermediate_steps}\n")
-            next_step_output = self.should_answer(inputs=inputs)
-
-            # if next_step_output is None which means should ask agent to answer and take next
-            # step
-            if not next_step_output:
-                next_step_output = self.take_next_step(
-                    name_to_tool_map,
-                    inputs,
-                )
+            next_step_output = self._next_step(name_to_tool_map, inputs)
 
             if isinstance(next_step_output, AgentFinish):
                 next_step_output.intermediate_steps = intermediate_steps
@@ -133,39 +212,215 @@ class BaseChain(BaseModel, ABC):
 
             # stores action output into the conversation as FunctionMessage, which can be used by
             # OpenAIFunctionsAgent
-            if isinstance(next_step_output, AgentAction):
-                self.memory.save_conversation(
-                    message=str(next_step_output.tool_output),
-                    name=next_step_output.tool,
-                    conversational_message=f"{next_step_output.tool} with input: "
-                    f"{next_step_output.tool_input}",
-                    message_type=MessageType.FunctionMessage,
-                )
+            # agent could take multiple actions in one step
+            actions = self._to_actions(next_step_output)
+            for action in actions:
+                self.memory.save_conversation(**self._format_function_message(action))
 
-            intermediate_steps.append(next_step_output)
+            intermediate_steps.extend(actions)
             # update inputs
             inputs[constants.INTERMEDIATE_STEPS] = intermediate_steps
-            inputs[constants.CONVERSATION_HISTORY] = self.memory.load_conversation()
+            inputs[constants.CONVERSATION_HISTORY] = self._set_history_window(
+                self.memory.load_conversation()
+            )
 
             iterations += 1
             time_elapsed = time.time() - start_time
 
         # force the termination when shouldn't continue
-        output = AgentFinish(
+        return self._stopped_output(intermediate_steps)
+
+    def _stream(
+        self,
+        inputs: Dict[str, Any],
+    ) -> Iterator[Union[str, AgentFinish]]:
+        """Streaming version of _run. Yields tokens of the final message and then the
+        AgentFinish as the last item"""
+        name_to_tool_map = {tool.name: tool for tool in self.agent.tools}
+
+        intermediate_steps: List[AgentAction] = inputs[constants.INTERMEDIATE_STEPS]
+
+        iterations = 0
+        time_elapsed = 0.0
+        start_time = time.time()
+        while self._should_continue(iterations, time_elapsed):
+            logger.info(f"\n Intermediate steps: {intermediate_steps}\n")
+            next_step_output = self.should_answer(inputs=inputs)
+            has_streamed = False
+
+            if not next_step_output:
+                for item in self.stream_next_step(name_to_tool_map, inputs):
+                    if isinstance(item, str):
+                        has_streamed = True
+                        yield item
+                    else:
+                        next_step_output = item
+
+            if isinstance(next_step_output, AgentFinish):
+                next_step_output.intermediate_steps = intermediate_steps
+                # responses not generated by streaming, such as clarifying question, are
+                # delivered as a whole
+                if not has_streamed:
+                    yield next_step_output.message
+                yield next_step_output
+                return
+
+            # agent could take multiple actions in one step
+            actions = self._to_actions(next_step_output)
+            for action in actions:
+                self.memory.save_conversation(**self._format_function_message(action))
+
+            intermediate_steps.extend(actions)
+            inputs[constants.INTERMEDIATE_STEPS] = intermediate_steps
+            inputs[constants.CONVERSATION_HISTORY] = self._set_history_window(
+                self.memory.load_conversation()
+            )
+
+            iterations += 1
+            time_elapsed = time.time() - start_time
+
+        output = self._stopped_output(intermediate_steps)
+        yield output.message
+        yield output
+
+    async def _arun(
+        self,
+        inputs: Dict[str, Any],
+    ) -> AgentFinish:
+        """Async version of _run"""
+        name_to_tool_map = {tool.name: tool for tool in self.agent.tools}
+
+        intermediate_steps: List[AgentAction] = inputs[constants.INTERMEDIATE_STEPS]
+
+        iterations = 0
+        time_elapsed = 0.0
+        start_time = time.time()
+        while self._should_continue(iterations, time_elapsed):
+            logger.info(f"\n Intermediate steps: {intermediate_steps}\n")
+            next_step_output = await self._anext_step(name_to_tool_map, inputs)
+
+            if isinstance(next_step_output, AgentFinish):
+                next_step_output.intermediate_steps = intermediate_steps
+                return next_step_output
+
+            actions = self._to_actions(next_step_output)
+            for action in actions:
+                await self.memory.asave_conversation(
+                    **self._format_function_message(action)
+                )
+
+            intermediate_steps.extend(actions)
+            inputs[constants.INTERMEDIATE_STEPS] = intermediate_steps
+            inputs[constants.CONVERSATION_HISTORY] = await self._aset_history_window(
+                await self.memory.aload_conversation()
+            )
+
+            iterations += 1
+            time_elapsed = time.time() - start_time
+
+        return self._stopped_output(intermediate_steps)
+
+    def _next_step(
+        self,
+        name_to_tool_map: Dict[str, Tool],
+        inputs: Dict[str, Any],
+    ) -> Union[AgentFinish, AgentAction, List[AgentAction]]:
+        """Check if agent should answer the query before taking the next step"""
+        next_step_output = self.should_answer(inputs=inputs)
+
+        # if next_step_output is None which means should ask agent to answer and take next
+        # step
+        if not next_step_output:
+            next_step_output = self.take_next_step(
+                name_to_tool_map,
+                inputs,
+            )
+        return next_step_output
+
+    async def _anext_step(
+        self,
+        name_to_tool_map: Dict[str, Tool],
+        inputs: Dict[str, Any],
+    ) -> Union[AgentFinish, AgentAction, List[AgentAction]]:
+        """Async version of _next_step"""
+        next_step_output = await self.ashould_answer(inputs=inputs)
+
+        if not next_step_output:
+            next_step_output = await self.atake_next_step(
+                name_to_tool_map,
+                inputs,
+            )
+        return next_step_output
+
+    @staticmethod
+    def _to_actions(
+        next_step_output: Union[AgentAction, List[AgentAction]]
+    ) -> List[AgentAction]:
+        if isinstance(next_step_output, list):
+            return next_step_output
+        return [next_step_output]
+
+    def _set_history_window(self, history: ChatMessageHistory) -> ChatMessageHistory:
+        """Let agents apply history window policy of memory when formatting prompts"""
+        history.set_window(self.memory.history_window, self.memory)
+        return history
+
+    async def _aset_history_window(
+        self, history: ChatMessageHistory
+    ) -> ChatMessageHistory:
+        """
+        Async version of _set_history_window, which also applies the window without
+        blocking the event loop, before agents format prompts with the windowed history
+        """
+        history = self._set_history_window(history)
+        await history.awindowed()
+        return history
+
+    @staticmethod
+    def _format_function_message(action: AgentAction) -> Dict[str, Any]:
+        """stores action output into the conversation as FunctionMessage, which can be used by
+        OpenAIFunctionsAgent"""
+        return {
+            "message": str(action.tool_output),
+            "name": action.tool,
+            "conversational_message": f"{action.tool} with input: {action.tool_input}",
+            "message_type": MessageType.FunctionMessage,
+        }
+
+    @staticmethod
+    def _stopped_output(intermediate_steps: List[AgentAction]) -> AgentFinish:
+        return AgentFinish(
             message="Agent stopped due to iteration limit or time limit.",
             log="",
             intermediate_steps=intermediate_steps,
         )
-        return output
 
     @abstractmethod
     def take_next_step(
         self,
         name_to_tool_map: Dict[str, Tool],
         inputs: Dict[str, str],
-    ) -> (AgentFinish, AgentAction):
+    ) -> Union[AgentFinish, AgentAction, List[AgentAction]]:
         """How agent determines the next step after observing the inputs and intermediate
-        steps"""
+        steps. Agent could take a list of independent actions in one step"""
+
+    def stream_next_step(
+        self,
+        name_to_tool_map: Dict[str, Tool],
+        inputs: Dict[str, str],
+    ) -> Iterator[Union[str, AgentFinish, AgentAction, List[AgentAction]]]:
+        """Streaming version of take_next_step. Yields tokens of the response to user if
+        supported, then the AgentFinish or AgentAction as the last item"""
+        yield self.take_next_step(name_to_tool_map, inputs)
+
+    async def atake_next_step(
+        self,
+        name_to_tool_map: Dict[str, Tool],
+        inputs: Dict[str, str],
+    ) -> Union[AgentFinish, AgentAction, List[AgentAction]]:
+        """Async version of take_next_step. Chains without native async support run
+        take_next_step in the default executor"""
+        return await run_in_executor(self.take_next_step, name_to_tool_map, inputs)
 
     def _should_continue(self, iterations: int, time_elapsed: float) -> bool:
         if self.max_iterations is not None and iterations >= self.max_iterations:
@@ -191,11 +446,25 @@ class BaseChain(BaseModel, ABC):
         """
         output = None
         # check if agent should answer this query
-        last_query = (
-            inputs[constants.CONVERSATION_HISTORY].get_latest_user_message().content
-        )
-        if self.last_query != last_query:
+        if self._is_new_query(inputs):
             output = self.agent.should_answer(**inputs)
-            self.last_query = last_query
+            self.last_query = self._get_latest_user_query(inputs)
 
         return output
+
+    async def ashould_answer(self, inputs) -> Optional[AgentFinish]:
+        """Async version of should_answer"""
+        output = None
+        if self._is_new_query(inputs):
+            output = await self.agent.ashould_answer(**inputs)
+            self.last_query = self._get_latest_user_query(inputs)
+
+        return output
+
+    def _is_new_query(self, inputs) -> bool:
+        """should_answer is only checked once for each new user query"""
+        return self.last_query != self._get_latest_user_query(inputs)
+
+    @staticmethod
+    def _get_latest_user_query(inputs) -> str:
+        return inputs[constants.CONVERSATION_HISTORY].get_latest_user_message().content
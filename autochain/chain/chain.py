@@ -1,12 +1,15 @@
 """Default implementation of Chain"""
+import asyncio
 import logging
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Union
 
 from autochain.agent.structs import AgentAction, AgentFinish
 from autochain.chain.base_chain import BaseChain
 from autochain.errors import ToolRunningError
 from autochain.tools.base import Tool
 from autochain.tools.simple_handoff.tool import HandOffToAgent
+from pydantic import PrivateAttr
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +24,23 @@ class Chain(BaseChain):
     return_intermediate_steps: bool = False
     handle_parsing_errors = True
     graceful_exit_tool: Tool = HandOffToAgent()
+    max_parallel_tools: int = 4
+    """Maximum number of tools to run concurrently when agent plans multiple actions at once"""
+    cancel_planning_early: bool = False
+    """Stop the planning completion as soon as agent yields planned actions, which saves
+    completion tokens and latency of the output generated after tool call, such as the
+    response of ConversationalAgent. Only applies to agents planning early, whose planning
+    is then streamed for models with streaming enabled. Actions planned this way have no
+    model_response, so repeated actions exit gracefully instead of responding with it"""
+    speculative_planning: bool = False
+    """Plan the next step in parallel with should_answer for a new user query, so their
+    latencies are not added up. The plan is discarded if agent should not answer"""
+
+    # runs planning in the background of streaming and speculative planning; a discarded
+    # plan could still be running, so the next step should not wait for its worker
+    _planning_executor: ThreadPoolExecutor = PrivateAttr(
+        default_factory=lambda: ThreadPoolExecutor(max_workers=2)
+    )
 
     def handle_repeated_action(self, agent_action: AgentAction) -> AgentFinish:
         print(
@@ -44,7 +64,7 @@ class Chain(BaseChain):
         self,
         name_to_tool_map: Dict[str, Tool],
         inputs: Dict[str, str],
-    ) -> (AgentFinish, AgentAction):
+    ) -> Union[AgentFinish, AgentAction, List[AgentAction]]:
         """
         How agent determines the next step after observing the inputs and intermediate steps
         Args:
@@ -53,24 +73,87 @@ class Chain(BaseChain):
                 tools outputs
 
         Returns:
-            Either AgentFinish to respond to user or AgentAction to take the next action
+            Either AgentFinish to respond to user or AgentAction to take the next action.
+            Independent actions planned at the same time are run concurrently
         """
 
+        output = self._plan(inputs)
+        return self._process_planned_output(name_to_tool_map, output, inputs)
+
+    def stream_next_step(
+        self,
+        name_to_tool_map: Dict[str, Tool],
+        inputs: Dict[str, str],
+    ) -> Iterator[Union[str, AgentFinish, AgentAction, List[AgentAction]]]:
+        """
+        Streaming version of take_next_step, which forwards tokens of the response to user
+        as soon as agent is known to respond with AgentFinish. Planned output is processed as
+        soon as agent yields it, so tools start running while the rest of the completion is
+        generated, or the completion is cancelled if cancel_planning_early is set
+        """
+        output_future = None
+        full_output = None
+        plan_stream = self.agent.stream_plan(**inputs)
         try:
-            # Call the LLM to see what to do.
-            output = self.agent.plan(
-                **inputs,
-            )
+            for item in plan_stream:
+                if isinstance(item, str):
+                    yield item
+                elif output_future is None:
+                    output_future = self._planning_executor.submit(
+                        self._process_planned_output, name_to_tool_map, item, inputs
+                    )
+                    if self.cancel_planning_early and self.agent.plans_early:
+                        break
+                else:
+                    # full planned output after actions were yielded early
+                    full_output = item
         except Exception as e:
-            if not self.handle_parsing_errors:
-                raise e
-            tool_output = f"Invalid or incomplete response due to {e}"
-            print(tool_output)
-            output = AgentFinish(message=self.graceful_exit_tool.run(), log=tool_output)
-            return output
+            if output_future is None:
+                yield self._handle_planning_error(e)
+                return
+            # planned output is already being processed
+            logger.warning(f"Failed to finish streaming planning output: {e}")
+        finally:
+            plan_stream.close()
+
+        if output_future is None:
+            raise ValueError("Agent did not plan the next step")
+        output = output_future.result()
+        if full_output is not None:
+            # actions are only updated once they are processed
+            self._add_model_response(output, full_output)
+        yield output
 
+    def _add_model_response(
+        self,
+        output: Union[AgentAction, AgentFinish, List[AgentAction]],
+        full_output: Union[AgentAction, AgentFinish, List[AgentAction]],
+    ) -> None:
+        """Add model_response generated after actions were planned to the actions"""
+        if isinstance(output, AgentFinish) or isinstance(full_output, AgentFinish):
+            return
+        for action, full_action in zip(
+            self._to_actions(output), self._to_actions(full_output)
+        ):
+            if action.tool == full_action.tool:
+                action.model_response = full_action.model_response
+
+    def _process_planned_output(
+        self,
+        name_to_tool_map: Dict[str, Tool],
+        output: Union[AgentAction, AgentFinish, List[AgentAction]],
+        inputs: Dict[str, str],
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
         if isinstance(output, AgentAction):
             output = self.agent.clarify_args_for_agent_action(output, **inputs)
+        elif isinstance(output, list):
+            actions = []
+            for action in output:
+                action = self.agent.clarify_args_for_agent_action(action, **inputs)
+                if isinstance(action, AgentFinish):
+                    return action
+                actions.append(action)
+            return self._execute_actions(name_to_tool_map, actions)
 
         # If agent plans to respond to AgentFinish or there is a clarifying question, respond to
         # user by returning AgentFinish
@@ -78,37 +161,327 @@ class Chain(BaseChain):
             return output
 
         if isinstance(output, AgentAction):
-            tool_output = ""
-            # Check if tool is supported
-            if output.tool in name_to_tool_map:
-                tool = name_to_tool_map[output.tool]
-
-                # how to handle the case where same action with same input is taken before
-                if output.tool_input == self.memory.load_memory(tool.name):
-                    return self.handle_repeated_action(output)
-
-                self.memory.save_memory(tool.name, output.tool_input)
-                # We then call the tool on the tool input to get an tool_output
-                try:
-                    tool_output = tool.run(output.tool_input)
-                except ToolRunningError as e:
-                    new_agent_action = self.agent.fix_action_input(
-                        tool, output, error=str(e)
-                    )
-                    if (
-                        new_agent_action
-                        and new_agent_action.tool_input != output.tool_input
-                    ):
-                        tool_output = tool.run(output.tool_input)
-
-                print(
-                    f"Took action '{tool.name}' with inputs '{output.tool_input}', "
-                    f"and the tool_output is {tool_output}"
-                )
-            else:
-                tool_output = f"Tool {output.tool} if not supported"
+            return self._execute_action(name_to_tool_map, output)
+        else:
+            raise ValueError(f"Unsupported action: {type(output)}")
+
+    async def atake_next_step(
+        self,
+        name_to_tool_map: Dict[str, Tool],
+        inputs: Dict[str, str],
+    ) -> Union[AgentFinish, AgentAction, List[AgentAction]]:
+        """Async version of take_next_step"""
+        output = await self._aplan(inputs)
+        return await self._aprocess_planned_output(name_to_tool_map, output, inputs)
 
-            output.tool_output = tool_output
+    def _next_step(
+        self,
+        name_to_tool_map: Dict[str, Tool],
+        inputs: Dict[str, Any],
+    ) -> Union[AgentFinish, AgentAction, List[AgentAction]]:
+        if not self.speculative_planning or not self._is_new_query(inputs):
+            return super()._next_step(name_to_tool_map, inputs)
+
+        plan_future = self._planning_executor.submit(self._plan, inputs)
+        try:
+            should_answer_output = self.should_answer(inputs=inputs)
+            if should_answer_output:
+                return should_answer_output
+            output = plan_future.result()
+        finally:
+            # discard the plan without waiting for it, which is a no-op once it is done
+            plan_future.cancel()
+
+        return self._process_planned_output(name_to_tool_map, output, inputs)
+
+    async def _anext_step(
+        self,
+        name_to_tool_map: Dict[str, Tool],
+        inputs: Dict[str, Any],
+    ) -> Union[AgentFinish, AgentAction, List[AgentAction]]:
+        if not self.speculative_planning or not self._is_new_query(inputs):
+            return await super()._anext_step(name_to_tool_map, inputs)
+
+        plan_task = asyncio.ensure_future(self._aplan(inputs))
+        try:
+            should_answer_output = await self.ashould_answer(inputs=inputs)
+            if should_answer_output:
+                return should_answer_output
+            output = await plan_task
+        finally:
+            plan_task.cancel()
+
+        return await self._aprocess_planned_output(name_to_tool_map, output, inputs)
+
+    def _plan(
+        self, inputs: Dict[str, str]
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
+        try:
+            if (
+                self.cancel_planning_early
+                and self.agent.plans_early
+                and getattr(self.agent.llm, "streaming", False)
+            ):
+                return self._plan_from_stream(inputs)
+            # Call the LLM to see what to do.
+            return self.agent.plan(
+                **inputs,
+            )
+        except Exception as e:
+            return self._handle_planning_error(e)
+
+    def _plan_from_stream(
+        self, inputs: Dict[str, str]
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
+        """Plan with streamed completion, which is cancelled once the output is planned"""
+        plan_stream = self.agent.stream_plan(**inputs)
+        try:
+            for item in plan_stream:
+                if not isinstance(item, str):
+                    return item
+        finally:
+            plan_stream.close()
+        raise ValueError("Agent did not plan the next step")
+
+    async def _aplan(
+        self, inputs: Dict[str, str]
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
+        try:
+            return await self.agent.aplan(
+                **inputs,
+            )
+        except Exception as e:
+            return self._handle_planning_error(e)
+
+    async def _aprocess_planned_output(
+        self,
+        name_to_tool_map: Dict[str, Tool],
+        output: Union[AgentAction, AgentFinish, List[AgentAction]],
+        inputs: Dict[str, str],
+    ) -> Union[AgentAction, AgentFinish, List[AgentAction]]:
+        if isinstance(output, AgentAction):
+            output = await self.agent.aclarify_args_for_agent_action(output, **inputs)
+        elif isinstance(output, list):
+            actions = await asyncio.gather(
+                *[
+                    self.agent.aclarify_args_for_agent_action(action, **inputs)
+                    for action in output
+                ]
+            )
+            for action in actions:
+                if isinstance(action, AgentFinish):
+                    return action
+            return await self._aexecute_actions(name_to_tool_map, actions)
+
+        if isinstance(output, AgentFinish):
             return output
+
+        if isinstance(output, AgentAction):
+            return await self._aexecute_action(name_to_tool_map, output)
         else:
             raise ValueError(f"Unsupported action: {type(output)}")
+
+    def _handle_planning_error(self, e: Exception) -> AgentFinish:
+        if not self.handle_parsing_errors:
+            raise e
+        tool_output = f"Invalid or incomplete response due to {e}"
+        print(tool_output)
+        return AgentFinish(message=self.graceful_exit_tool.run(), log=tool_output)
+
+    def _execute_action(
+        self, name_to_tool_map: Dict[str, Tool], output: AgentAction
+    ) -> (AgentFinish, AgentAction):
+        """Run the tool selected by agent and store the tool output into the action"""
+        repeated_action_output = self._check_repeated_action(name_to_tool_map, output)
+        if repeated_action_output:
+            return repeated_action_output
+
+        return self._run_action(name_to_tool_map, output)
+
+    def _execute_actions(
+        self, name_to_tool_map: Dict[str, Tool], actions: List[AgentAction]
+    ) -> Union[AgentFinish, List[AgentAction]]:
+        """Run independent tools selected by agent concurrently"""
+        repeated_action_output = self._check_repeated_actions(name_to_tool_map, actions)
+        if repeated_action_output:
+            return repeated_action_output
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel_tools) as executor:
+            return list(
+                executor.map(
+                    lambda action: self._run_action(name_to_tool_map, action), actions
+                )
+            )
+
+    async def _aexecute_action(
+        self, name_to_tool_map: Dict[str, Tool], output: AgentAction
+    ) -> (AgentFinish, AgentAction):
+        """Async version of _execute_action"""
+        repeated_action_output = await self._acheck_repeated_action(
+            name_to_tool_map, output
+        )
+        if repeated_action_output:
+            return repeated_action_output
+
+        return await self._arun_action(name_to_tool_map, output)
+
+    async def _aexecute_actions(
+        self, name_to_tool_map: Dict[str, Tool], actions: List[AgentAction]
+    ) -> Union[AgentFinish, List[AgentAction]]:
+        """Async version of _execute_actions"""
+        repeated_action_output = await self._acheck_repeated_actions(
+            name_to_tool_map, actions
+        )
+        if repeated_action_output:
+            return repeated_action_output
+
+        semaphore = asyncio.Semaphore(self.max_parallel_tools)
+
+        async def _arun_action_with_limit(action: AgentAction) -> AgentAction:
+            async with semaphore:
+                return await self._arun_action(name_to_tool_map, action)
+
+        return list(
+            await asyncio.gather(*[_arun_action_with_limit(a) for a in actions])
+        )
+
+    def _check_repeated_action(
+        self, name_to_tool_map: Dict[str, Tool], output: AgentAction
+    ) -> Optional[AgentFinish]:
+        if output.tool not in name_to_tool_map:
+            return None
+
+        tool = name_to_tool_map[output.tool]
+        # how to handle the case where same action with same input is taken before
+        previous_input = self.memory.replace_memory(tool.name, output.tool_input)
+        if output.tool_input == previous_input:
+            return self.handle_repeated_action(output)
+
+        return None
+
+    async def _acheck_repeated_action(
+        self, name_to_tool_map: Dict[str, Tool], output: AgentAction
+    ) -> Optional[AgentFinish]:
+        if output.tool not in name_to_tool_map:
+            return None
+
+        tool = name_to_tool_map[output.tool]
+        previous_input = await self.memory.areplace_memory(tool.name, output.tool_input)
+        if output.tool_input == previous_input:
+            return self.handle_repeated_action(output)
+
+        return None
+
+    def _check_repeated_actions(
+        self, name_to_tool_map: Dict[str, Tool], actions: List[AgentAction]
+    ) -> Optional[AgentFinish]:
+        """
+        Check all actions before recording their inputs, so inputs of actions are only
+        recorded when they are run
+        """
+        tool_inputs: Dict[str, Any] = {}
+        for action in actions:
+            if action.tool not in name_to_tool_map:
+                continue
+
+            tool_name = name_to_tool_map[action.tool].name
+            if tool_name not in tool_inputs:
+                tool_inputs[tool_name] = self.memory.load_memory(tool_name)
+            if action.tool_input == tool_inputs[tool_name]:
+                return self.handle_repeated_action(action)
+            tool_inputs[tool_name] = action.tool_input
+
+        for tool_name, tool_input in tool_inputs.items():
+            self.memory.save_memory(tool_name, tool_input)
+        return None
+
+    async def _acheck_repeated_actions(
+        self, name_to_tool_map: Dict[str, Tool], actions: List[AgentAction]
+    ) -> Optional[AgentFinish]:
+        """Async version of _check_repeated_actions"""
+        tool_inputs: Dict[str, Any] = {}
+        for action in actions:
+            if action.tool not in name_to_tool_map:
+                continue
+
+            tool_name = name_to_tool_map[action.tool].name
+            if tool_name not in tool_inputs:
+                tool_inputs[tool_name] = await self.memory.aload_memory(tool_name)
+            if action.tool_input == tool_inputs[tool_name]:
+                return self.handle_repeated_action(action)
+            tool_inputs[tool_name] = action.tool_input
+
+        for tool_name, tool_input in tool_inputs.items():
+            await self.memory.asave_memory(tool_name, tool_input)
+        return None
+
+    def _run_action(
+        self, name_to_tool_map: Dict[str, Tool], output: AgentAction
+    ) -> AgentAction:
+        precomputed_output = output.get_precomputed_output()
+        if precomputed_output is not None:
+            # agent already ran the tool with the same input while planning
+            output.tool_output = precomputed_output
+            return output
+
+        tool_output = ""
+        # Check if tool is supported
+        if output.tool in name_to_tool_map:
+            tool = name_to_tool_map[output.tool]
+            # We then call the tool on the tool input to get an tool_output
+            try:
+                tool_output = tool.run(output.tool_input)
+            except ToolRunningError as e:
+                new_agent_action = self.agent.fix_action_input(
+                    tool, output, error=str(e)
+                )
+                if (
+                    new_agent_action
+                    and new_agent_action.tool_input != output.tool_input
+                ):
+                    output.tool_input = new_agent_action.tool_input
+                    tool_output = tool.run(output.tool_input)
+
+            print(
+                f"Took action '{tool.name}' with inputs '{output.tool_input}', "
+                f"and the tool_output is {tool_output}"
+            )
+        else:
+            tool_output = f"Tool {output.tool} if not supported"
+
+        output.tool_output = tool_output
+        return output
+
+    async def _arun_action(
+        self, name_to_tool_map: Dict[str, Tool], output: AgentAction
+    ) -> AgentAction:
+        precomputed_output = output.get_precomputed_output()
+        if precomputed_output is not None:
+            output.tool_output = precomputed_output
+            return output
+
+        tool_output = ""
+        if output.tool in name_to_tool_map:
+            tool = name_to_tool_map[output.tool]
+            try:
+                tool_output = await tool.arun(output.tool_input)
+            except ToolRunningError as e:
+                new_agent_action = await self.agent.afix_action_input(
+                    tool, output, error=str(e)
+                )
+                if (
+                    new_agent_action
+                    and new_agent_action.tool_input != output.tool_input
+                ):
+                    output.tool_input = new_agent_action.tool_input
+                    tool_output = await tool.arun(output.tool_input)
+
+            print(
+                f"Took action '{tool.name}' with inputs '{output.tool_input}', "
+                f"and the tool_output is {tool_output}"
+            )
+        else:
+            tool_output = f"Tool {output.tool} if not supported"
+
+        output.tool_output = tool_output
+        return output
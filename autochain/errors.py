@@ -15,3 +15,15 @@ class ToolRunningError(Exception):
 
     def __init__(self, message):
         self.message = message
+
+
+class PromptTooLongError(Exception):
+    """Exception when prompt exceeds the maximum number of tokens of the model"""
+
+    def __init__(self, num_tokens: int, max_tokens: int):
+        self.num_tokens = num_tokens
+        self.max_tokens = max_tokens
+        self.message = (
+            f"Prompt has {num_tokens} tokens, which exceeds the maximum of {max_tokens}"
+        )
+        super().__init__(self.message)
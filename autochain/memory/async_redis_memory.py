@@ -0,0 +1,136 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+from redis.asyncio import ConnectionPool, Redis
+from redis.asyncio.client import Pipeline
+
+from autochain.agent.message import ChatMessageHistory, MessageType
+from autochain.memory.redis_memory import RedisMemory, SCAN_COUNT
+
+
+class AsyncRedisMemory(RedisMemory):
+    """
+    Store conversation info in redis with redis.asyncio, so chains running with arun do not
+    block the event loop. Sync methods, used by chains running with run, send the same
+    commands with sync_redis_client.
+
+    Example:
+    .. code-block:: python
+
+        pool = ConnectionPool.from_url("redis://localhost:6379")
+        memory = AsyncRedisMemory(redis_key_prefix="conversation_id", connection_pool=pool)
+        await Chain(agent=agent, memory=memory).arun(user_query)
+    """
+
+    redis_client: Optional[Redis] = None
+    connection_pool: Optional[ConnectionPool] = None
+    """Connection pool shared by memories of different conversations, used to create
+    redis_client if it is not provided"""
+    sync_redis_client: Optional[redis.Redis] = None
+    """Client used by sync methods. If it is not provided, it is created on first use with
+    the connection arguments of redis_client, so pass a shared client to share its
+    connections between memories"""
+
+    @classmethod
+    def _create_redis_client(cls, connection_pool: ConnectionPool) -> Redis:
+        return Redis(connection_pool=connection_pool)
+
+    @property
+    def _sync_client(self) -> redis.Redis:
+        if self.sync_redis_client is None:
+            self.sync_redis_client = redis.Redis(
+                **self.redis_client.connection_pool.connection_kwargs
+            )
+        return self.sync_redis_client
+
+    async def aload_memory(
+        self, key: Optional[str] = None, default: Optional[Any] = None, **kwargs
+    ) -> Any:
+        """Get the key's corresponding value from redis."""
+        self._count_round_trip()
+        value = await self.redis_client.get(self._get_key(key))
+        return self._decode_value(value, default)
+
+    async def aload_conversation(
+        self, last_n: Optional[int] = None, **kwargs: Dict[str, Any]
+    ) -> ChatMessageHistory:
+        """Return chat message history, or only its last n messages if last_n is set."""
+        start = -last_n if last_n else 0
+        self._count_round_trip()
+        encoded_messages = await self.redis_client.lrange(
+            self._conversation_key, start, -1
+        )
+        return self._decode_conversation(encoded_messages)
+
+    async def asave_memory(self, key: str, value: Any) -> None:
+        """Save the key value pair to redis."""
+        self._count_round_trip()
+        await self.redis_client.set(
+            self._get_key(key), self._encode_value(value), ex=self.expire_time
+        )
+
+    async def asave_conversation(
+        self, message: str, message_type: MessageType, **kwargs
+    ) -> None:
+        """Append message to the conversation list in redis."""
+        pipeline = self.redis_client.pipeline()
+        self._queue_save_conversation(pipeline, message, message_type, **kwargs)
+        await self._aexecute(pipeline)
+
+    async def asave_conversation_and_load(
+        self,
+        message: str,
+        message_type: MessageType,
+        key: str,
+        default: Optional[Any] = None,
+        **kwargs,
+    ) -> Tuple[ChatMessageHistory, Any]:
+        """Save message, load conversation and value of the key in one round trip."""
+        pipeline = self.redis_client.pipeline()
+        self._queue_save_conversation(pipeline, message, message_type, **kwargs)
+        pipeline.lrange(self._conversation_key, 0, -1)
+        pipeline.get(self._get_key(key))
+        *_, encoded_messages, value = await self._aexecute(pipeline)
+        return (
+            self._decode_conversation(encoded_messages),
+            self._decode_value(value, default),
+        )
+
+    async def asave_conversation_and_memory(
+        self, message: str, message_type: MessageType, key: str, value: Any, **kwargs
+    ) -> None:
+        """Save message and the key value pair in one round trip."""
+        pipeline = self.redis_client.pipeline()
+        self._queue_save_conversation(pipeline, message, message_type, **kwargs)
+        pipeline.set(self._get_key(key), self._encode_value(value), ex=self.expire_time)
+        await self._aexecute(pipeline)
+
+    async def areplace_memory(
+        self, key: str, value: Any, default: Optional[Any] = None
+    ) -> Any:
+        """Save the key value pair and return the previous value in one round trip."""
+        redis_key = self._get_key(key)
+        pipeline = self.redis_client.pipeline()
+        pipeline.get(redis_key)
+        pipeline.set(redis_key, self._encode_value(value), ex=self.expire_time)
+        previous, _ = await self._aexecute(pipeline)
+        return self._decode_value(previous, default)
+
+    async def aclear(self) -> None:
+        """Clear redis memory incrementally with SCAN and UNLINK, without blocking redis."""
+        cursor = 0
+        while True:
+            self._count_round_trip()
+            cursor, keys = await self.redis_client.scan(
+                cursor, match=self._scan_pattern, count=SCAN_COUNT
+            )
+            if keys:
+                self._count_round_trip()
+                await self.redis_client.unlink(*keys)
+            if not cursor:
+                break
+
+    async def _aexecute(self, pipeline: Pipeline) -> List[Any]:
+        """Send all commands queued in the pipeline as a MULTI block in one round trip"""
+        self._count_round_trip()
+        return await pipeline.execute()
@@ -6,17 +6,23 @@ from typing import (
     Any,
     Dict,
     Optional,
+    Tuple,
     Union,
 )
 
 from pydantic import BaseModel
 
 from autochain.agent.message import ChatMessageHistory, MessageType
+from autochain.memory.history_window import BaseHistoryWindow
 
 
 class BaseMemory(BaseModel, ABC):
     """Base interface for memory in chains."""
 
+    history_window: Optional[BaseHistoryWindow] = None
+    """Policy selecting the part of conversation history agents include in prompts.
+    Entire history is included if not set"""
+
     @abstractmethod
     def load_memory(
         self, key: Union[str, None] = None, default: Optional[Any] = None, **kwargs: Any
@@ -40,3 +46,86 @@ class BaseMemory(BaseModel, ABC):
     @abstractmethod
     def clear(self) -> None:
         """Clear memory contents."""
+
+    # Chains use the following combined operations to load and save memory at the start and
+    # the end of each turn. Memories backed by network storage could override them to do
+    # all reads or writes in a single round trip.
+    def save_conversation_and_load(
+        self,
+        message: str,
+        message_type: MessageType,
+        key: str,
+        default: Optional[Any] = None,
+        **kwargs,
+    ) -> Tuple[ChatMessageHistory, Any]:
+        """Save message to conversation, then load conversation and value of the key."""
+        self.save_conversation(message, message_type, **kwargs)
+        return self.load_conversation(), self.load_memory(key, default)
+
+    def save_conversation_and_memory(
+        self, message: str, message_type: MessageType, key: str, value: Any, **kwargs
+    ) -> None:
+        """Save message to conversation and the key value pair."""
+        self.save_conversation(message, message_type, **kwargs)
+        self.save_memory(key, value)
+
+    def replace_memory(
+        self, key: str, value: Any, default: Optional[Any] = None
+    ) -> Any:
+        """Save the key value pair and return the value previously saved under the key."""
+        previous = self.load_memory(key, default)
+        self.save_memory(key, value)
+        return previous
+
+    # Async counterparts default to the sync implementations, which do not block for
+    # in-process memories. Memories backed by network storage should override them.
+    async def aload_memory(
+        self, key: Union[str, None] = None, default: Optional[Any] = None, **kwargs: Any
+    ) -> Any:
+        """Async version of load_memory."""
+        return self.load_memory(key, default, **kwargs)
+
+    async def aload_conversation(self, **kwargs) -> ChatMessageHistory:
+        """Async version of load_conversation."""
+        return self.load_conversation(**kwargs)
+
+    async def asave_memory(self, key: str, value: Any) -> None:
+        """Async version of save_memory."""
+        self.save_memory(key, value)
+
+    async def asave_conversation(
+        self, message: str, message_type: MessageType, **kwargs
+    ) -> None:
+        """Async version of save_conversation."""
+        self.save_conversation(message, message_type, **kwargs)
+
+    async def aclear(self) -> None:
+        """Async version of clear."""
+        self.clear()
+
+    async def asave_conversation_and_load(
+        self,
+        message: str,
+        message_type: MessageType,
+        key: str,
+        default: Optional[Any] = None,
+        **kwargs,
+    ) -> Tuple[ChatMessageHistory, Any]:
+        """Async version of save_conversation_and_load."""
+        await self.asave_conversation(message, message_type, **kwargs)
+        return await self.aload_conversation(), await self.aload_memory(key, default)
+
+    async def asave_conversation_and_memory(
+        self, message: str, message_type: MessageType, key: str, value: Any, **kwargs
+    ) -> None:
+        """Async version of save_conversation_and_memory."""
+        await self.asave_conversation(message, message_type, **kwargs)
+        await self.asave_memory(key, value)
+
+    async def areplace_memory(
+        self, key: str, value: Any, default: Optional[Any] = None
+    ) -> Any:
+        """Async version of replace_memory."""
+        previous = await self.aload_memory(key, default)
+        await self.asave_memory(key, value)
+        return previous
@@ -0,0 +1,193 @@
+"""Serialization of values saved to external memory storage"""
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Type
+
+from pydantic import BaseModel, root_validator
+
+from autochain.agent.message import (
+    AIMessage,
+    FunctionMessage,
+    SystemMessage,
+    UserMessage,
+)
+from autochain.agent.structs import AgentAction, AgentFinish
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMAT_VERSION = 1
+"""Version of the encoded format, stored as the first byte of every encoded value"""
+COMPRESSED_FLAG = 0x01
+MODEL_TYPE_KEY = "__model__"
+
+MODEL_CLASSES: Dict[str, Type[BaseModel]] = {}
+
+
+def register_model(model_class: Type[BaseModel]) -> Type[BaseModel]:
+    """
+    Allow pydantic model to be encoded by codecs. Only registered models are decoded, so
+    stored data cannot create arbitrary objects. Could be used as class decorator.
+    """
+    MODEL_CLASSES[model_class.__name__] = model_class
+    return model_class
+
+
+for _model_class in [
+    UserMessage,
+    AIMessage,
+    SystemMessage,
+    FunctionMessage,
+    AgentAction,
+    AgentFinish,
+]:
+    register_model(_model_class)
+
+
+def model_to_dict(value: Any) -> Dict[str, Any]:
+    """
+    Convert registered pydantic model into a tagged dictionary, skipping fields with default
+    values. Serializers call it for objects they could not serialize natively.
+    """
+    if not isinstance(value, BaseModel):
+        raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+    model_name = type(value).__name__
+    if MODEL_CLASSES.get(model_name) is not type(value):
+        raise TypeError(f"{model_name} is not registered with register_model")
+
+    encoded = {MODEL_TYPE_KEY: model_name}
+    for name, field in value.__fields__.items():
+        field_value = getattr(value, name)
+        if field_value != field.default:
+            encoded[name] = field_value
+    return encoded
+
+
+def dict_to_model(value: Dict[str, Any]) -> Any:
+    """Reverse of model_to_dict, called by deserializers for every decoded dictionary"""
+    model_name = value.pop(MODEL_TYPE_KEY, None)
+    if model_name is None:
+        return value
+
+    model_class = MODEL_CLASSES.get(model_name)
+    if model_class is None:
+        raise ValueError(
+            f"Could not decode {model_name}, which is not registered with register_model"
+        )
+    return model_class.parse_obj(value)
+
+
+def _decode_models(value: Any) -> Any:
+    """Apply dict_to_model to every dictionary from the innermost"""
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if isinstance(v, (dict, list)):
+                value[k] = _decode_models(v)
+        return dict_to_model(value)
+    if isinstance(value, list):
+        return [_decode_models(v) if isinstance(v, (dict, list)) else v for v in value]
+    return value
+
+
+class BaseCodec(BaseModel, ABC):
+    """
+    Encodes values, including messages and agent actions, into versioned bytes. Payloads
+    larger than compression_threshold are compressed with zstd if zstandard is installed.
+    Values are limited to types of JSON: tuples are decoded as lists and sets could not be
+    encoded.
+    """
+
+    compression_threshold: Optional[int] = 4096
+    """Minimum payload size in bytes to compress. Compression is disabled if not set"""
+    compression_level: int = 3
+
+    @abstractmethod
+    def _dumps(self, value: Any) -> bytes:
+        """Serialize value, converting models with model_to_dict"""
+
+    @abstractmethod
+    def _loads(self, payload: bytes) -> Any:
+        """Deserialize value, converting dictionaries with dict_to_model"""
+
+    def encode(self, value: Any) -> bytes:
+        payload = self._dumps(value)
+        flags = 0
+        if (
+            self.compression_threshold is not None
+            and len(payload) >= self.compression_threshold
+            and zstandard is not None
+        ):
+            compressor = zstandard.ZstdCompressor(level=self.compression_level)
+            payload = compressor.compress(payload)
+            flags |= COMPRESSED_FLAG
+
+        return bytes([FORMAT_VERSION, flags]) + payload
+
+    @staticmethod
+    def is_encoded(encoded: bytes) -> bool:
+        """Whether value is encoded in the current format, unlike values pickled before"""
+        return len(encoded) >= 2 and encoded[0] == FORMAT_VERSION
+
+    def decode(self, encoded: bytes) -> Any:
+        if not self.is_encoded(encoded):
+            raise ValueError("Unsupported encoding format")
+
+        payload = encoded[2:]
+        if encoded[1] & COMPRESSED_FLAG:
+            if zstandard is None:
+                raise ImportError(
+                    "Could not import zstandard python package to decompress value. "
+                    "Please install it with `pip install zstandard`."
+                )
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        return self._loads(payload)
+
+
+class JSONCodec(BaseCodec):
+    """Encode values as JSON, using orjson for encoding if it is installed"""
+
+    def _dumps(self, value: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(value, default=model_to_dict)
+        return json.dumps(value, default=model_to_dict, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+    def _loads(self, payload: bytes) -> Any:
+        if orjson is not None:
+            # orjson does not support object_hook, so models are decoded afterwards
+            return _decode_models(orjson.loads(payload))
+        return json.loads(payload, object_hook=dict_to_model)
+
+
+class MsgpackCodec(BaseCodec):
+    """Encode values with msgpack, which is more compact than JSON"""
+
+    @root_validator()
+    def validate_environment(cls, values: Dict) -> Dict:
+        """Validate that msgpack python package exists in environment."""
+        if msgpack is None:
+            raise ImportError(
+                "Could not import msgpack python package. "
+                "Please install it with `pip install msgpack`."
+            )
+        return values
+
+    def _dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=model_to_dict)
+
+    def _loads(self, payload: bytes) -> Any:
+        return msgpack.unpackb(payload, object_hook=dict_to_model)
@@ -0,0 +1,236 @@
+"""Policies limiting how much conversation history is included in prompts"""
+from __future__ import annotations
+
+import threading
+from abc import ABC, abstractmethod
+from string import Template
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, PrivateAttr
+
+from autochain.agent.message import (
+    BaseMessage,
+    ChatMessageHistory,
+    SystemMessage,
+    UserMessage,
+)
+from autochain.models.base import BaseLanguageModel, approximate_token_count
+
+SUMMARY_MEMORY_KEY = "history_summary"
+
+SUMMARIZE_HISTORY_PROMPT_TEMPLATE = """Progressively summarize the conversation between a user \
+and an assistant, adding onto the previous summary and returning a new summary. Keep all \
+details that could be needed to continue the conversation, such as user information, requests \
+and outcomes of actions taken.
+
+Previous summary:
+$summary
+
+New lines of conversation:
+$new_lines
+
+New summary:"""
+
+
+class BaseHistoryWindow(BaseModel, ABC):
+    """
+    Selects the part of conversation history included in prompts. Window is set on memory
+    and applied by agents when they format prompts with ChatMessageHistory.windowed()
+    """
+
+    class Config:
+        """Configuration for this pydantic object."""
+
+        arbitrary_types_allowed = True
+        # window could keep state for the conversation of the memory it is attached to
+        copy_on_model_validation = "none"
+
+    @abstractmethod
+    def apply(
+        self, history: ChatMessageHistory, memory: Optional[Any] = None
+    ) -> ChatMessageHistory:
+        """
+        Return the windowed history. Memory of the conversation is passed to windows that
+        need to keep state across turns
+        """
+
+    async def aapply(
+        self, history: ChatMessageHistory, memory: Optional[Any] = None
+    ) -> ChatMessageHistory:
+        """
+        Async version of apply, used by chains running with arun. Windows calling models or
+        memory should override it, so they do not block the event loop
+        """
+        return self.apply(history, memory=memory)
+
+
+class LastNMessagesWindow(BaseHistoryWindow):
+    """Keep only the last max_messages messages"""
+
+    max_messages: int = 20
+
+    def apply(
+        self, history: ChatMessageHistory, memory: Optional[Any] = None
+    ) -> ChatMessageHistory:
+        if len(history.messages) <= self.max_messages:
+            return history
+        return ChatMessageHistory.construct(
+            messages=history.messages[-self.max_messages :]
+        )
+
+
+class TokenBudgetWindow(BaseHistoryWindow):
+    """
+    Keep the most recent messages fitting in max_tokens. The latest message is always kept
+    """
+
+    max_tokens: int = 2000
+    llm: Optional[BaseLanguageModel] = None
+    """Model whose tokenizer is used to count tokens, e.g. the one agent plans with"""
+    token_counter: Callable[[str], int] = approximate_token_count
+    """Function counting tokens of rendered message, used if llm is not set"""
+
+    def apply(
+        self, history: ChatMessageHistory, memory: Optional[Any] = None
+    ) -> ChatMessageHistory:
+        count_tokens = self.llm.count_text_tokens if self.llm else self.token_counter
+        total_tokens = 0
+        start = len(history.messages)
+        for message in reversed(history.messages):
+            text = ChatMessageHistory.format_single_message(message) or ""
+            total_tokens += count_tokens(text)
+            if total_tokens > self.max_tokens and start < len(history.messages):
+                break
+            start -= 1
+
+        if start == 0:
+            return history
+        return ChatMessageHistory.construct(messages=history.messages[start:])
+
+
+class SummaryWindow(BaseHistoryWindow):
+    """
+    Keep the last max_messages messages and replace earlier ones with a rolling summary
+    generated by llm. Messages are evicted and summarized in batches of summary_batch_size,
+    so summarization does not add a model call to every turn. Summary is cached in memory
+    of the conversation, or in the window itself if no memory is given. Concurrent aapply
+    calls for the same conversation could summarize the same batch twice
+    """
+
+    llm: BaseLanguageModel
+    max_messages: int = 20
+    summary_batch_size: int = 10
+    summary_prompt_template: str = SUMMARIZE_HISTORY_PROMPT_TEMPLATE
+
+    _summary: Dict[str, Any] = PrivateAttr(default_factory=dict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def apply(
+        self, history: ChatMessageHistory, memory: Optional[Any] = None
+    ) -> ChatMessageHistory:
+        with self._lock:
+            summary, new_count = self._get_next_batch(
+                self._load_summary(memory), history
+            )
+            if new_count:
+                summary = {
+                    "summarized_count": new_count,
+                    "summary": self._summarize(summary, history, new_count),
+                }
+                self._save_summary(memory, summary)
+
+        return self._apply_summary(history, summary)
+
+    async def aapply(
+        self, history: ChatMessageHistory, memory: Optional[Any] = None
+    ) -> ChatMessageHistory:
+        summary, new_count = self._get_next_batch(
+            await self._aload_summary(memory), history
+        )
+        if new_count:
+            summary = {
+                "summarized_count": new_count,
+                "summary": await self._asummarize(summary, history, new_count),
+            }
+            await self._asave_summary(memory, summary)
+
+        return self._apply_summary(history, summary)
+
+    def _get_next_batch(
+        self, summary: Dict[str, Any], history: ChatMessageHistory
+    ) -> Tuple[Dict[str, Any], int]:
+        """
+        Summary still valid for the history, and number of messages to summarize up to if
+        the next batch is due, or 0
+        """
+        if summary.get("summarized_count", 0) > len(history.messages):
+            # conversation was cleared
+            summary = {}
+
+        new_count = len(history.messages) - self.max_messages
+        if new_count - summary.get("summarized_count", 0) >= self.summary_batch_size:
+            return summary, new_count
+        return summary, 0
+
+    @staticmethod
+    def _apply_summary(
+        history: ChatMessageHistory, summary: Dict[str, Any]
+    ) -> ChatMessageHistory:
+        summarized_count = summary.get("summarized_count", 0)
+        if not summarized_count:
+            return history
+        return ChatMessageHistory.construct(
+            messages=[
+                SystemMessage(
+                    content=f"Summary of earlier conversation: {summary['summary']}"
+                ),
+                *history.messages[summarized_count:],
+            ]
+        )
+
+    def _summarize(
+        self, summary: Dict[str, Any], history: ChatMessageHistory, new_count: int
+    ) -> str:
+        messages = self._format_summary_messages(summary, history, new_count)
+        return self.llm.generate(messages).generations[0].message.content.strip()
+
+    async def _asummarize(
+        self, summary: Dict[str, Any], history: ChatMessageHistory, new_count: int
+    ) -> str:
+        messages = self._format_summary_messages(summary, history, new_count)
+        result = await self.llm.agenerate(messages)
+        return result.generations[0].message.content.strip()
+
+    def _format_summary_messages(
+        self, summary: Dict[str, Any], history: ChatMessageHistory, new_count: int
+    ) -> List[BaseMessage]:
+        new_messages = history.messages[summary.get("summarized_count", 0) : new_count]
+        new_lines = ChatMessageHistory.construct(messages=new_messages).format_message()
+        prompt = Template(self.summary_prompt_template).substitute(
+            summary=summary.get("summary", ""), new_lines=new_lines
+        )
+        return [UserMessage(content=prompt)]
+
+    def _load_summary(self, memory: Optional[Any]) -> Dict[str, Any]:
+        if memory is None:
+            return self._summary
+        return memory.load_memory(SUMMARY_MEMORY_KEY, {}) or {}
+
+    def _save_summary(self, memory: Optional[Any], summary: Dict[str, Any]) -> None:
+        if memory is None:
+            self._summary = summary
+        else:
+            memory.save_memory(SUMMARY_MEMORY_KEY, summary)
+
+    async def _aload_summary(self, memory: Optional[Any]) -> Dict[str, Any]:
+        if memory is None:
+            return self._summary
+        return await memory.aload_memory(SUMMARY_MEMORY_KEY, {}) or {}
+
+    async def _asave_summary(
+        self, memory: Optional[Any], summary: Dict[str, Any]
+    ) -> None:
+        if memory is None:
+            self._summary = summary
+        else:
+            await memory.asave_memory(SUMMARY_MEMORY_KEY, summary)
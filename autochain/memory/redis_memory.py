@@ -1,79 +1,297 @@
-import pickle
-from typing import Any, Optional, Dict
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Dict, List, Tuple
 
 from autochain.agent.message import (
     ChatMessageHistory,
     MessageType,
     BaseMessage,
-    AIMessage,
-    UserMessage,
-    FunctionMessage,
-    SystemMessage,
 )
 from autochain.memory.base import BaseMemory
-from redis import Redis
+from autochain.memory.codec import BaseCodec, JSONCodec
+from pydantic import Field, PrivateAttr, root_validator
+from redis import ConnectionPool, Redis
+from redis.client import Pipeline
 
 from autochain.memory.constants import ONE_HOUR
+from autochain.utils import run_in_executor
 
+logger = logging.getLogger(__name__)
 
-class RedisMemory(BaseMemory):
-    """Store conversation info in redis memory."""
+SCAN_COUNT = 1000
+"""Number of keys to scan at a time when clearing memory"""
+
+
+class BaseRedisMemory(BaseMemory, ABC):
+    """Key layout and encoding shared by sync and async redis memories."""
 
     expire_time: int = ONE_HOUR
     redis_key_prefix: str
-    redis_client: Redis
+
+    codec: BaseCodec = Field(default_factory=JSONCodec)
+    """Codec to encode messages and values saved to redis"""
+
+    round_trips: int = 0
+    """Number of requests sent to redis, where a pipeline counts as one request"""
+    turn_round_trips: int = 0
+    """Number of requests sent to redis since the last user message was saved, which is
+    the number of requests of the current turn of chain"""
+
+    _round_trips_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
 
     class Config:
         """Configuration for this pydantic object."""
 
         arbitrary_types_allowed = True
+        # chains should update the round trip count of the memory passed in
+        copy_on_model_validation = "none"
+
+    @root_validator(skip_on_failure=True)
+    def validate_redis_client(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        if values.get("redis_client") is None:
+            if values.get("connection_pool") is None:
+                raise ValueError("Either redis_client or connection_pool is required")
+            values["redis_client"] = cls._create_redis_client(values["connection_pool"])
+        return values
+
+    @classmethod
+    @abstractmethod
+    def _create_redis_client(cls, connection_pool: Any) -> Any:
+        """Create redis client from connection pool"""
+
+    def _count_round_trip(self) -> None:
+        with self._round_trips_lock:
+            self.round_trips += 1
+            self.turn_round_trips += 1
+
+    def _start_turn(self) -> None:
+        with self._round_trips_lock:
+            self.turn_round_trips = 0
+
+    def _get_key(self, key: str) -> str:
+        if not key.startswith(self.redis_key_prefix):
+            key = self.redis_key_prefix + f":{key}"
+        return key
+
+    @property
+    def _conversation_key(self) -> str:
+        # list of messages uses a different key than the pickled history saved by previous
+        # versions, which would fail list commands with WRONGTYPE until it expires
+        return self.redis_key_prefix + f":{ChatMessageHistory.__name__}:messages"
+
+    @property
+    def _scan_pattern(self) -> str:
+        return f"{self.redis_key_prefix}:*"
+
+    def _queue_save_conversation(
+        self, pipeline: Any, message: str, message_type: MessageType, **kwargs
+    ) -> None:
+        history = ChatMessageHistory()
+        history.save_message(message=message, message_type=message_type, **kwargs)
+        if not history.messages:
+            raise ValueError(f"Unsupported message type: {message_type}")
+        if message_type == MessageType.UserMessage:
+            self._start_turn()
+
+        pipeline.rpush(
+            self._conversation_key, self._encode_message(history.messages[0])
+        )
+        pipeline.expire(self._conversation_key, self.expire_time)
+
+    def _encode_value(self, value: Any) -> bytes:
+        return self.codec.encode(value)
+
+    def _decode_value(
+        self, value: Optional[bytes], default: Optional[Any] = None
+    ) -> Any:
+        if not value:
+            return default
+        if not self.codec.is_encoded(value):
+            # values pickled by previous versions are not loaded and expire with their TTL
+            logger.warning(
+                f"Ignoring value of unsupported format saved by a previous version of "
+                f"{type(self).__name__}"
+            )
+            return default
+        return self.codec.decode(value)
+
+    def _encode_message(self, message: BaseMessage) -> bytes:
+        return self.codec.encode(message)
+
+    def _decode_message(self, encoded: bytes) -> BaseMessage:
+        return self.codec.decode(encoded)
+
+    def _decode_conversation(self, encoded_messages: List[bytes]) -> ChatMessageHistory:
+        # decoded messages are already valid, skip copying them again during validation
+        return ChatMessageHistory.construct(
+            messages=[self._decode_message(m) for m in encoded_messages]
+        )
+
+
+class RedisMemory(BaseRedisMemory):
+    """Store conversation info in redis memory.
+
+    Example:
+    .. code-block:: python
+
+        pool = ConnectionPool.from_url("redis://localhost:6379")
+        memory = RedisMemory(redis_key_prefix="conversation_id", connection_pool=pool)
+    """
+
+    redis_client: Optional[Redis] = None
+    connection_pool: Optional[ConnectionPool] = None
+    """Connection pool shared by memories of different conversations, used to create
+    redis_client if it is not provided"""
+
+    @classmethod
+    def _create_redis_client(cls, connection_pool: ConnectionPool) -> Redis:
+        return Redis(connection_pool=connection_pool)
+
+    @property
+    def _sync_client(self) -> Redis:
+        """Client used by sync methods"""
+        return self.redis_client
 
     def load_memory(
         self, key: Optional[str] = None, default: Optional[Any] = None, **kwargs
     ) -> Any:
         """Get the key's corresponding value from redis."""
-        if not key.startswith(self.redis_key_prefix):
-            key = self.redis_key_prefix + f":{key}"
-        pickled = self.redis_client.get(key)
-        if not pickled:
-            return default
-        return pickle.loads(pickled)
+        self._count_round_trip()
+        value = self._sync_client.get(self._get_key(key))
+        return self._decode_value(value, default)
 
-    def load_conversation(self, **kwargs: Dict[str, Any]) -> ChatMessageHistory:
-        """Return chat message history."""
-        redis_key = self.redis_key_prefix + f":{ChatMessageHistory.__name__}"
-        return ChatMessageHistory(messages=self.load_memory(redis_key, []))
+    def load_conversation(
+        self, last_n: Optional[int] = None, **kwargs: Dict[str, Any]
+    ) -> ChatMessageHistory:
+        """Return chat message history, or only its last n messages if last_n is set."""
+        start = -last_n if last_n else 0
+        self._count_round_trip()
+        encoded_messages = self._sync_client.lrange(self._conversation_key, start, -1)
+        return self._decode_conversation(encoded_messages)
 
     def save_memory(self, key: str, value: Any) -> None:
         """Save the key value pair to redis."""
-        if not key.startswith(self.redis_key_prefix):
-            key = self.redis_key_prefix + f":{key}"
-        pickled = pickle.dumps(value)
-        self.redis_client.set(key, pickled, ex=self.expire_time)
+        self._count_round_trip()
+        self._sync_client.set(
+            self._get_key(key), self._encode_value(value), ex=self.expire_time
+        )
 
     def save_conversation(
         self, message: str, message_type: MessageType, **kwargs
     ) -> None:
-        """Save context from this conversation to redis."""
-        redis_key = self.redis_key_prefix + f":{ChatMessageHistory.__name__}"
-        pickled = self.redis_client.get(redis_key)
-        if pickled:
-            messages: list[BaseMessage] = pickle.loads(pickled)
-        else:
-            messages = []
-        if message_type == MessageType.AIMessage:
-            messages.append(AIMessage(content=message))
-        elif message_type == MessageType.UserMessage:
-            messages.append(UserMessage(content=message))
-        elif message_type == MessageType.FunctionMessage:
-            messages.append(FunctionMessage(content=message, name=kwargs["name"]))
-        elif message_type == MessageType.SystemMessage:
-            messages.append(SystemMessage(content=message))
-        else:
-            raise ValueError(f"Unsupported message type: {message_type}")
-        self.save_memory(redis_key, messages)
+        """Append message to the conversation list in redis."""
+        pipeline = self._sync_client.pipeline()
+        self._queue_save_conversation(pipeline, message, message_type, **kwargs)
+        self._execute(pipeline)
+
+    def save_conversation_and_load(
+        self,
+        message: str,
+        message_type: MessageType,
+        key: str,
+        default: Optional[Any] = None,
+        **kwargs,
+    ) -> Tuple[ChatMessageHistory, Any]:
+        """Save message, load conversation and value of the key in one round trip."""
+        pipeline = self._sync_client.pipeline()
+        self._queue_save_conversation(pipeline, message, message_type, **kwargs)
+        pipeline.lrange(self._conversation_key, 0, -1)
+        pipeline.get(self._get_key(key))
+        *_, encoded_messages, value = self._execute(pipeline)
+        return (
+            self._decode_conversation(encoded_messages),
+            self._decode_value(value, default),
+        )
+
+    def save_conversation_and_memory(
+        self, message: str, message_type: MessageType, key: str, value: Any, **kwargs
+    ) -> None:
+        """Save message and the key value pair in one round trip."""
+        pipeline = self._sync_client.pipeline()
+        self._queue_save_conversation(pipeline, message, message_type, **kwargs)
+        pipeline.set(self._get_key(key), self._encode_value(value), ex=self.expire_time)
+        self._execute(pipeline)
+
+    def replace_memory(
+        self, key: str, value: Any, default: Optional[Any] = None
+    ) -> Any:
+        """Save the key value pair and return the previous value in one round trip."""
+        redis_key = self._get_key(key)
+        pipeline = self._sync_client.pipeline()
+        pipeline.get(redis_key)
+        pipeline.set(redis_key, self._encode_value(value), ex=self.expire_time)
+        previous, _ = self._execute(pipeline)
+        return self._decode_value(previous, default)
 
     def clear(self) -> None:
-        """Clear redis memory."""
-        for key in self.redis_client.keys(f"{self.redis_key_prefix}:*"):
-            self.redis_client.delete(key)
+        """Clear redis memory incrementally with SCAN and UNLINK, without blocking redis."""
+        cursor = 0
+        while True:
+            self._count_round_trip()
+            cursor, keys = self._sync_client.scan(
+                cursor, match=self._scan_pattern, count=SCAN_COUNT
+            )
+            if keys:
+                self._count_round_trip()
+                self._sync_client.unlink(*keys)
+            if not cursor:
+                break
+
+    def _execute(self, pipeline: Pipeline) -> List[Any]:
+        """Send all commands queued in the pipeline as a MULTI block in one round trip"""
+        self._count_round_trip()
+        return pipeline.execute()
+
+    async def aload_memory(
+        self, key: Optional[str] = None, default: Optional[Any] = None, **kwargs
+    ) -> Any:
+        return await run_in_executor(self.load_memory, key, default, **kwargs)
+
+    async def aload_conversation(self, **kwargs: Dict[str, Any]) -> ChatMessageHistory:
+        return await run_in_executor(self.load_conversation, **kwargs)
+
+    async def asave_memory(self, key: str, value: Any) -> None:
+        await run_in_executor(self.save_memory, key, value)
+
+    async def asave_conversation(
+        self, message: str, message_type: MessageType, **kwargs
+    ) -> None:
+        await run_in_executor(self.save_conversation, message, message_type, **kwargs)
+
+    async def asave_conversation_and_load(
+        self,
+        message: str,
+        message_type: MessageType,
+        key: str,
+        default: Optional[Any] = None,
+        **kwargs,
+    ) -> Tuple[ChatMessageHistory, Any]:
+        return await run_in_executor(
+            self.save_conversation_and_load,
+            message,
+            message_type,
+            key,
+            default,
+            **kwargs,
+        )
+
+    async def asave_conversation_and_memory(
+        self, message: str, message_type: MessageType, key: str, value: Any, **kwargs
+    ) -> None:
+        await run_in_executor(
+            self.save_conversation_and_memory,
+            message,
+            message_type,
+            key,
+            value,
+            **kwargs,
+        )
+
+    async def areplace_memory(
+        self, key: str, value: Any, default: Optional[Any] = None
+    ) -> Any:
+        return await run_in_executor(self.replace_memory, key, value, default)
+
+    async def aclear(self) -> None:
+        await run_in_executor(self.clear)
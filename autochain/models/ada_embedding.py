@@ -50,15 +50,27 @@ class OpenAIAdaEncoder(BaseLanguageModel):
         pass
 
     def encode(self, texts: List[str]) -> EmbeddingResult:
-        def _format_response(texts, resp) -> EmbeddingResult:
-            embeddings = [d.get("embedding") for d in resp.get("data", [])]
-            return EmbeddingResult(texts=texts, embeddings=embeddings)
+        response = self.generate_with_retry(**self._create_encoding_params(texts))
+        return self._format_response(texts=texts, resp=response)
 
-        params: Dict[str, Any] = {
+    async def aencode(self, texts: List[str]) -> EmbeddingResult:
+        response = await self.agenerate_with_retry(
+            **self._create_encoding_params(texts)
+        )
+        return self._format_response(texts=texts, resp=response)
+
+    def _create_encoding_params(self, texts: List[str]) -> Dict[str, Any]:
+        return {
             "model": self.model_name,
             "input": texts,
             **self._default_params,
         }
 
-        response = self.generate_with_retry(**params)
-        return _format_response(texts=texts, resp=response)
+    def _is_deterministic(self, params: Dict[str, Any]) -> bool:
+        """Embeddings do not depend on sampling temperature"""
+        return True
+
+    @staticmethod
+    def _format_response(texts: List[str], resp: Dict[str, Any]) -> EmbeddingResult:
+        embeddings = [d.get("embedding") for d in resp.get("data", [])]
+        return EmbeddingResult(texts=texts, embeddings=embeddings)
@@ -1,23 +1,53 @@
 from __future__ import annotations
 
+import json
 import logging
 from abc import abstractmethod
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
-
-from pydantic import Extra, Field, BaseModel
-from tenacity import (
-    before_sleep_log,
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_exponential,
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
 )
 
-from autochain.agent.message import BaseMessage
+from pydantic import Extra, Field, BaseModel, PrivateAttr
+from tenacity import AsyncRetrying, Retrying
+
+from autochain.agent.message import AIMessage, BaseMessage
+from autochain.cache.base import BaseCache
+from autochain.errors import PromptTooLongError
+from autochain.models.rate_limiter import RateLimiter
+from autochain.models.retry import (
+    DEFAULT_RETRY_BUDGET,
+    RetryBudget,
+    create_retrying_kwargs,
+)
 from autochain.tools.base import Tool
+from autochain.utils import run_in_executor
 
 logger = logging.getLogger(__name__)
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Count tokens with tiktoken cl100k_base encoding if tiktoken is installed, otherwise
+    estimate about four characters per token
+    """
+    if tiktoken is not None:
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    return len(text) // 4 + 1
+
 
 class Generation(BaseModel):
     """Output of a single generation."""
@@ -28,7 +58,41 @@ class Generation(BaseModel):
     generation_info: Optional[Dict[str, Any]] = None
     """Raw generation info response from the provider"""
     """May include things like reason for finishing (e.g. in OpenAI)"""
-    # TODO: add log probs
+    logprobs: Optional[List[float]] = None
+    """Log probabilities of generated tokens, if they are requested from the provider"""
+
+
+class GenerationChunk(BaseModel):
+    """Incremental output of a streamed generation."""
+
+    content: str = ""
+    """Delta of the generated text."""
+
+    function_call: Dict[str, str] = {}
+    """Delta of the function call, name and arguments should be concatenated across chunks"""
+
+    finish_reason: Optional[str] = None
+
+
+def merge_generation_chunks(chunks: Iterable[GenerationChunk]) -> Generation:
+    """Concatenate streamed chunks into a full generation"""
+    content = ""
+    function_name = ""
+    function_arguments = ""
+    finish_reason = None
+    for chunk in chunks:
+        content += chunk.content
+        function_name += chunk.function_call.get("name", "")
+        function_arguments += chunk.function_call.get("arguments", "")
+        finish_reason = chunk.finish_reason or finish_reason
+
+    function_call = {}
+    if function_name:
+        function_call = {"name": function_name, "arguments": function_arguments}
+    return Generation(
+        message=AIMessage(content=content, function_call=function_call),
+        generation_info={"finish_reason": finish_reason},
+    )
 
 
 class LLMResult(BaseModel):
@@ -79,11 +143,30 @@ class BaseLanguageModel(BaseModel):
     """Number of chat completions to generate for each prompt."""
     max_tokens: Optional[int] = None
     """Maximum number of tokens to generate."""
+    cache: Optional[BaseCache] = None
+    """Cache for responses of identical requests"""
+    force_cache: bool = False
+    """Whether to cache responses even when sampling temperature is not zero"""
+    max_prompt_tokens: Optional[int] = None
+    """Maximum number of tokens in prompt. Longer prompts raise PromptTooLongError before
+    they are sent to the model"""
+    retry_budget: Optional[RetryBudget] = None
+    """Budget limiting retries to a fraction of requests. All models share one budget
+    if it is not set"""
+
+    rate_limiter: Optional[RateLimiter] = None
+    """Client side limit of requests and tokens per minute, which could be shared by models
+    using the same account"""
+
+    # retry strategies are created on the first request and reused by later ones
+    _retrying: Optional[Retrying] = PrivateAttr(default=None)
+    _aretrying: Optional[AsyncRetrying] = PrivateAttr(default=None)
 
     class Config:
         """Configuration for this pydantic object."""
 
         extra = Extra.ignore
+        arbitrary_types_allowed = True
 
     @property
     def _default_params(self) -> Dict[str, Any]:
@@ -97,36 +180,134 @@ class BaseLanguageModel(BaseModel):
             **self.model_kwargs,
         }
 
-    def _create_retry_decorator(self) -> Callable[[Any], Any]:
+    def count_text_tokens(self, text: str) -> int:
+        """Number of tokens of the text"""
+        return approximate_token_count(text)
+
+    def count_tokens(
+        self, messages: List[BaseMessage], functions: Optional[List[Tool]] = None
+    ) -> int:
+        """Number of prompt tokens of messages and functions sent to the model"""
+        num_tokens = sum(self.count_text_tokens(m.content) for m in messages)
+        for tool in functions or []:
+            num_tokens += self.count_text_tokens(
+                f"{tool.name}: {tool.description} {tool.arg_description or ''}"
+            )
+        return num_tokens
+
+    def _check_prompt_tokens(
+        self, messages: List[BaseMessage], functions: Optional[List[Tool]] = None
+    ) -> None:
+        """Raise PromptTooLongError if prompt exceeds max_prompt_tokens"""
+        if self.max_prompt_tokens is None:
+            return
+
+        num_tokens = self.count_tokens(messages, functions)
+        if num_tokens > self.max_prompt_tokens:
+            raise PromptTooLongError(num_tokens, self.max_prompt_tokens)
+
+    @staticmethod
+    def _create_token_usage(
+        prompt_tokens: int, completion_tokens: int
+    ) -> Dict[str, int]:
+        """Token usage in the same format as reported by OpenAI"""
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _get_retry_exceptions(self) -> Tuple[Type[BaseException], ...]:
+        """Errors of the provider worth retrying"""
         import openai
 
-        min_seconds = 1
-        max_seconds = 60
-        # Wait 2^x * 1 second between each retry starting with
-        # 4 seconds, then up to 10 seconds, then 10 seconds afterwards
-        return retry(
-            reraise=True,
-            stop=stop_after_attempt(self.max_retries),
-            wait=wait_exponential(multiplier=1, min=min_seconds, max=max_seconds),
-            retry=(
-                retry_if_exception_type(openai.error.Timeout)
-                | retry_if_exception_type(openai.error.APIError)
-                | retry_if_exception_type(openai.error.APIConnectionError)
-                | retry_if_exception_type(openai.error.RateLimitError)
-                | retry_if_exception_type(openai.error.ServiceUnavailableError)
-            ),
-            before_sleep=before_sleep_log(logger, logging.WARNING),
+        return (
+            openai.error.Timeout,
+            openai.error.APIError,
+            openai.error.APIConnectionError,
+            openai.error.RateLimitError,
+            openai.error.ServiceUnavailableError,
+        )
+
+    def _get_retrying_kwargs(self) -> Dict[str, Any]:
+        return create_retrying_kwargs(
+            retry_exceptions=self._get_retry_exceptions(),
+            max_retries=self.max_retries,
+            budget=self.retry_budget or DEFAULT_RETRY_BUDGET,
         )
 
     def generate_with_retry(self, **kwargs: Any) -> Any:
         """Use tenacity to retry the completion call."""
-        retry_decorator = self._create_retry_decorator()
+        cache_key = self._get_cache_key(kwargs)
+        if cache_key:
+            response = self.cache.lookup(cache_key)
+            if response is not None:
+                return response
+
+        if self._retrying is None:
+            self._retrying = Retrying(**self._get_retrying_kwargs())
+        # state of an attempt is kept per thread, so one Retrying serves all threads
+        response = self._retrying(self._create, **kwargs)
+        if cache_key:
+            self.cache.update(cache_key, response)
+        return response
 
-        @retry_decorator
-        def _generate_with_retry(**kwargs: Any) -> Any:
-            return self.client.create(**kwargs)
+    async def agenerate_with_retry(self, **kwargs: Any) -> Any:
+        """Use tenacity to retry the async completion call."""
+        cache_key = self._get_cache_key(kwargs)
+        if cache_key:
+            response = self.cache.lookup(cache_key)
+            if response is not None:
+                return response
 
-        return _generate_with_retry(**kwargs)
+        if self._aretrying is None:
+            self._aretrying = AsyncRetrying(**self._get_retrying_kwargs())
+        # concurrent coroutines run on the same thread, so each call retries with a copy
+        # sharing the configured strategies
+        response = await self._aretrying.copy()(self._acreate, **kwargs)
+        if cache_key:
+            self.cache.update(cache_key, response)
+        return response
+
+    def _create(self, **kwargs: Any) -> Any:
+        """Send the request once the rate limiter allows it"""
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self._estimate_request_tokens(kwargs))
+        return self.client.create(**kwargs)
+
+    async def _acreate(self, **kwargs: Any) -> Any:
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aacquire(self._estimate_request_tokens(kwargs))
+        return await self.client.acreate(**kwargs)
+
+    def _estimate_request_tokens(self, params: Dict[str, Any]) -> int:
+        """
+        Tokens counted against tokens per minute limit, which are estimated from the prompt
+        and max_tokens of the request
+        """
+        num_tokens = params.get("max_tokens") or 0
+        for key in ["messages", "functions", "input"]:
+            value = params.get(key)
+            if isinstance(value, str):
+                num_tokens += self.count_text_tokens(value)
+            elif value:
+                num_tokens += self.count_text_tokens(json.dumps(value, default=str))
+        return num_tokens
+
+    def _get_cache_key(self, params: Dict[str, Any]) -> Optional[str]:
+        """Cache key of the request, or None if the response should not be cached"""
+        if self.cache is None or params.get("stream"):
+            return None
+        if not self._is_deterministic(params) and not self.force_cache:
+            return None
+
+        # request timeout does not change the response
+        key_params = {k: v for k, v in params.items() if k != "request_timeout"}
+        return self.cache.get_cache_key(**key_params)
+
+    def _is_deterministic(self, params: Dict[str, Any]) -> bool:
+        """Responses are only reused when sampling is disabled"""
+        return not params.get("temperature")
 
     @abstractmethod
     def generate(
@@ -137,5 +318,50 @@ class BaseLanguageModel(BaseModel):
     ) -> LLMResult:
         pass
 
+    async def agenerate(
+        self,
+        messages: List[BaseMessage],
+        functions: Optional[List[Tool]] = None,
+        stop: Optional[List[str]] = None,
+    ) -> LLMResult:
+        """Async version of generate. Models without a native async client run generate
+        in the default executor so the event loop is not blocked"""
+        return await run_in_executor(self.generate, messages, functions, stop)
+
+    def stream(
+        self,
+        messages: List[BaseMessage],
+        functions: Optional[List[Tool]] = None,
+        stop: Optional[List[str]] = None,
+    ) -> Iterator[GenerationChunk]:
+        """Stream the generation as chunks. Models without streaming support yield the full
+        generation as a single chunk"""
+        message = self.generate(messages, functions, stop).generations[0].message
+        yield GenerationChunk(
+            content=message.content,
+            function_call=getattr(message, "function_call", {}),
+            finish_reason="stop",
+        )
+
+    async def astream(
+        self,
+        messages: List[BaseMessage],
+        functions: Optional[List[Tool]] = None,
+        stop: Optional[List[str]] = None,
+    ) -> AsyncIterator[GenerationChunk]:
+        """Async version of stream"""
+        message = (
+            (await self.agenerate(messages, functions, stop)).generations[0].message
+        )
+        yield GenerationChunk(
+            content=message.content,
+            function_call=getattr(message, "function_call", {}),
+            finish_reason="stop",
+        )
+
     def encode(self, texts: List[str]) -> EmbeddingResult:
         pass
+
+    async def aencode(self, texts: List[str]) -> EmbeddingResult:
+        """Async version of encode"""
+        return await run_in_executor(self.encode, texts)
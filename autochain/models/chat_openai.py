@@ -3,10 +3,22 @@ from __future__ import annotations
 
 import enum
 import inspect
+import json
 import logging
 import os
 import re
-from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
+from functools import lru_cache
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from pydantic import Extra, Field, root_validator
 
@@ -20,12 +32,28 @@ from autochain.agent.message import (
 from autochain.models.base import (
     LLMResult,
     Generation,
+    GenerationChunk,
     BaseLanguageModel,
+    approximate_token_count,
+    merge_generation_chunks,
 )
 from autochain.tools.base import Tool
 
 logger = logging.getLogger(__name__)
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+@lru_cache(maxsize=None)
+def _get_tiktoken_encoding(model_name: str):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
 
 def convert_dict_to_message(_dict: dict) -> BaseMessage:
     role = _dict["role"]
@@ -60,32 +88,44 @@ def convert_message_to_dict(message: BaseMessage) -> dict:
     return message_dict
 
 
-def convert_tool_to_dict(tool: Tool):
-    """Convert tool into function parameter for openai"""
-    inspection = inspect.getfullargspec(tool.func)
-    arg_description = tool.arg_description or {}
+CLASS_NAME_PATTERN = re.compile(r"<class '(\w+)'>")
+PRIMARY_TYPE_MAP = {"str": "string"}
+
 
-    def _type_to_string(t: type) -> str:
-        prog = re.compile(r"<class '(\w+)'>")
-        cls = prog.findall(str(t))
+def _type_to_string(t: type) -> str:
+    cls = CLASS_NAME_PATTERN.findall(str(t))
 
-        primary_type_map = {"str": "string"}
+    if len(cls) > 0:
+        cls_name = cls[0].split(".")[-1]
+        return PRIMARY_TYPE_MAP.get(cls_name, cls_name)
 
-        if len(cls) > 0:
-            cls_name = cls[0].split(".")[-1]
-            return primary_type_map.get(cls_name, cls_name)
+    if issubclass(t, enum.Enum):
+        return "enum"
 
-        if issubclass(t, enum.Enum):
-            return "enum"
+    return str(t)
 
-        return str(t)
 
-    def _format_property(t: type, arg_desp: str):
-        p = {"type": _type_to_string(t)}
-        if arg_desp:
-            p["description"] = arg_desp
+def _format_property(t: type, arg_desp: str):
+    p = {"type": _type_to_string(t)}
+    if arg_desp:
+        p["description"] = arg_desp
+
+    return p
+
+
+def convert_tool_to_dict(tool: Tool):
+    """
+    Convert tool into function parameter for openai. Schema is cached on the tool until any
+    of its fields changes, so returned dictionary should not be modified
+    """
+    if tool._function_schema is None:
+        tool._function_schema = _create_function_schema(tool)
+    return tool._function_schema
+
 
-        return p
+def _create_function_schema(tool: Tool) -> Dict[str, Any]:
+    inspection = inspect.getfullargspec(tool.func)
+    arg_description = tool.arg_description or {}
 
     arg_annotations = inspection.annotations
     if arg_annotations:
@@ -152,11 +192,8 @@ class ChatOpenAI(BaseLanguageModel):
     """Timeout for requests to OpenAI completion API. Default is 600 seconds."""
     max_retries: int = 6
     """Maximum number of retries to make when generating."""
-    # TODO: support streaming
-    # streaming: bool = False
-    # """Whether to stream the results or not."""
-    # n: int = 1
-    # """Number of chat completions to generate for each prompt."""
+    streaming: bool = False
+    """Whether to stream the results or not."""
     max_tokens: Optional[int] = None
     """Maximum number of tokens to generate."""
 
@@ -184,7 +221,9 @@ class ChatOpenAI(BaseLanguageModel):
         if openai_api_base:
             values["api_base"] = openai.api_base = openai_api_base
         if openai_api_type == "azure":
-            values["azure_api_version"] = openai.api_version = os.environ.get("OPENAI_API_VERSION", "2023-05-15")
+            values["azure_api_version"] = openai.api_version = os.environ.get(
+                "OPENAI_API_VERSION", "2023-05-15"
+            )
         try:
             values["client"] = openai.ChatCompletion
         except AttributeError:
@@ -193,10 +232,10 @@ class ChatOpenAI(BaseLanguageModel):
                 "due to an old version of the openai package. Try upgrading it "
                 "with `pip install --upgrade openai`."
             )
-        # if values["n"] < 1:
-        #     raise ValueError("n must be at least 1.")
-        # if values["n"] > 1 and values["streaming"]:
-        #     raise ValueError("n must be 1 when streaming.")
+        if values["n"] < 1:
+            raise ValueError("n must be at least 1.")
+        if values["n"] > 1 and values["streaming"]:
+            raise ValueError("n must be 1 when streaming.")
         return values
 
     def generate(
@@ -205,6 +244,75 @@ class ChatOpenAI(BaseLanguageModel):
         functions: Optional[List[Tool]] = None,
         stop: Optional[List[str]] = None,
     ) -> LLMResult:
+        self._check_prompt_tokens(messages, functions)
+        if self.streaming:
+            return self._create_llm_result_from_chunks(
+                list(self.stream(messages, functions, stop)), messages, functions
+            )
+
+        generation_param = self._create_generation_params(messages, functions, stop)
+        response = self.generate_with_retry(**generation_param)
+        return self._create_llm_result(response)
+
+    async def agenerate(
+        self,
+        messages: List[BaseMessage],
+        functions: Optional[List[Tool]] = None,
+        stop: Optional[List[str]] = None,
+    ) -> LLMResult:
+        self._check_prompt_tokens(messages, functions)
+        if self.streaming:
+            chunks = [c async for c in self.astream(messages, functions, stop)]
+            return self._create_llm_result_from_chunks(chunks, messages, functions)
+
+        generation_param = self._create_generation_params(messages, functions, stop)
+        response = await self.agenerate_with_retry(**generation_param)
+        return self._create_llm_result(response)
+
+    def stream(
+        self,
+        messages: List[BaseMessage],
+        functions: Optional[List[Tool]] = None,
+        stop: Optional[List[str]] = None,
+    ) -> Iterator[GenerationChunk]:
+        """Stream deltas of the completion, including partial function call arguments"""
+        self._check_prompt_tokens(messages, functions)
+        generation_param = self._create_generation_params(messages, functions, stop)
+        response = self.generate_with_retry(stream=True, **generation_param)
+        try:
+            for stream_resp in response:
+                chunk = self._create_generation_chunk(stream_resp)
+                if chunk:
+                    yield chunk
+        finally:
+            # stop receiving the rest of completion if caller stops consuming the stream
+            if hasattr(response, "close"):
+                response.close()
+
+    async def astream(
+        self,
+        messages: List[BaseMessage],
+        functions: Optional[List[Tool]] = None,
+        stop: Optional[List[str]] = None,
+    ) -> AsyncIterator[GenerationChunk]:
+        self._check_prompt_tokens(messages, functions)
+        generation_param = self._create_generation_params(messages, functions, stop)
+        response = await self.agenerate_with_retry(stream=True, **generation_param)
+        try:
+            async for stream_resp in response:
+                chunk = self._create_generation_chunk(stream_resp)
+                if chunk:
+                    yield chunk
+        finally:
+            if hasattr(response, "aclose"):
+                await response.aclose()
+
+    def _create_generation_params(
+        self,
+        messages: List[BaseMessage],
+        functions: Optional[List[Tool]] = None,
+        stop: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
         message_dicts, function_dicts, params = self._create_message_dicts(
             messages, functions, stop
         )
@@ -215,9 +323,7 @@ class ChatOpenAI(BaseLanguageModel):
         }
         if len(function_dicts) > 0:
             generation_param["functions"] = function_dicts
-
-        response = self.generate_with_retry(**generation_param)
-        return self._create_llm_result(response)
+        return generation_param
 
     def _create_message_dicts(
         self,
@@ -242,8 +348,76 @@ class ChatOpenAI(BaseLanguageModel):
         generations = []
         for res in response["choices"]:
             message = convert_dict_to_message(res["message"])
-            gen = Generation(message=message)
+            # log probabilities are only returned if requested with logprobs=True
+            token_logprobs = (res.get("logprobs") or {}).get("content") or []
+            gen = Generation(
+                message=message,
+                generation_info={"finish_reason": res.get("finish_reason")},
+                logprobs=[t["logprob"] for t in token_logprobs] or None,
+            )
             generations.append(gen)
         llm_output = {"token_usage": response["usage"], "model_name": self.model_name}
         result = LLMResult(generations=generations, llm_output=llm_output)
         return result
+
+    @staticmethod
+    def _create_generation_chunk(
+        stream_resp: Mapping[str, Any]
+    ) -> Optional[GenerationChunk]:
+        if not stream_resp["choices"]:
+            return None
+
+        choice = stream_resp["choices"][0]
+        delta = choice.get("delta", {})
+        return GenerationChunk(
+            content=delta.get("content") or "",
+            function_call=delta.get("function_call") or {},
+            finish_reason=choice.get("finish_reason"),
+        )
+
+    def _create_llm_result_from_chunks(
+        self,
+        chunks: List[GenerationChunk],
+        messages: List[BaseMessage],
+        functions: Optional[List[Tool]] = None,
+    ) -> LLMResult:
+        generation = merge_generation_chunks(chunks)
+        # usage is not reported by streamed completions, so it is counted locally
+        completion = (generation.message.content or "") + json.dumps(
+            generation.message.function_call or ""
+        )
+        token_usage = self._create_token_usage(
+            prompt_tokens=self.count_tokens(messages, functions),
+            completion_tokens=self.count_text_tokens(completion),
+        )
+        llm_output = {"token_usage": token_usage, "model_name": self.model_name}
+        return LLMResult(generations=[generation], llm_output=llm_output)
+
+    def count_text_tokens(self, text: str) -> int:
+        if tiktoken is None:
+            return approximate_token_count(text)
+        return len(_get_tiktoken_encoding(self.model_name).encode(text))
+
+    def count_tokens(
+        self, messages: List[BaseMessage], functions: Optional[List[Tool]] = None
+    ) -> int:
+        """
+        Count prompt tokens the same way as OpenAI chat completion API. Functions are
+        counted approximately from their JSON schema
+        """
+        # every message is wrapped with <|start|>{role/name}\n{content}<|end|>\n
+        num_tokens = 3
+        for message_dict in [convert_message_to_dict(m) for m in messages]:
+            num_tokens += 3
+            for key, value in message_dict.items():
+                if isinstance(value, dict):
+                    value = json.dumps(value)
+                num_tokens += self.count_text_tokens(value or "")
+                if key == "name":
+                    num_tokens += 1
+
+        if functions:
+            num_tokens += self.count_text_tokens(
+                json.dumps([convert_tool_to_dict(t) for t in functions])
+            )
+        return num_tokens
@@ -2,11 +2,19 @@
 from __future__ import annotations
 
 import logging
+import threading
+import time
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import torch
-from pydantic import Field
-from transformers import pipeline, AutoModelForCausalLM, AutoTokenizer
+from pydantic import Field, PrivateAttr
+from transformers import (
+    pipeline,
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
 
 from autochain.agent.message import (
     BaseMessage,
@@ -17,11 +25,44 @@ from autochain.models.base import (
     Generation,
     BaseLanguageModel,
 )
+from autochain.models.micro_batching import MicroBatchQueue
 from autochain.tools.base import Tool
 
 logger = logging.getLogger(__name__)
 
 
+class StopSequenceCriteria(StoppingCriteria):
+    """
+    Stop generation as soon as every sequence in the batch contains one of the stop
+    strings. Only the last few generated tokens are decoded at each step.
+    """
+
+    def __init__(self, tokenizer: AutoTokenizer, stop: List[str]):
+        self.tokenizer = tokenizer
+        self.stop = stop
+        # a stop string cannot span more tokens than it has characters
+        self.window = max(len(s) for s in stop) + 1
+        self.prompt_length: Optional[int] = None
+        self.stopped: Optional[List[bool]] = None
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> bool:
+        if self.prompt_length is None:
+            # criteria is first called after one token is generated
+            self.prompt_length = input_ids.shape[1] - 1
+            self.stopped = [False] * input_ids.shape[0]
+
+        start = max(self.prompt_length, input_ids.shape[1] - self.window)
+        for i, stopped in enumerate(self.stopped):
+            if stopped:
+                continue
+            text = self.tokenizer.decode(input_ids[i, start:], skip_special_tokens=True)
+            self.stopped[i] = any(s in text for s in self.stop)
+
+        return all(self.stopped)
+
+
 class HuggingFaceTextGenerationModel(BaseLanguageModel):
     """Huggingface model that supports text-generation task
 
@@ -59,13 +100,31 @@ class HuggingFaceTextGenerationModel(BaseLanguageModel):
     """Model will generate tokens up to the number of max token, so it would be good to have 
     default stop token"""
 
+    preload: bool = False
+    """Whether to load model weights when the model is created instead of at the first
+    generate call"""
+
+    batch_size: int = 8
+    """Maximum number of prompts generated together in one forward pass"""
+    micro_batching: bool = False
+    """Whether to coalesce generate calls made concurrently, e.g. from chains running in
+    different threads, into batched generation"""
+    micro_batch_wait_time: float = 0.01
+    """Seconds to wait for more concurrent requests before generating a batch"""
+
     model: Optional[AutoModelForCausalLM]
     tokenizer: Optional[AutoTokenizer]
 
+    _generator: Optional[Any] = PrivateAttr(default=None)
+    _load_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _batch_queue: Optional[MicroBatchQueue] = PrivateAttr(default=None)
+
     class Config:
         """Configuration for this pydantic object."""
 
         arbitrary_types_allowed = True
+        # agents and chains should share the loaded model weights instead of copies
+        copy_on_model_validation = "none"
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -75,6 +134,47 @@ class HuggingFaceTextGenerationModel(BaseLanguageModel):
         self.tokenizer = AutoTokenizer.from_pretrained(
             self.model_name, **self.tokenizer_kwargs
         )
+        # prompts in a batch are padded on the left, so generated tokens of every prompt
+        # directly follow its own prompt tokens
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
+
+        if self.micro_batching:
+            self._batch_queue = MicroBatchQueue(
+                batch_func=self._generate_requests,
+                max_batch_size=self.batch_size,
+                max_wait_time=self.micro_batch_wait_time,
+            )
+        if self.preload:
+            self.load_pipeline()
+
+    def load_pipeline(self):
+        """
+        Load model weights and create text generation pipeline only once. Pipeline is reused
+        across generate calls, including the ones from different threads.
+        """
+        if self._generator is not None:
+            return self._generator
+
+        with self._load_lock:
+            if self._generator is None:
+                start = time.perf_counter()
+                generator = pipeline(
+                    task="text-generation",
+                    model=self.model_name,
+                    tokenizer=self.tokenizer,
+                    max_new_tokens=self.max_tokens,
+                    temperature=self.temperature,
+                    **self.model_kwargs,
+                )
+                self.model = generator.model
+                self._generator = generator
+                logger.info(
+                    f"Loaded {self.model_name} in {time.perf_counter() - start:.2f}s"
+                )
+
+        return self._generator
 
     def generate(
         self,
@@ -82,19 +182,75 @@ class HuggingFaceTextGenerationModel(BaseLanguageModel):
         functions: Optional[List[Tool]] = None,
         stop: Optional[List[str]] = None,
     ) -> LLMResult:
-        generator = pipeline(
-            task="text-generation",
-            model=self.model_name,
-            tokenizer=self.tokenizer,
-            max_new_tokens=self.max_tokens,
-            temperature=self.temperature,
-            **self.model_kwargs,
+        self._check_prompt_tokens(messages)
+        if self._batch_queue is not None:
+            return self._batch_queue.submit((messages, stop))
+
+        return self.generate_batch([messages], stop=stop)[0]
+
+    def generate_batch(
+        self,
+        messages_list: List[List[BaseMessage]],
+        stop: Optional[List[str]] = None,
+    ) -> List[LLMResult]:
+        """Generate responses for multiple conversations with batched forward passes"""
+        generator = self.load_pipeline()
+
+        prompts = [
+            self._construct_prompt_from_message(messages) for messages in messages_list
+        ]
+        # it is better to have a default stop token so model does not always generate to max
+        # sequence length
+        stop = stop or self.default_stop_tokens
+
+        start = time.perf_counter()
+        generations = []
+        for i in range(0, len(prompts), self.batch_size):
+            batch = prompts[i : i + self.batch_size]
+            generations += generator(
+                batch,
+                do_sample=False,
+                batch_size=len(batch),
+                pad_token_id=self.tokenizer.pad_token_id,
+                stopping_criteria=StoppingCriteriaList(
+                    [StopSequenceCriteria(tokenizer=self.tokenizer, stop=stop)]
+                ),
+            )
+        logger.debug(
+            f"Generated {len(prompts)} prompts in {time.perf_counter() - start:.2f}s"
         )
 
-        prompt = self._construct_prompt_from_message(messages)
-        generation = generator(prompt, do_sample=False)
+        return [
+            self._create_llm_result(generation=generation, prompt=prompt, stop=stop)
+            for generation, prompt in zip(generations, prompts)
+        ]
 
-        return self._create_llm_result(generation=generation, prompt=prompt, stop=stop)
+    def _generate_requests(
+        self, requests: List[Tuple[List[BaseMessage], Optional[List[str]]]]
+    ) -> List[LLMResult]:
+        """Generate requests collected by micro batching queue, grouped by stop tokens"""
+        results: List[Optional[LLMResult]] = [None] * len(requests)
+        groups: Dict[Tuple[str, ...], List[int]] = {}
+        for i, (_, stop) in enumerate(requests):
+            groups.setdefault(tuple(stop or ()), []).append(i)
+
+        for stop, indices in groups.items():
+            batch_results = self.generate_batch(
+                [requests[i][0] for i in indices], stop=list(stop) or None
+            )
+            for i, result in zip(indices, batch_results):
+                results[i] = result
+
+        return results
+
+    def count_text_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def count_tokens(
+        self, messages: List[BaseMessage], functions: Optional[List[Tool]] = None
+    ) -> int:
+        # functions are not included in the prompt
+        return self.count_text_tokens(self._construct_prompt_from_message(messages))
 
     @staticmethod
     def _construct_prompt_from_message(messages: List[BaseMessage]):
@@ -116,20 +272,18 @@ class HuggingFaceTextGenerationModel(BaseLanguageModel):
     def _create_llm_result(
         self, generation: List[Dict[str, Any]], prompt: str, stop: List[str]
     ) -> LLMResult:
+        # generation is already limited to max_tokens new tokens and stops at the first stop
+        # string, which only needs to be cut off from the text
         text = generation[0]["generated_text"][len(prompt) :]
-        if self.max_tokens:
-            token_ids = self.tokenizer.encode(text)[: self.max_tokens]
-            text = self.tokenizer.decode(token_ids)
-
-        # it is better to have a default stop token so model does not always generate to max
-        # sequence length
-        stop = stop or self.default_stop_tokens
         text = self._enforce_stop_tokens(text=text, stop=stop)
 
         return LLMResult(
             generations=[Generation(message=AIMessage(content=text))],
             llm_output={
-                "token_usage": len(text.split()),
+                "token_usage": self._create_token_usage(
+                    prompt_tokens=self.count_text_tokens(prompt),
+                    completion_tokens=self.count_text_tokens(text),
+                ),
                 "model_name": self.model_name,
             },
         )
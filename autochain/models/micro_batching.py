@@ -0,0 +1,78 @@
+"""Queue coalescing concurrent requests into batches"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class MicroBatchQueue:
+    """
+    Collects requests submitted concurrently from different threads and processes them
+    with a single call to `batch_func`. A batch is processed once it reaches
+    `max_batch_size` or `max_wait_time` seconds after its first request arrives.
+
+    Example:
+    .. code-block:: python
+
+        batch_queue = MicroBatchQueue(batch_func=model.generate_batch, max_batch_size=8)
+        result = batch_queue.submit(messages)
+    """
+
+    def __init__(
+        self,
+        batch_func: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_time: float = 0.01,
+    ):
+        self.batch_func = batch_func
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+        self.num_batches = 0
+        """Number of calls made to batch_func"""
+
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def submit(self, request: Any) -> Any:
+        """Add request to the next batch and block until its result is ready"""
+        future: Future = Future()
+        self._queue.put((request, future))
+        self._ensure_worker()
+        return future.result()
+
+    def _ensure_worker(self) -> None:
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _collect_batch(self) -> List[Tuple[Any, Future]]:
+        # block until the first request arrives, then wait shortly for more
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_time
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            requests = [request for request, _ in batch]
+            try:
+                results = self.batch_func(requests)
+                self.num_batches += 1
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,99 @@
+"""Client side rate limiting of requests to model providers"""
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Smooths requests to stay under requests per minute and tokens per minute limits of
+    the provider, instead of having requests rejected and retried. Each limit is a token
+    bucket refilled continuously; a request reserves its capacity and waits until the
+    buckets cover it, so waiting requests are served in order. Rate limiter is thread and
+    asyncio safe and could be shared by models using the same account.
+
+    Example:
+    .. code-block:: python
+
+        rate_limiter = RateLimiter(requests_per_minute=3500, tokens_per_minute=90000)
+        llm = ChatOpenAI(temperature=0, rate_limiter=rate_limiter)
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.num_requests = 0
+        """Number of requests that acquired the rate limiter"""
+        self.num_waits = 0
+        """Number of requests that had to wait"""
+        self.total_wait_time = 0.0
+        """Total seconds requests waited"""
+        self.max_wait_time = 0.0
+        """Longest wait of a single request in seconds"""
+
+        # buckets start full, so the first requests are sent right away
+        self._requests = requests_per_minute or 0.0
+        self._tokens = tokens_per_minute or 0.0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def average_wait_time(self) -> float:
+        return self.total_wait_time / self.num_requests if self.num_requests else 0.0
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until the request could be sent. Returns the time waited in seconds"""
+        wait_time = self._reserve(tokens)
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        """Async version of acquire, which waits without blocking the event loop"""
+        wait_time = self._reserve(tokens)
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+        return wait_time
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Take capacity for the request, letting buckets go negative, and return how long
+        the request needs to wait until the buckets are refilled
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed_minutes = (now - self._updated_at) / 60
+            self._updated_at = now
+
+            wait_time = 0.0
+            if self.requests_per_minute:
+                self._requests = min(
+                    self._requests + elapsed_minutes * self.requests_per_minute,
+                    self.requests_per_minute,
+                )
+                self._requests -= 1
+                if self._requests < 0:
+                    wait_time = -self._requests / self.requests_per_minute * 60
+
+            if self.tokens_per_minute:
+                self._tokens = min(
+                    self._tokens + elapsed_minutes * self.tokens_per_minute,
+                    self.tokens_per_minute,
+                )
+                self._tokens -= tokens
+                if self._tokens < 0:
+                    wait_time = max(
+                        wait_time, -self._tokens / self.tokens_per_minute * 60
+                    )
+
+            self.num_requests += 1
+            if wait_time > 0:
+                self.num_waits += 1
+                self.total_wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+            return wait_time
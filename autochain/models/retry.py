@@ -0,0 +1,141 @@
+"""Retry strategies shared by requests to model providers"""
+import email.utils
+import logging
+import threading
+import time
+from typing import Optional, Tuple, Type
+
+from tenacity import (
+    RetryCallState,
+    before_sleep_log,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+from tenacity.stop import stop_base
+from tenacity.wait import wait_base
+
+logger = logging.getLogger(__name__)
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of requests, so a provider outage does not multiply the
+    load by max_retries. Every request deposits `retry_ratio` tokens, up to `max_tokens`,
+    and every retry withdraws one token. Budget is thread safe and shared by all models by
+    default.
+
+    Example:
+    .. code-block:: python
+
+        budget = RetryBudget(retry_ratio=0.1)
+        llm = ChatOpenAI(temperature=0, retry_budget=budget)
+    """
+
+    def __init__(self, retry_ratio: float = 0.2, max_tokens: float = 10):
+        self.retry_ratio = retry_ratio
+        self.max_tokens = max_tokens
+        self.num_retries = 0
+        """Number of retries allowed by the budget"""
+        self.num_exhausted = 0
+        """Number of retries rejected because the budget was exhausted"""
+
+        # start full so retries of the first requests are not rejected
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self._tokens + self.retry_ratio, self.max_tokens)
+
+    def withdraw(self) -> bool:
+        """Return whether a retry is allowed, taking one token if it is"""
+        with self._lock:
+            if self._tokens < 1:
+                self.num_exhausted += 1
+                return False
+            self._tokens -= 1
+            self.num_retries += 1
+            return True
+
+
+DEFAULT_RETRY_BUDGET = RetryBudget()
+
+
+def get_retry_after(exception: Optional[BaseException]) -> Optional[float]:
+    """Seconds to wait from Retry-After header of the error response, if it is set"""
+    headers = getattr(exception, "headers", None)
+    if not headers:
+        return None
+
+    try:
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            return max(float(retry_after_ms) / 1000, 0.0)
+
+        retry_after = headers.get("retry-after")
+        if retry_after is None:
+            return None
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            # Retry-After could also be an HTTP date
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+            return max(retry_at.timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, AttributeError):
+        logger.warning(f"Could not parse Retry-After header: {headers}")
+        return None
+
+
+class wait_retry_after(wait_base):
+    """Wait as long as the Retry-After header asks, up to max_wait, or fall back to wait"""
+
+    def __init__(self, wait: wait_base, max_wait: float):
+        self.wait = wait
+        self.max_wait = max_wait
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        retry_after = get_retry_after(retry_state.outcome.exception())
+        if retry_after is not None:
+            return min(retry_after, self.max_wait)
+        return self.wait(retry_state)
+
+
+class stop_when_budget_exhausted(stop_base):
+    """Stop retrying once the retry budget is exhausted"""
+
+    def __init__(self, budget: RetryBudget):
+        self.budget = budget
+
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        return not self.budget.withdraw()
+
+
+def create_retrying_kwargs(
+    retry_exceptions: Tuple[Type[BaseException], ...],
+    max_retries: int,
+    budget: RetryBudget,
+    min_wait: float = 1,
+    max_wait: float = 60,
+) -> dict:
+    """
+    Arguments of tenacity Retrying or AsyncRetrying with exponential backoff and full
+    jitter, honoring Retry-After headers and limited by the retry budget
+    """
+
+    def _deposit(retry_state: RetryCallState) -> None:
+        if retry_state.attempt_number == 1:
+            budget.deposit()
+
+    return {
+        "reraise": True,
+        # budget is only consulted for attempts that would otherwise be retried
+        "stop": stop_after_attempt(max_retries) | stop_when_budget_exhausted(budget),
+        "wait": wait_retry_after(
+            wait_random_exponential(multiplier=1, min=min_wait, max=max_wait),
+            max_wait=max_wait,
+        ),
+        "retry": retry_if_exception_type(retry_exceptions),
+        "before": _deposit,
+        "before_sleep": before_sleep_log(logger, logging.WARNING),
+    }
@@ -6,8 +6,10 @@ from abc import ABC
 from typing import Any, Callable, Dict, Optional, Tuple, Type, Union
 
 from autochain.errors import ToolRunningError
+from autochain.utils import run_in_executor
 from pydantic import (
     BaseModel,
+    PrivateAttr,
     root_validator,
 )
 
@@ -35,6 +37,18 @@ class Tool(ABC, BaseModel):
 
     func: Union[Callable[..., str], None] = None
 
+    read_only: bool = False
+    """Whether the tool only reads information without side effects, so it is safe to run
+    before agent is sure to take it"""
+
+    # function schema model is called with, computed once and reset when any field changes
+    _function_schema: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in self.__fields__:
+            self._function_schema = None
+
     @root_validator()
     def validate_environment(cls, values: Dict) -> Dict:
         """Validate that api key and python package exists in environment."""
@@ -87,18 +101,34 @@ class Tool(ABC, BaseModel):
     ) -> str:
         return self.func(*args, **kwargs)
 
-    def run(
+    async def _arun(
         self,
-        tool_input: Union[str, Dict] = "",
+        *args: Any,
         **kwargs: Any,
     ) -> str:
-        """Run the tool."""
+        """Await coroutine functions directly, otherwise run the blocking tool in the default
+        executor"""
+        if self.func is not None and inspect.iscoroutinefunction(self.func):
+            return await self.func(*args, **kwargs)
+        return await run_in_executor(self._run, *args, **kwargs)
+
+    def _parse_input_or_raise(
+        self, tool_input: Union[str, Dict]
+    ) -> Union[str, Dict[str, Any]]:
         try:
-            parsed_input = self._parse_input(tool_input)
+            return self._parse_input(tool_input)
         except ValueError as e:
             # return exception as tool output
             raise ToolRunningError(message=f"Tool input args value Error: {e}") from e
 
+    def run(
+        self,
+        tool_input: Union[str, Dict] = "",
+        **kwargs: Any,
+    ) -> str:
+        """Run the tool."""
+        parsed_input = self._parse_input_or_raise(tool_input)
+
         try:
             tool_args, tool_kwargs = self._to_args_and_kwargs(parsed_input)
             tool_output = self._run(*tool_args, **tool_kwargs)
@@ -108,3 +138,21 @@ class Tool(ABC, BaseModel):
             ) from e
 
         return tool_output
+
+    async def arun(
+        self,
+        tool_input: Union[str, Dict] = "",
+        **kwargs: Any,
+    ) -> str:
+        """Run the tool asynchronously."""
+        parsed_input = self._parse_input_or_raise(tool_input)
+
+        try:
+            tool_args, tool_kwargs = self._to_args_and_kwargs(parsed_input)
+            tool_output = await self._arun(*tool_args, **tool_kwargs)
+        except (Exception, KeyboardInterrupt) as e:
+            raise ToolRunningError(
+                message=f"Failed to run tool {self.name} due to {e}"
+            ) from e
+
+        return tool_output
@@ -1,10 +1,14 @@
 import argparse
+import asyncio
+import functools
 import logging
 import os
-from typing import Optional, Dict, Any
+from typing import Any, Callable, Dict, Optional, TypeVar
 
 from colorama import Style
 
+T = TypeVar("T")
+
 
 def print_with_color(text: str, color: str):
     if os.getenv("NO_COLOR"):
@@ -38,6 +42,12 @@ def get_from_env(key: str, env_key: str, default: Optional[str] = None) -> str:
         )
 
 
+async def run_in_executor(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking function in the default executor so it does not block the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
 def get_args():
     """Adding arguments for running test interactively or setting verbosity"""
     parser = argparse.ArgumentParser()
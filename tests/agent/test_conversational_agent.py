@@ -11,7 +11,9 @@ from autochain.agent.message import (
     ChatMessageHistory,
     MessageType,
 )
-from autochain.agent.structs import AgentFinish
+from autochain.agent.conversational_agent.output_parser import ConvoJSONOutputParser
+from autochain.agent.structs import AgentAction, AgentFinish
+from autochain.errors import OutputParserException
 
 from autochain.models.chat_openai import ChatOpenAI
 from autochain.tools.simple_handoff.tool import HandOffToAgent
@@ -115,3 +117,95 @@ def test_plan(openai_response_fixture):
 
     action = agent.plan(history=history, intermediate_steps=[])
     assert isinstance(action, AgentFinish)
+
+
+def _planning_response(tool: dict):
+    return {
+        "choices": [
+            {
+                "message": {
+                    "role": "assistant",
+                    "content": json.dumps(
+                        {
+                            "thoughts": {"plan": "use tool", "need_use_tool": "Yes"},
+                            "tool": tool,
+                            "response": "",
+                        }
+                    ),
+                }
+            }
+        ],
+        "usage": 10,
+    }
+
+
+def _clarify_and_plan(agent: ConversationalAgent):
+    history = ChatMessageHistory()
+    history.save_message("first user query", MessageType.UserMessage)
+    action = agent.plan(history=history, intermediate_steps=[])
+    if isinstance(action, AgentAction):
+        action = agent.clarify_args_for_agent_action(
+            action, history=history, intermediate_steps=[]
+        )
+    return action
+
+
+def test_single_pass_planning_llm_calls():
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    tool = {
+        "name": "Hand off",
+        "args": {},
+        "has_arg_value": "Yes",
+        "clarifying_question": "",
+    }
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        return_value=_planning_response(tool),
+    ) as generate_mock:
+        agent = ConversationalAgent.from_llm_and_tools(
+            llm=ChatOpenAI(), tools=[HandOffToAgent()]
+        )
+        assert isinstance(_clarify_and_plan(agent), AgentAction)
+        # planning and clarification
+        assert generate_mock.call_count == 2
+
+        generate_mock.reset_mock()
+        agent = ConversationalAgent.from_llm_and_tools(
+            llm=ChatOpenAI(), tools=[HandOffToAgent()], single_pass_planning=True
+        )
+        assert isinstance(_clarify_and_plan(agent), AgentAction)
+        assert generate_mock.call_count == 1
+        prompt = generate_mock.call_args.kwargs["messages"][0]["content"]
+        assert "has_arg_value" in prompt
+
+
+def test_single_pass_planning_clarifying_question():
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    tool = {
+        "name": "Hand off",
+        "args": {"reason": ""},
+        "has_arg_value": "No",
+        "clarifying_question": "why do you need an agent?",
+    }
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        return_value=_planning_response(tool),
+    ):
+        agent = ConversationalAgent.from_llm_and_tools(
+            llm=ChatOpenAI(), tools=[HandOffToAgent()], single_pass_planning=True
+        )
+        output = _clarify_and_plan(agent)
+        assert isinstance(output, AgentFinish)
+        assert output.message == "why do you need an agent?"
+
+
+def test_parse_invalid_tool_list():
+    parser = ConvoJSONOutputParser()
+    with pytest.raises(OutputParserException):
+        parser._parse_response(
+            {
+                "thoughts": {"plan": "use tool", "need_use_tool": "Yes"},
+                "tool": [{"name": "get_weather", "args": {}}, "get_time"],
+                "response": "",
+            }
+        )
@@ -0,0 +1,50 @@
+import json
+from unittest import mock
+
+import pytest
+
+from autochain.agent.json_repair import extract_json_text, repair_json
+from autochain.agent.message import AIMessage
+from autochain.agent.structs import AgentOutputParser
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"a": 1, "b": [1, 2,],}', {"a": 1, "b": [1, 2]}),
+        ("{'a': 'it\\'s', 'b': \"say 'hi'\"}", {"a": "it's", "b": "say 'hi'"}),
+        ('{"a": "line 1\nline 2"}', {"a": "line 1\nline 2"}),
+        ('{"a": True, "b": None}', {"a": True, "b": None}),
+        ('{"a": {"b": [1, 2', {"a": {"b": [1, 2]}}),
+        ('{"a": "truncated', {"a": "truncated"}),
+        ('{"a": 1, "b":', {"a": 1, "b": None}),
+    ],
+)
+def test_repair_json(text, expected):
+    assert json.loads(repair_json(text)) == expected
+
+
+def test_extract_json_text():
+    assert extract_json_text('Sure!\n```json\n{"a": 1}\n```\nDone') == '{"a": 1}'
+    assert extract_json_text('{"a": 1} hope it helps') == '{"a": 1}'
+    assert extract_json_text('{"a": {"b": 1}, "c": "trunc') == (
+        '{"a": {"b": 1}, "c": "trunc'
+    )
+    # code fences inside of JSON strings are kept
+    text = '{"response": "Run:\n```python\nprint({})\n```"}'
+    assert extract_json_text(text) == text
+    assert extract_json_text("```json\n{'a': 1}\n```") == "{'a': 1}"
+
+
+def test_load_json_output_repaired_locally():
+    AgentOutputParser.json_output_counts.clear()
+    with mock.patch("autochain.agent.structs.ChatOpenAI") as chat_openai:
+        assert AgentOutputParser.load_json_output(AIMessage(content='{"a": 1}')) == {
+            "a": 1
+        }
+        assert AgentOutputParser.load_json_output(
+            AIMessage(content="```json\n{'a': 1,\n```")
+        ) == {"a": 1}
+
+    chat_openai.assert_not_called()
+    assert AgentOutputParser.json_output_counts == {"parsed": 1, "repaired": 1}
@@ -0,0 +1,74 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+
+from autochain.agent.message import (
+    ChatMessageHistory,
+    MessageType,
+    SystemMessage,
+    UserMessage,
+)
+
+
+def test_format_message_is_extended_incrementally():
+    history = ChatMessageHistory()
+    assert history.format_message() == ""
+
+    history.save_message("user query", MessageType.UserMessage)
+    assert history.format_message() == "User: user query\n"
+
+    history.save_message(
+        "Sunny",
+        MessageType.FunctionMessage,
+        name="get_weather",
+        conversational_message="get weather",
+    )
+    history.messages.append(SystemMessage(content="system message"))
+    assert history.format_message() == (
+        "User: user query\nAction: get weather\nSystem: system message\n"
+    )
+
+    history.clear()
+    assert history.format_message() == ""
+
+
+def test_format_message_after_messages_replaced():
+    history = ChatMessageHistory(messages=[UserMessage(content="first")])
+    assert history.format_message() == "User: first\n"
+
+    history.messages = [UserMessage(content="second")]
+    assert history.format_message() == "User: second\n"
+
+    history.messages.pop()
+    assert history.format_message() == ""
+
+    history.messages.append(UserMessage(content="third"))
+    history.format_message()
+    history.messages[-1] = UserMessage(content="fourth")
+    assert history.format_message() == "User: fourth\n"
+
+
+def test_snapshot_keeps_rendered_history():
+    history = ChatMessageHistory()
+    history.save_message("user query", MessageType.UserMessage)
+    history.format_message()
+
+    snapshot = history.snapshot()
+    history.save_message("response", MessageType.AIMessage)
+
+    assert snapshot.format_message() == "User: user query\n"
+    assert history.format_message() == "User: user query\nAssistant: response\n"
+
+
+def test_format_message_concurrently():
+    history = ChatMessageHistory()
+
+    def _save_and_format(i):
+        history.save_message(f"query {i}", MessageType.UserMessage)
+        return history.format_message()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(_save_and_format, range(100)))
+
+    expected = "".join(f"User: {m.content}\n" for m in history.messages)
+    assert history.format_message() == expected
+    assert copy.deepcopy(history).format_message() == expected
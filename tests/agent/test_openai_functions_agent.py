@@ -1,3 +1,5 @@
+import json
+import threading
 from unittest import mock
 
 import pytest
@@ -8,8 +10,13 @@ from autochain.agent.message import (
 from autochain.agent.openai_functions_agent.openai_functions_agent import (
     OpenAIFunctionsAgent,
 )
+from autochain.agent.openai_functions_agent.output_parser import (
+    OpenAIFunctionOutputParser,
+)
 from autochain.agent.structs import AgentAction, AgentFinish
+from autochain.errors import OutputParserException
 from autochain.models.chat_openai import ChatOpenAI
+from autochain.tools.base import Tool
 
 
 @pytest.fixture
@@ -137,3 +144,180 @@ def test_estimate_confidence(openai_estimate_confidence_fixture):
     )
 
     assert is_confident
+
+
+def _function_call_choice(location: str, logprobs=None):
+    return {
+        "message": {
+            "role": "assistant",
+            "content": None,
+            "function_call": {
+                "name": "get_current_weather",
+                "arguments": json.dumps({"location": location}),
+            },
+        },
+        "logprobs": {"content": [{"logprob": lp} for lp in logprobs or []]},
+    }
+
+
+def test_logprob_confidence():
+    history = ChatMessageHistory()
+    history.save_message("what is the weather in Toronto", MessageType.UserMessage)
+    agent = OpenAIFunctionsAgent.from_llm_and_tools(
+        llm=ChatOpenAI(), tools=[], confidence_mode="logprob", min_confidence=4
+    )
+
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        return_value={
+            "choices": [_function_call_choice("Toronto", logprobs=[-0.01, -0.05])],
+            "usage": 10,
+        },
+    ) as generate_mock:
+        action = agent.plan(history=history, intermediate_steps=[])
+
+    assert action.tool_input == {"location": "Toronto"}
+    # confidence comes from the planning completion without another request
+    generate_mock.assert_called_once()
+    assert generate_mock.call_args.kwargs["logprobs"] is True
+
+
+def test_sampling_confidence():
+    history = ChatMessageHistory()
+    history.save_message("what is the weather in Toronto", MessageType.UserMessage)
+    agent = OpenAIFunctionsAgent.from_llm_and_tools(
+        llm=ChatOpenAI(temperature=0.7),
+        tools=[],
+        confidence_mode="sampling",
+        confidence_samples=3,
+        min_confidence=3,
+    )
+
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        return_value={
+            "choices": [
+                _function_call_choice("Paris"),
+                _function_call_choice("Toronto"),
+                _function_call_choice("Toronto"),
+            ],
+            "usage": 10,
+        },
+    ) as generate_mock:
+        action = agent.plan(history=history, intermediate_steps=[])
+
+    # the most common output is taken, two of three samples agree
+    assert action.tool_input == {"location": "Toronto"}
+    generate_mock.assert_called_once()
+    assert generate_mock.call_args.kwargs["n"] == 3
+
+
+def test_sampling_confidence_invalid_sample():
+    class LocationOutputParser(OpenAIFunctionOutputParser):
+        def parse(self, message):
+            action = super().parse(message)
+            if action.tool_input["location"] == "":
+                raise OutputParserException("Missing location")
+            return action
+
+    history = ChatMessageHistory()
+    history.save_message("what is the weather in Toronto", MessageType.UserMessage)
+    agent = OpenAIFunctionsAgent.from_llm_and_tools(
+        llm=ChatOpenAI(temperature=0.7),
+        tools=[],
+        output_parser=LocationOutputParser(),
+        confidence_mode="sampling",
+        confidence_samples=3,
+        min_confidence=3,
+    )
+
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        return_value={
+            "choices": [
+                _function_call_choice(""),
+                _function_call_choice("Toronto"),
+                _function_call_choice("Toronto"),
+            ],
+            "usage": 10,
+        },
+    ):
+        action = agent.plan(history=history, intermediate_steps=[])
+
+    # sample that could not be parsed counts as disagreement
+    assert action.tool_input == {"location": "Toronto"}
+
+
+def test_sampling_confidence_needs_temperature():
+    with pytest.raises(ValueError, match="temperature"):
+        OpenAIFunctionsAgent.from_llm_and_tools(
+            llm=ChatOpenAI(temperature=0), tools=[], confidence_mode="sampling"
+        )
+
+
+def test_sampling_planning_llm():
+    agent = OpenAIFunctionsAgent.from_llm_and_tools(
+        llm=ChatOpenAI(temperature=0.7, streaming=True),
+        tools=[],
+        confidence_mode="sampling",
+        confidence_samples=3,
+    )
+
+    planning_llm = agent._get_planning_llm()
+    # samples are not streamed
+    assert (planning_llm.n, planning_llm.streaming) == (3, False)
+    assert agent._get_planning_llm() is planning_llm
+
+    # planning model is copied again when the model or settings change
+    agent.confidence_samples = 5
+    assert agent._get_planning_llm().n == 5
+    agent.llm = ChatOpenAI(temperature=0.5)
+    assert agent._get_planning_llm().temperature == 0.5
+
+
+@pytest.mark.parametrize("confident", [True, False])
+def test_optimistic_execution(confident):
+    confidence_started = threading.Event()
+
+    def get_current_weather(location: str):
+        # tool runs while confidence is being estimated
+        assert confidence_started.wait(timeout=5)
+        return f"Sunny in {location}"
+
+    planned_outputs = []
+
+    def is_generation_confident(*args, **kwargs):
+        confidence_started.set()
+        planned_outputs.append(kwargs["agent_output"])
+        return confident
+
+    tool = Tool(func=get_current_weather, description="get weather", read_only=True)
+    agent = OpenAIFunctionsAgent.from_llm_and_tools(
+        llm=ChatOpenAI(), tools=[tool], optimistic_execution=True
+    )
+    history = ChatMessageHistory()
+    history.save_message("what is the weather in Toronto", MessageType.UserMessage)
+
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        return_value={"choices": [_function_call_choice("Toronto")], "usage": 10},
+    ), mock.patch.object(
+        OpenAIFunctionsAgent,
+        "is_generation_confident",
+        side_effect=is_generation_confident,
+    ):
+        action = agent.plan(history=history, intermediate_steps=[], retries=1)
+
+    # planned action is returned only if the generation is confident
+    if confident:
+        assert (action.tool, action.tool_input) == (
+            "get_current_weather",
+            {"location": "Toronto"},
+        )
+    else:
+        assert action is None
+    # output of the tool is only kept if the generation is confident
+    expected_output = "Sunny in Toronto" if confident else None
+    assert planned_outputs[0].get_precomputed_output() == expected_output
+    # tool_output is set by chain, so response of the action is not changed
+    assert planned_outputs[0].tool_output == ""
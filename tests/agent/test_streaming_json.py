@@ -0,0 +1,44 @@
+import json
+
+from autochain.agent.streaming_json import StreamingJSONParser
+
+OUTPUT = {
+    "thoughts": {"plan": 'say "hi" é', "need_use_tool": "No"},
+    "tool": {"name": "", "args": {"n": -1.5, "flags": [True, None]}},
+    "response": "Hello\nthere",
+}
+
+
+def test_streaming_json_parser():
+    text = "```json\n" + json.dumps(OUTPUT) + "\n```"
+    parser = StreamingJSONParser()
+    response_deltas = []
+    completed_before_response = None
+    for i in range(0, len(text), 3):
+        for path, delta in parser.feed(text[i : i + 3]):
+            if path == ("response",):
+                response_deltas.append(delta)
+                if completed_before_response is None:
+                    completed_before_response = parser.is_complete("tool")
+
+    assert parser.done and not parser.failed
+    assert parser.value == OUTPUT
+    assert len(response_deltas) > 1
+    assert "".join(response_deltas) == "Hello\nthere"
+    assert completed_before_response
+
+
+def test_streaming_json_parser_partial():
+    parser = StreamingJSONParser()
+    parser.feed('{"thoughts": {"need_use_tool": "Yes"}, "tool": {"name": "get_w')
+
+    assert parser.is_complete("thoughts", "need_use_tool")
+    assert not parser.is_complete("tool")
+    assert parser.get("tool", "name") is None
+    assert parser.get("thoughts", "need_use_tool") == "Yes"
+
+
+def test_streaming_json_parser_invalid():
+    parser = StreamingJSONParser()
+    parser.feed("{'thoughts': 1}")
+    assert parser.failed
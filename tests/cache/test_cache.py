@@ -0,0 +1,138 @@
+import asyncio
+import os
+import time
+from unittest import mock
+
+import pytest
+
+from autochain.agent.message import UserMessage
+from autochain.cache.in_memory_cache import InMemoryCache
+from autochain.cache.redis_cache import CLEAR_BATCH_SIZE, RedisCache
+from autochain.cache.sqlite_cache import SQLiteCache
+from autochain.models.ada_embedding import OpenAIAdaEncoder
+from autochain.models.chat_openai import ChatOpenAI
+from redis import Redis
+
+COMPLETION_RESPONSE = {
+    "choices": [{"message": {"role": "assistant", "content": "generated message"}}],
+    "usage": 10,
+}
+
+
+@pytest.fixture
+def openai_completion_fixture():
+    with mock.patch(
+        "openai.ChatCompletion.create", return_value=COMPLETION_RESPONSE
+    ) as create_mock:
+        yield create_mock
+
+
+def test_in_memory_cache_evicts_least_recently_used():
+    cache = InMemoryCache(max_size=2)
+    cache.update("a", 1)
+    cache.update("b", 2)
+    assert cache.lookup("a") == 1
+
+    cache.update("c", 3)
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") == 1
+    assert cache.lookup("c") == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_in_memory_cache_ttl():
+    cache = InMemoryCache(ttl=1)
+    cache.update("a", 1)
+    assert cache.lookup("a") == 1
+
+    with mock.patch("time.time", return_value=time.time() + 2):
+        assert cache.lookup("a") is None
+
+
+def test_sqlite_cache(tmp_path):
+    database_path = str(tmp_path / "cache.db")
+    cache = SQLiteCache(database_path=database_path)
+    cache.update("a", COMPLETION_RESPONSE)
+
+    # responses persist across cache instances
+    assert SQLiteCache(database_path=database_path).lookup("a") == COMPLETION_RESPONSE
+
+    cache.clear()
+    assert cache.lookup("a") is None
+
+
+def test_redis_cache_clear_in_batches():
+    class Pipeline:
+        def __init__(self):
+            self.keys = []
+            self.batches = []
+
+        def __len__(self):
+            return len(self.keys)
+
+        def unlink(self, key):
+            self.keys.append(key)
+
+        def execute(self):
+            self.batches.append(self.keys)
+            self.keys = []
+
+    pipeline = Pipeline()
+    redis_client = mock.Mock(spec=Redis)
+    redis_client.pipeline.return_value = pipeline
+    keys = [f"autochain:llm_cache:{i}" for i in range(CLEAR_BATCH_SIZE + 1)]
+    redis_client.scan_iter.return_value = iter(keys)
+
+    RedisCache(redis_client=redis_client).clear()
+
+    assert pipeline.batches == [keys[:CLEAR_BATCH_SIZE], keys[CLEAR_BATCH_SIZE:]]
+    redis_client.delete.assert_not_called()
+
+
+def test_chat_openai_cache(openai_completion_fixture):
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    cache = InMemoryCache()
+    model = ChatOpenAI(temperature=0, cache=cache)
+    messages = [UserMessage(content="test message")]
+
+    first = model.generate(messages)
+    second = model.generate(messages)
+    asyncio.run(model.agenerate(messages))
+
+    assert openai_completion_fixture.call_count == 1
+    assert first.generations[0].message.content == "generated message"
+    assert second.generations[0].message.content == "generated message"
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    model.generate([UserMessage(content="another message")])
+    assert openai_completion_fixture.call_count == 2
+
+
+def test_chat_openai_cache_skips_sampling(openai_completion_fixture):
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    messages = [UserMessage(content="test message")]
+
+    model = ChatOpenAI(temperature=0.7, cache=InMemoryCache())
+    model.generate(messages)
+    model.generate(messages)
+    assert openai_completion_fixture.call_count == 2
+
+    openai_completion_fixture.reset_mock()
+    model = ChatOpenAI(temperature=0.7, cache=InMemoryCache(), force_cache=True)
+    model.generate(messages)
+    model.generate(messages)
+    assert openai_completion_fixture.call_count == 1
+
+
+def test_encoder_cache():
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    with mock.patch(
+        "openai.Embedding.create",
+        return_value={"data": [{"embedding": [0.1, 0.2]}]},
+    ) as create_mock:
+        encoder = OpenAIAdaEncoder(cache=InMemoryCache())
+        encoder.encode(["hello"])
+        result = encoder.encode(["hello"])
+
+    assert create_mock.call_count == 1
+    assert list(result.embeddings[0]) == [0.1, 0.2]
@@ -0,0 +1,535 @@
+import asyncio
+import json
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+from autochain.agent.conversational_agent.conversational_agent import (
+    ConversationalAgent,
+)
+from autochain.agent.openai_functions_agent.openai_functions_agent import (
+    OpenAIFunctionsAgent,
+)
+from autochain.agent.message import MessageType
+from autochain.agent.structs import AgentAction, AgentFinish
+from autochain.chain.chain import Chain
+from autochain.memory.buffer_memory import BufferMemory
+from autochain.memory.history_window import LastNMessagesWindow
+from autochain.models.chat_openai import ChatOpenAI
+from autochain.tools.base import Tool
+
+
+def get_weather(location: str):
+    return f"Sunny in {location}"
+
+
+def _openai_response(content: str):
+    return {
+        "choices": [{"message": {"role": "assistant", "content": content}}],
+        "usage": 10,
+    }
+
+
+def side_effect(*args, **kwargs):
+    prompt = kwargs["messages"][0]["content"]
+    if "Answer with yes or no" in prompt:
+        return _openai_response("no")
+    if "has_arg_value" in prompt:
+        return _openai_response(
+            json.dumps({"has_arg_value": "Yes", "clarifying_question": ""})
+        )
+    if "Sunny in Toronto" in prompt:
+        return _openai_response(
+            json.dumps(
+                {
+                    "thoughts": {"plan": "respond", "need_use_tool": "No"},
+                    "tool": {"name": "", "args": {}},
+                    "response": "It is sunny in Toronto",
+                }
+            )
+        )
+    return _openai_response(
+        json.dumps(
+            {
+                "thoughts": {"plan": "check weather", "need_use_tool": "Yes"},
+                "tool": {"name": "get_weather", "args": {"location": "Toronto"}},
+                "response": "",
+            }
+        )
+    )
+
+
+async def async_side_effect(*args, **kwargs):
+    return side_effect(*args, **kwargs)
+
+
+@pytest.fixture
+def openai_chain_fixture():
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        side_effect=side_effect,
+    ), mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.agenerate_with_retry",
+        side_effect=async_side_effect,
+    ):
+        yield
+
+
+def create_chain() -> Chain:
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    tool = Tool(func=get_weather, description="get weather for a location")
+    agent = ConversationalAgent.from_llm_and_tools(llm=ChatOpenAI(), tools=[tool])
+    return Chain(agent=agent, memory=BufferMemory())
+
+
+def test_run(openai_chain_fixture):
+    chain = create_chain()
+    output = chain.run("what is the weather in Toronto")
+
+    assert output["message"] == "It is sunny in Toronto"
+    steps = output["intermediate_steps"]
+    assert len(steps) == 1
+    assert isinstance(steps[0], AgentAction)
+    assert steps[0].tool_output == "Sunny in Toronto"
+
+
+def test_arun(openai_chain_fixture):
+    chain = create_chain()
+    output = asyncio.run(chain.arun("what is the weather in Toronto"))
+
+    assert output["message"] == "It is sunny in Toronto"
+    steps = output["intermediate_steps"]
+    assert len(steps) == 1
+    assert steps[0].tool_output == "Sunny in Toronto"
+
+
+def test_arun_concurrent_conversations(openai_chain_fixture):
+    async def _run_all():
+        chains = [create_chain() for _ in range(5)]
+        return await asyncio.gather(
+            *[chain.arun("what is the weather in Toronto") for chain in chains]
+        )
+
+    outputs = asyncio.run(_run_all())
+    assert [o["message"] for o in outputs] == ["It is sunny in Toronto"] * 5
+
+
+@pytest.fixture
+def openai_stream_fixture():
+    tokens = ["It is ", "sunny ", "in Toronto"]
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        return_value=iter(
+            [
+                {"choices": [{"delta": {"content": t}, "finish_reason": None}]}
+                for t in tokens
+            ]
+        ),
+    ):
+        yield
+
+
+def test_stream(openai_stream_fixture):
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    agent = OpenAIFunctionsAgent.from_llm_and_tools(llm=ChatOpenAI(), tools=[])
+    memory = BufferMemory()
+    chain = Chain(agent=agent, memory=memory)
+
+    tokens = list(chain.stream("what is the weather in Toronto"))
+
+    assert tokens == ["It is ", "sunny ", "in Toronto"]
+    assert chain.memory.load_conversation().format_message() == (
+        "User: what is the weather in Toronto\nAssistant: It is sunny in Toronto\n"
+    )
+
+
+def _stream_chunks(content: str, on_finish=None):
+    for i in range(0, len(content), 5):
+        yield {
+            "choices": [
+                {"delta": {"content": content[i : i + 5]}, "finish_reason": None}
+            ]
+        }
+    if on_finish:
+        on_finish(content)
+
+
+def create_streaming_chain(tool_func, cancel_planning_early: bool = True) -> Chain:
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    tool = Tool(
+        name="get_weather", func=tool_func, description="get weather for a location"
+    )
+    agent = ConversationalAgent.from_llm_and_tools(
+        llm=ChatOpenAI(streaming=True), tools=[tool]
+    )
+    return Chain(
+        agent=agent,
+        memory=BufferMemory(),
+        cancel_planning_early=cancel_planning_early,
+    )
+
+
+def test_stream_conversational_agent():
+    tool_started = threading.Event()
+    tool_started_before_finish = []
+
+    def get_weather_tool(location: str):
+        tool_started.set()
+        return f"Sunny in {location}"
+
+    def on_finish(content: str):
+        if '"need_use_tool": "Yes"' in content:
+            # errors raised in the stream are handled by chain, so check the result later
+            tool_started_before_finish.append(tool_started.wait(timeout=5))
+
+    def stream_side_effect(*args, **kwargs):
+        response = side_effect(*args, **kwargs)
+        if not kwargs.get("stream"):
+            return response
+        content = response["choices"][0]["message"]["content"]
+        return _stream_chunks(content, on_finish)
+
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        side_effect=stream_side_effect,
+    ):
+        chain = create_streaming_chain(get_weather_tool, cancel_planning_early=False)
+        tokens = list(chain.stream("what is the weather in Toronto"))
+
+    # tool runs before the completion finishes
+    assert tool_started_before_finish == [True]
+    # response field is streamed in deltas
+    assert len(tokens) > 1
+    assert "".join(tokens) == "It is sunny in Toronto"
+    assert chain.memory.load_conversation().messages[-1].content == (
+        "It is sunny in Toronto"
+    )
+
+
+def test_cancel_planning_early():
+    finished_completions = []
+
+    def stream_side_effect(*args, **kwargs):
+        response = side_effect(*args, **kwargs)
+        if not kwargs.get("stream"):
+            return response
+        content = response["choices"][0]["message"]["content"]
+        return _stream_chunks(content, finished_completions.append)
+
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        side_effect=stream_side_effect,
+    ):
+        chain = create_streaming_chain(get_weather)
+        output = chain.run("what is the weather in Toronto")
+        assert output["message"] == "It is sunny in Toronto"
+        assert output["intermediate_steps"][0].tool_output == "Sunny in Toronto"
+
+        tokens = list(chain.stream("what is the weather in Toronto"))
+        assert "".join(tokens) == "It is sunny in Toronto"
+
+    # completions planning the tool are cancelled, only the responses are finished
+    planning_completions = [c for c in finished_completions if "thoughts" in c]
+    assert len(planning_completions) == 2
+    assert all('"need_use_tool": "No"' in c for c in planning_completions)
+
+
+def test_cancel_planning_early_only_for_agents_planning_early():
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    agent = OpenAIFunctionsAgent.from_llm_and_tools(
+        llm=ChatOpenAI(streaming=True), tools=[]
+    )
+    chain = Chain(agent=agent, memory=BufferMemory(), cancel_planning_early=True)
+    action = AgentAction(tool="get_weather", tool_input={}, model_response="checking")
+
+    with mock.patch.object(
+        OpenAIFunctionsAgent, "plan", return_value=action
+    ) as plan_mock, mock.patch.object(
+        OpenAIFunctionsAgent, "stream_plan"
+    ) as stream_plan_mock:
+        assert chain._plan(chain.prep_inputs("what is the weather")) == action
+
+    # planning keeps confidence checks and model_response of the agent
+    assert plan_mock.called
+    stream_plan_mock.assert_not_called()
+
+
+def test_speculative_planning():
+    plan_started = threading.Event()
+
+    def speculative_side_effect(*args, **kwargs):
+        prompt = kwargs["messages"][0]["content"]
+        if "Answer with yes or no" in prompt:
+            # should_answer only returns after planning has started in parallel
+            assert plan_started.wait(timeout=5)
+            return _openai_response("yes" if "thank you" in prompt else "no")
+        if "RESPONSE FORMAT" in prompt and "has_arg_value" not in prompt:
+            plan_started.set()
+        return side_effect(*args, **kwargs)
+
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        side_effect=speculative_side_effect,
+    ) as generate_mock:
+        chain = create_chain()
+        chain.speculative_planning = True
+
+        output = chain.run("what is the weather in Toronto")
+        assert output["message"] == "It is sunny in Toronto"
+
+        plan_started.clear()
+        generate_mock.reset_mock()
+        output = chain.run("thank you")
+        # the speculative plan is discarded and no more step is taken
+        assert output["message"] == "Thank your for contacting"
+        assert len(output["intermediate_steps"]) == 1
+        prompts = [
+            c.kwargs["messages"][0]["content"] for c in generate_mock.call_args_list
+        ]
+        assert not any("has_arg_value" in p for p in prompts)
+
+
+def test_speculative_planning_arun(openai_chain_fixture):
+    chain = create_chain()
+    chain.speculative_planning = True
+    output = asyncio.run(chain.arun("what is the weather in Toronto"))
+
+    assert output["message"] == "It is sunny in Toronto"
+    assert output["intermediate_steps"][0].tool_output == "Sunny in Toronto"
+
+
+def test_parallel_actions():
+    barrier = threading.Barrier(3, timeout=5)
+
+    def get_weather_concurrently(location: str):
+        # all three tools need to run at the same time to pass the barrier
+        barrier.wait()
+        return f"Sunny in {location}"
+
+    def parallel_side_effect(*args, **kwargs):
+        prompt = kwargs["messages"][0]["content"]
+        if "Answer with yes or no" in prompt:
+            return _openai_response("no")
+        if "Sunny in Paris" in prompt:
+            return _openai_response(
+                json.dumps(
+                    {
+                        "thoughts": {"plan": "respond", "need_use_tool": "No"},
+                        "tool": {"name": "", "args": {}},
+                        "response": "It is sunny everywhere",
+                    }
+                )
+            )
+        return _openai_response(
+            json.dumps(
+                {
+                    "thoughts": {"plan": "check weather", "need_use_tool": "Yes"},
+                    "tool": [
+                        {
+                            "name": "get_weather_concurrently",
+                            "args": {"location": city},
+                            "has_arg_value": "Yes",
+                        }
+                        for city in ["Toronto", "Paris", "Tokyo"]
+                    ],
+                    "response": "",
+                }
+            )
+        )
+
+    async def async_parallel_side_effect(*args, **kwargs):
+        return parallel_side_effect(*args, **kwargs)
+
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    tool = Tool(func=get_weather_concurrently, description="get weather")
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        side_effect=parallel_side_effect,
+    ), mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.agenerate_with_retry",
+        side_effect=async_parallel_side_effect,
+    ):
+        agent = ConversationalAgent.from_llm_and_tools(
+            llm=ChatOpenAI(), tools=[tool], single_pass_planning=True
+        )
+        chain = Chain(agent=agent, memory=BufferMemory())
+        output = chain.run("what is the weather in Toronto, Paris and Tokyo")
+
+        chain = Chain(agent=agent, memory=BufferMemory())
+        async_output = asyncio.run(
+            chain.arun("what is the weather in Toronto, Paris and Tokyo")
+        )
+
+    for o in [output, async_output]:
+        assert o["message"] == "It is sunny everywhere"
+        assert [s.tool_output for s in o["intermediate_steps"]] == [
+            "Sunny in Toronto",
+            "Sunny in Paris",
+            "Sunny in Tokyo",
+        ]
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_repeated_parallel_action_records_no_inputs(run_async):
+    chain = create_chain()
+    get_weather_tool = Tool(func=mock.Mock(), name="get_weather", description="")
+    get_time_tool = Tool(func=mock.Mock(), name="get_time", description="")
+    name_to_tool_map = {"get_weather": get_weather_tool, "get_time": get_time_tool}
+    chain.memory.save_memory("get_time", {"location": "Paris"})
+    actions = [
+        AgentAction(tool="get_weather", tool_input={"location": "Toronto"}),
+        AgentAction(tool="get_time", tool_input={"location": "Paris"}),
+    ]
+
+    if run_async:
+        output = asyncio.run(chain._aexecute_actions(name_to_tool_map, actions))
+    else:
+        output = chain._execute_actions(name_to_tool_map, actions)
+
+    assert isinstance(output, AgentFinish)
+    get_weather_tool.func.assert_not_called()
+    # action that was not run is not a repeat on the next turn
+    assert chain.memory.load_memory("get_weather") is None
+
+
+def test_prep_inputs_isolated_from_memory(openai_chain_fixture):
+    chain = create_chain()
+    chain.memory.save_memory(key="intermediate_steps", value=[])
+    inputs = chain.prep_inputs("what is the weather in Toronto")
+
+    chain.memory.save_conversation("response", MessageType.AIMessage)
+    inputs["intermediate_steps"].append(AgentAction(tool="get_weather", tool_input=""))
+
+    assert len(inputs["history"].messages) == 1
+    assert chain.memory.load_memory("intermediate_steps") == []
+    assert len(chain.memory.load_conversation().messages) == 2
+
+
+def test_history_window(openai_chain_fixture):
+    chain = create_chain()
+    chain.memory.history_window = LastNMessagesWindow(max_messages=1)
+    chain.memory.save_conversation("first query", MessageType.UserMessage)
+    chain.memory.save_conversation("first response", MessageType.AIMessage)
+
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        side_effect=side_effect,
+    ) as generate_mock:
+        chain.run("what is the weather in Toronto")
+
+    prompts = [c.kwargs["messages"][0]["content"] for c in generate_mock.call_args_list]
+    assert not any("first query" in p for p in prompts)
+    # entire history is still saved in memory
+    assert len(chain.memory.load_conversation().messages) == 5
+
+
+def test_skip_action_run_by_agent():
+    chain = create_chain()
+    tool = Tool(
+        func=mock.Mock(return_value="rainy"), name="get_weather", description=""
+    )
+    action = AgentAction(tool="get_weather", tool_input={"location": "Toronto"})
+    action.set_precomputed_output("sunny")
+
+    assert chain._run_action({"get_weather": tool}, action).tool_output == "sunny"
+    tool.func.assert_not_called()
+
+    # tool runs again if its input is clarified after agent ran it
+    action = AgentAction(tool="get_weather", tool_input={"location": "Toronto"})
+    action.set_precomputed_output("sunny")
+    action.tool_input["location"] = "Toronto, Canada"
+    output = asyncio.run(chain._arun_action({"get_weather": tool}, action))
+    assert output.tool_output == "rainy"
+    tool.func.assert_called_once_with(location="Toronto, Canada")
+
+
+def test_run_fixed_action_input():
+    chain = create_chain()
+
+    def get_weather_in_city(city: str):
+        if city != "Toronto":
+            raise ValueError(f"Unknown city {city}")
+        return "Sunny in Toronto"
+
+    tool = Tool(func=get_weather_in_city, description="get weather for a city")
+    action = AgentAction(tool=tool.name, tool_input={"city": "toronto"})
+    fixed_action = AgentAction(tool=tool.name, tool_input={"city": "Toronto"})
+
+    with mock.patch.object(
+        ConversationalAgent, "fix_action_input", return_value=fixed_action
+    ), mock.patch.object(
+        ConversationalAgent, "afix_action_input", return_value=fixed_action
+    ):
+        output = chain._run_action({tool.name: tool}, action.copy())
+        async_output = asyncio.run(chain._arun_action({tool.name: tool}, action.copy()))
+
+    for o in [output, async_output]:
+        assert o.tool_input == {"city": "Toronto"}
+        assert o.tool_output == "Sunny in Toronto"
+
+
+def test_speculative_planning_cancelled_on_error(openai_chain_fixture):
+    chain = create_chain()
+    chain.speculative_planning = True
+
+    async def _run():
+        plan_started = asyncio.Event()
+        plan_cancelled = asyncio.Event()
+
+        async def _aplan(inputs):
+            plan_started.set()
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                plan_cancelled.set()
+                raise
+
+        async def _ashould_answer(inputs):
+            await plan_started.wait()
+            raise RuntimeError("should_answer failed")
+
+        with mock.patch.object(Chain, "_aplan", side_effect=_aplan), mock.patch.object(
+            Chain, "ashould_answer", side_effect=_ashould_answer
+        ):
+            with pytest.raises(RuntimeError):
+                await chain.arun("what is the weather in Toronto")
+        await asyncio.wait_for(plan_cancelled.wait(), timeout=1)
+
+    asyncio.run(_run())
+
+
+def test_stream_next_step_adds_model_response():
+    def stream_side_effect(*args, **kwargs):
+        content = json.dumps(
+            {
+                "thoughts": {"plan": "check weather", "need_use_tool": "Yes"},
+                "tool": {"name": "get_weather", "args": {"location": "Toronto"}},
+                "response": "Let me check the weather",
+            }
+        )
+        return _stream_chunks(content)
+
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        side_effect=stream_side_effect,
+    ):
+        chain = create_streaming_chain(get_weather, cancel_planning_early=False)
+        inputs = chain.prep_inputs("what is the weather in Toronto")
+        planned_actions = []
+
+        def process_planned_output(name_to_tool_map, output, inputs):
+            planned_actions.append(output)
+            return output.copy()
+
+        with mock.patch.object(
+            Chain, "_process_planned_output", side_effect=process_planned_output
+        ):
+            *_, output = chain.stream_next_step(
+                {t.name: t for t in chain.agent.tools}, inputs
+            )
+
+    # action planned early is processed without model_response, which is added after
+    assert planned_actions[0].model_response == ""
+    assert output.model_response == "Let me check the weather"
@@ -0,0 +1,86 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import redis
+
+from autochain.agent.message import MessageType, UserMessage
+from autochain.memory.async_redis_memory import AsyncRedisMemory
+from autochain.memory.codec import JSONCodec
+from redis.asyncio import ConnectionPool, Redis
+
+
+@pytest.fixture
+def mock_redis():
+    mock_redis = MagicMock(spec=Redis)
+    mock_redis.pipeline.return_value.execute = AsyncMock()
+    for command in ["get", "set", "lrange", "scan", "unlink"]:
+        setattr(mock_redis, command, AsyncMock())
+    return mock_redis
+
+
+def test_async_redis_kv_memory(mock_redis):
+    mock_redis.get.side_effect = [JSONCodec().encode("v"), None]
+    mock_redis.scan.side_effect = [(3, [b"test:k"]), (0, [b"test:k2"])]
+    memory = AsyncRedisMemory(redis_key_prefix="test", redis_client=mock_redis)
+
+    async def _run():
+        await memory.asave_memory(key="k", value="v")
+        assert await memory.aload_memory(key="k") == "v"
+        assert await memory.aload_memory(key="k2", default="v2") == "v2"
+        await memory.aclear()
+
+    asyncio.run(_run())
+    assert mock_redis.unlink.await_count == 2
+    assert memory.round_trips == 7
+
+
+def test_async_redis_memory_sync_methods(mock_redis):
+    sync_redis = MagicMock(spec=redis.Redis)
+    sync_redis.get.return_value = JSONCodec().encode("v")
+    memory = AsyncRedisMemory(
+        redis_key_prefix="test", redis_client=mock_redis, sync_redis_client=sync_redis
+    )
+
+    memory.save_memory(key="k", value="v")
+    assert memory.load_memory(key="k") == "v"
+    sync_redis.get.assert_called_with("test:k")
+    mock_redis.get.assert_not_called()
+
+
+def test_async_redis_memory_creates_sync_client():
+    pool = ConnectionPool.from_url("redis://localhost:6380/2")
+    memory = AsyncRedisMemory(redis_key_prefix="test", connection_pool=pool)
+
+    sync_client = memory._sync_client
+    assert isinstance(sync_client, redis.Redis)
+    assert sync_client.connection_pool.connection_kwargs["port"] == 6380
+    assert memory._sync_client is sync_client
+
+
+def test_async_redis_conversation_memory(mock_redis):
+    memory = AsyncRedisMemory(redis_key_prefix="test", redis_client=mock_redis)
+    encoded_user_message = memory._encode_message(UserMessage(content="user query"))
+    mock_redis.pipeline.return_value.execute.return_value = [
+        1,
+        True,
+        [encoded_user_message],
+        None,
+    ]
+
+    conversation, steps = asyncio.run(
+        memory.asave_conversation_and_load(
+            "user query", MessageType.UserMessage, key="intermediate_steps", default=[]
+        )
+    )
+
+    assert conversation.format_message() == "User: user query\n"
+    assert steps == []
+    assert memory.round_trips == 1
+    assert memory.turn_round_trips == 1
+
+
+def test_async_redis_memory_connection_pool():
+    pool = ConnectionPool()
+    memory = AsyncRedisMemory(redis_key_prefix="test", connection_pool=pool)
+    assert memory.redis_client.connection_pool is pool
@@ -0,0 +1,69 @@
+import pytest
+from pydantic import BaseModel
+
+from autochain.agent.message import FunctionMessage, UserMessage
+from autochain.agent.structs import AgentAction, AgentFinish
+from autochain.memory.codec import JSONCodec, MsgpackCodec, register_model
+
+
+class CustomValue(BaseModel):
+    value: int
+
+
+@pytest.mark.parametrize("codec_class", [JSONCodec, MsgpackCodec])
+def test_codec_round_trip(codec_class):
+    if codec_class is MsgpackCodec:
+        pytest.importorskip("msgpack")
+    codec = codec_class()
+    values = [
+        "text",
+        {"k": [1, 2.5, None, True]},
+        UserMessage(content="user query"),
+        FunctionMessage(
+            content="Sunny", name="get_weather", conversational_message="get weather"
+        ),
+        [AgentAction(tool="get_weather", tool_input={"location": "Toronto"})],
+        AgentFinish(
+            message="done",
+            log="",
+            intermediate_steps=[AgentAction(tool="t", tool_input="i", tool_output="o")],
+        ),
+    ]
+    for value in values:
+        assert codec.decode(codec.encode(value)) == value
+
+
+def test_codec_compression():
+    pytest.importorskip("zstandard")
+    action = AgentAction(tool="search", tool_input="q", tool_output="result " * 1000)
+    compressed = JSONCodec(compression_threshold=1024).encode(action)
+    uncompressed = JSONCodec(compression_threshold=None).encode(action)
+
+    assert len(compressed) < len(uncompressed) / 10
+    assert JSONCodec().decode(compressed) == action
+
+
+def test_codec_only_decodes_registered_models():
+    codec = JSONCodec()
+    with pytest.raises(TypeError):
+        codec.encode(CustomValue(value=1))
+
+    register_model(CustomValue)
+    assert codec.decode(codec.encode(CustomValue(value=1))) == CustomValue(value=1)
+
+    with pytest.raises(ValueError):
+        codec.decode(b"\x80\x04unknown format")
+
+
+def test_codec_rejects_unregistered_model_name():
+    codec = JSONCodec()
+    encoded = codec.encode({"__model__": "UnknownModel", "value": 1})
+    with pytest.raises(ValueError, match="UnknownModel"):
+        codec.decode(encoded)
+
+
+def test_codec_json_types():
+    codec = JSONCodec()
+    assert codec.decode(codec.encode({"k": (1, 2)})) == {"k": [1, 2]}
+    with pytest.raises(TypeError):
+        codec.encode({1, 2})
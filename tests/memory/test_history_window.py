@@ -0,0 +1,120 @@
+import asyncio
+import os
+from unittest import mock
+
+from autochain.agent.message import ChatMessageHistory, MessageType, SystemMessage
+from autochain.memory.buffer_memory import BufferMemory
+from autochain.memory.history_window import (
+    LastNMessagesWindow,
+    SummaryWindow,
+    TokenBudgetWindow,
+)
+from autochain.models.chat_openai import ChatOpenAI
+
+
+def create_history(num_messages: int) -> ChatMessageHistory:
+    history = ChatMessageHistory()
+    for i in range(num_messages):
+        message_type = MessageType.UserMessage if i % 2 == 0 else MessageType.AIMessage
+        history.save_message(f"message {i}", message_type)
+    return history
+
+
+def test_last_n_messages_window():
+    history = create_history(5)
+    history.set_window(LastNMessagesWindow(max_messages=2))
+
+    assert history.windowed().format_message() == (
+        "Assistant: message 3\nUser: message 4\n"
+    )
+    assert len(history.messages) == 5
+
+
+def test_token_budget_window():
+    history = create_history(5)
+    # every rendered message counts as 3 tokens
+    history.set_window(
+        TokenBudgetWindow(max_tokens=7, token_counter=lambda text: len(text.split()))
+    )
+    assert [m.content for m in history.windowed().messages] == [
+        "message 3",
+        "message 4",
+    ]
+
+    # latest message is kept even if it does not fit
+    history.set_window(TokenBudgetWindow(max_tokens=1))
+    assert [m.content for m in history.windowed().messages] == ["message 4"]
+
+    # tokens are counted with tokenizer of the model if it is set
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    llm = ChatOpenAI(temperature=0)
+    with mock.patch.object(
+        ChatOpenAI, "count_text_tokens", side_effect=lambda text: 4
+    ) as count_text_tokens:
+        history.set_window(TokenBudgetWindow(max_tokens=8, llm=llm))
+        assert len(history.windowed().messages) == 2
+    assert count_text_tokens.called
+
+
+def test_summary_window():
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    memory = BufferMemory()
+    window = SummaryWindow(
+        llm=ChatOpenAI(temperature=0), max_messages=2, summary_batch_size=2
+    )
+
+    with mock.patch(
+        "openai.ChatCompletion.create",
+        return_value={
+            "choices": [{"message": {"role": "assistant", "content": "summary"}}],
+            "usage": 10,
+        },
+    ) as create_mock:
+        history = create_history(3)
+        history.set_window(window, memory)
+        # not enough messages to summarize yet
+        assert history.windowed().messages == history.messages
+
+        history = create_history(5)
+        history.set_window(window, memory)
+        windowed = history.windowed()
+        history.windowed()
+        history.set_window(window, memory)
+        history.windowed()
+
+    assert create_mock.call_count == 1
+    assert "message 2" in create_mock.call_args.kwargs["messages"][0]["content"]
+    assert windowed.messages[0] == SystemMessage(
+        content="Summary of earlier conversation: summary"
+    )
+    assert [m.content for m in windowed.messages[1:]] == ["message 3", "message 4"]
+    assert memory.load_memory("history_summary")["summarized_count"] == 3
+
+
+def test_summary_window_async():
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    memory = BufferMemory()
+    window = SummaryWindow(
+        llm=ChatOpenAI(temperature=0), max_messages=2, summary_batch_size=2
+    )
+    history = create_history(5)
+    history.set_window(window, memory)
+
+    with mock.patch(
+        "openai.ChatCompletion.acreate",
+        new_callable=mock.AsyncMock,
+        return_value={
+            "choices": [{"message": {"role": "assistant", "content": "summary"}}],
+            "usage": 10,
+        },
+    ) as acreate_mock, mock.patch("openai.ChatCompletion.create") as create_mock:
+        windowed = asyncio.run(history.awindowed())
+        # agents formatting prompts get the window applied asynchronously
+        assert history.windowed() is windowed
+
+    assert acreate_mock.await_count == 1
+    create_mock.assert_not_called()
+    assert windowed.messages[0] == SystemMessage(
+        content="Summary of earlier conversation: summary"
+    )
+    assert memory.load_memory("history_summary")["summarized_count"] == 3
@@ -1,16 +1,23 @@
 import pickle
 from unittest.mock import MagicMock
 
-from autochain.agent.message import AIMessage, MessageType, UserMessage
+import pytest
+from pydantic import ValidationError
+
+from autochain.agent.message import FunctionMessage, MessageType, UserMessage
+from autochain.agent.structs import AgentAction
+from autochain.memory.codec import JSONCodec
 from autochain.memory.redis_memory import RedisMemory
+from redis import ConnectionPool
 from redis.client import Redis
 
 
 def test_redis_kv_memory():
     mock_redis = MagicMock(spec=Redis)
-    pickled = pickle.dumps("v")
-    mock_redis.get.side_effect = [pickled, None, None]
+    encoded = JSONCodec().encode("v")
+    mock_redis.get.side_effect = [encoded, None, None]
 
+    mock_redis.scan.side_effect = [(1, [b"test:k"]), (0, [])]
     memory = RedisMemory(redis_key_prefix="test", redis_client=mock_redis)
 
     memory.save_memory(key="k", value="v")
@@ -21,29 +28,109 @@ def test_redis_kv_memory():
     assert default_value == "v2"
 
     memory.clear()
+    mock_redis.unlink.assert_called_once_with(b"test:k")
+    mock_redis.keys.assert_not_called()
     assert memory.load_memory(key="k") is None
 
 
 def test_redis_conversation_memory():
     mock_redis = MagicMock(spec=Redis)
+    pipeline = mock_redis.pipeline.return_value
     user_query = "user query"
     ai_response = "response to user"
-    user_message = UserMessage(content=user_query)
-    ai_message = AIMessage(content=ai_response)
-    mock_redis.get.side_effect = [
-        None,
-        None,
-        pickle.dumps([user_message, ai_message]),
-        None,
-    ]
 
     memory = RedisMemory(redis_key_prefix="test", redis_client=mock_redis)
     memory.save_conversation(user_query, MessageType.UserMessage)
     memory.save_conversation(ai_response, MessageType.AIMessage)
 
+    # every message is appended to the list with expiry refreshed in the same round trip
+    assert pipeline.execute.call_count == 2
+    pipeline.expire.assert_called_with(
+        "test:ChatMessageHistory:messages", memory.expire_time
+    )
+    encoded_messages = [c.args[1] for c in pipeline.rpush.call_args_list]
+
+    mock_redis.lrange.side_effect = [encoded_messages, []]
+    mock_redis.scan.return_value = (0, [b"test:ChatMessageHistory:messages"])
     conversation = memory.load_conversation().format_message()
     assert conversation == "User: user query\nAssistant: response to user\n"
 
     memory.clear()
     message_after_clear = memory.load_conversation().format_message()
     assert message_after_clear == ""
+
+
+def test_redis_conversation_memory_last_n():
+    mock_redis = MagicMock(spec=Redis)
+    memory = RedisMemory(redis_key_prefix="test", redis_client=mock_redis)
+    function_message = FunctionMessage(
+        content="Sunny", name="get_weather", conversational_message="get weather"
+    )
+    mock_redis.lrange.return_value = [memory._encode_message(function_message)]
+
+    conversation = memory.load_conversation(last_n=1)
+
+    mock_redis.lrange.assert_called_with("test:ChatMessageHistory:messages", -1, -1)
+    assert conversation.messages == [function_message]
+
+
+def test_redis_memory_pipelines_round_trips():
+    mock_redis = MagicMock(spec=Redis)
+    pipeline = mock_redis.pipeline.return_value
+    memory = RedisMemory(redis_key_prefix="test", redis_client=mock_redis)
+    encoded_user_message = memory._encode_message(UserMessage(content="user query"))
+
+    pipeline.execute.return_value = [
+        1,
+        True,
+        [encoded_user_message],
+        JSONCodec().encode([]),
+    ]
+    conversation, steps = memory.save_conversation_and_load(
+        "user query", MessageType.UserMessage, key="intermediate_steps", default=[]
+    )
+    assert conversation.format_message() == "User: user query\n"
+    assert steps == []
+
+    pipeline.execute.return_value = [2, True, True]
+    memory.save_conversation_and_memory(
+        "response", MessageType.AIMessage, key="intermediate_steps", value=["step"]
+    )
+
+    pipeline.execute.return_value = [JSONCodec().encode({"k": 1}), True]
+    assert memory.replace_memory("tool", {"k": 2}) == {"k": 1}
+
+    assert memory.round_trips == 3
+    mock_redis.get.assert_not_called()
+    mock_redis.set.assert_not_called()
+
+    # a new user message starts the next turn
+    memory.save_conversation("next query", MessageType.UserMessage)
+    assert (memory.round_trips, memory.turn_round_trips) == (4, 1)
+
+
+def test_redis_memory_ignores_pickled_values(caplog):
+    mock_redis = MagicMock(spec=Redis)
+    pipeline = mock_redis.pipeline.return_value
+    memory = RedisMemory(redis_key_prefix="test", redis_client=mock_redis)
+    # value saved by a previous version, which pickled values
+    pickled_steps = pickle.dumps([AgentAction(tool="get_weather", tool_input={})])
+
+    mock_redis.get.return_value = pickled_steps
+    assert memory.load_memory(key="intermediate_steps", default=[]) == []
+    assert "unsupported format" in caplog.text
+
+    pipeline.execute.return_value = [1, True, [], pickled_steps]
+    conversation, steps = memory.save_conversation_and_load(
+        "user query", MessageType.UserMessage, key="intermediate_steps", default=[]
+    )
+    assert steps == []
+
+
+def test_redis_memory_connection_pool():
+    pool = ConnectionPool()
+    memory = RedisMemory(redis_key_prefix="test", connection_pool=pool)
+    assert memory.redis_client.connection_pool is pool
+
+    with pytest.raises(ValidationError):
+        RedisMemory(redis_key_prefix="test")
@@ -5,6 +5,7 @@ import pytest
 from autochain.tools.base import Tool
 
 from autochain.agent.message import UserMessage
+from autochain.errors import PromptTooLongError
 from autochain.models.base import LLMResult
 from autochain.models.chat_openai import ChatOpenAI, convert_tool_to_dict
 
@@ -110,3 +111,96 @@ def test_convert_tool_to_dict():
             "required": ["k"],
         },
     }
+
+
+def _stream_chunk(delta, finish_reason=None):
+    return {"choices": [{"delta": delta, "finish_reason": finish_reason}]}
+
+
+@pytest.fixture
+def openai_stream_fixture():
+    with mock.patch(
+        "autochain.models.chat_openai.ChatOpenAI.generate_with_retry",
+        return_value=iter(
+            [
+                _stream_chunk({"role": "assistant", "content": None}),
+                _stream_chunk(
+                    {"function_call": {"name": "get_weather", "arguments": ""}}
+                ),
+                _stream_chunk({"function_call": {"arguments": '{"location"'}}),
+                _stream_chunk({"function_call": {"arguments": ': "Toronto"}'}}),
+                _stream_chunk({}, finish_reason="function_call"),
+            ]
+        ),
+    ):
+        yield
+
+
+def test_chat_completion_stream(openai_stream_fixture):
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    model = ChatOpenAI(temperature=0)
+    chunks = list(model.stream([UserMessage(content="test message")]))
+
+    assert [c.function_call.get("arguments") for c in chunks[1:4]] == [
+        "",
+        '{"location"',
+        ': "Toronto"}',
+    ]
+    assert chunks[-1].finish_reason == "function_call"
+
+
+def test_chat_completion_streaming_generate(openai_stream_fixture):
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    model = ChatOpenAI(temperature=0, streaming=True)
+    response = model.generate([UserMessage(content="test message")])
+
+    message = response.generations[0].message
+    assert message.function_call == {
+        "name": "get_weather",
+        "arguments": '{"location": "Toronto"}',
+    }
+    token_usage = response.llm_output["token_usage"]
+    assert token_usage["prompt_tokens"] > 0
+    assert token_usage["completion_tokens"] > 0
+    assert token_usage["total_tokens"] == (
+        token_usage["prompt_tokens"] + token_usage["completion_tokens"]
+    )
+
+
+def test_count_tokens():
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    model = ChatOpenAI(temperature=0)
+    messages = [UserMessage(content="test message")]
+    tool = Tool(
+        func=sample_tool_func_with_type,
+        description="This is just a dummy tool with typing info",
+    )
+
+    num_tokens = model.count_tokens(messages)
+    assert num_tokens > model.count_text_tokens("test message")
+    assert model.count_tokens(messages, functions=[tool]) > num_tokens
+
+
+def test_prompt_too_long():
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    model = ChatOpenAI(temperature=0, max_prompt_tokens=10)
+    with mock.patch("openai.ChatCompletion.create") as create:
+        with pytest.raises(PromptTooLongError):
+            model.generate([UserMessage(content="test message " * 20)])
+    create.assert_not_called()
+
+
+def test_convert_tool_to_dict_cached():
+    tool = Tool(
+        func=sample_tool_func_with_type,
+        description="This is just a dummy tool with typing info",
+    )
+
+    tool_dict = convert_tool_to_dict(tool)
+    with mock.patch("inspect.getfullargspec") as getfullargspec:
+        assert convert_tool_to_dict(tool) is tool_dict
+    getfullargspec.assert_not_called()
+
+    # schema is recomputed once the tool changes
+    tool.description = "updated description"
+    assert convert_tool_to_dict(tool)["description"] == "updated description"
@@ -0,0 +1,51 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from autochain.models.micro_batching import MicroBatchQueue
+
+
+def test_concurrent_requests_are_batched():
+    barrier = threading.Barrier(4)
+    batches = []
+
+    def batch_func(requests):
+        batches.append(requests)
+        return [r * 2 for r in requests]
+
+    batch_queue = MicroBatchQueue(batch_func, max_batch_size=4, max_wait_time=5)
+
+    def submit(i):
+        barrier.wait()
+        return batch_queue.submit(i)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(submit, range(4)))
+
+    assert results == [0, 2, 4, 6]
+    assert len(batches) == 1
+    assert sorted(batches[0]) == [0, 1, 2, 3]
+
+
+def test_batch_size_is_limited():
+    batch_queue = MicroBatchQueue(lambda r: r, max_batch_size=2, max_wait_time=0.05)
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        results = list(executor.map(batch_queue.submit, range(5)))
+
+    assert results == list(range(5))
+    assert batch_queue.num_batches >= 3
+
+
+def test_batch_error_is_raised_to_callers():
+    def batch_func(requests):
+        raise ValueError("generation failed")
+
+    batch_queue = MicroBatchQueue(batch_func, max_wait_time=0)
+    with pytest.raises(ValueError):
+        batch_queue.submit("request")
+
+    # queue keeps serving requests after a failed batch
+    batch_queue.batch_func = lambda requests: requests
+    assert batch_queue.submit("request") == "request"
@@ -0,0 +1,70 @@
+import asyncio
+import os
+from unittest import mock
+
+import pytest
+
+from autochain.agent.message import UserMessage
+from autochain.models.chat_openai import ChatOpenAI
+from autochain.models.rate_limiter import RateLimiter
+
+
+def test_requests_per_minute():
+    rate_limiter = RateLimiter(requests_per_minute=120)
+    with mock.patch("time.sleep") as sleep:
+        assert rate_limiter.acquire() == 0
+        for _ in range(119):
+            rate_limiter.acquire()
+        sleep.assert_not_called()
+
+        # bucket is empty, every request waits for the refill of one more request
+        assert rate_limiter.acquire() == pytest.approx(0.5, abs=0.01)
+        assert rate_limiter.acquire() == pytest.approx(1, abs=0.01)
+
+    assert rate_limiter.num_requests == 122
+    assert rate_limiter.num_waits == 2
+    assert rate_limiter.max_wait_time == pytest.approx(1, abs=0.01)
+
+
+def test_tokens_per_minute():
+    rate_limiter = RateLimiter(tokens_per_minute=600)
+    with mock.patch("time.sleep") as sleep:
+        rate_limiter.acquire(tokens=500)
+        rate_limiter.acquire(tokens=200)
+
+    # 100 tokens over the limit take 10 seconds to refill
+    sleep.assert_called_once()
+    assert sleep.call_args[0][0] == pytest.approx(10, abs=0.01)
+
+
+def test_aacquire():
+    rate_limiter = RateLimiter(requests_per_minute=60)
+
+    async def acquire_all():
+        return await asyncio.gather(*[rate_limiter.aacquire() for _ in range(62)])
+
+    with mock.patch("asyncio.sleep") as sleep:
+        wait_times = asyncio.run(acquire_all())
+
+    assert sleep.call_count == 2
+    assert wait_times[-2:] == [pytest.approx(1, abs=0.01), pytest.approx(2, abs=0.01)]
+
+
+def test_generate_acquires_rate_limiter():
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    rate_limiter = RateLimiter(requests_per_minute=10, tokens_per_minute=1000)
+    model = ChatOpenAI(temperature=0, max_tokens=100, rate_limiter=rate_limiter)
+    with mock.patch(
+        "openai.ChatCompletion.create",
+        return_value={
+            "choices": [
+                {"message": {"role": "assistant", "content": "generated message"}}
+            ],
+            "usage": 10,
+        },
+    ):
+        model.generate([UserMessage(content="test message")])
+
+    assert rate_limiter.num_requests == 1
+    # prompt tokens are estimated in addition to max_tokens
+    assert 100 < 1000 - rate_limiter._tokens < 150
@@ -0,0 +1,68 @@
+import os
+from unittest import mock
+
+import openai
+import pytest
+
+from autochain.models.chat_openai import ChatOpenAI
+from autochain.models.retry import RetryBudget, get_retry_after
+
+
+def rate_limit_error(headers=None):
+    return openai.error.RateLimitError("rate limited", headers=headers)
+
+
+def test_get_retry_after():
+    assert get_retry_after(ValueError()) is None
+    assert get_retry_after(rate_limit_error({"retry-after": "3"})) == 3
+    assert get_retry_after(rate_limit_error({"retry-after-ms": "500"})) == 0.5
+    assert get_retry_after(rate_limit_error({"retry-after": "soon"})) is None
+    assert (
+        get_retry_after(
+            rate_limit_error({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        )
+        == 0
+    )
+
+
+def test_retry_budget():
+    budget = RetryBudget(retry_ratio=0.5, max_tokens=2)
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+    assert budget.num_retries == 3
+    assert budget.num_exhausted == 1
+
+
+@mock.patch("time.sleep")
+def test_generate_with_retry_honors_retry_after(sleep):
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    model = ChatOpenAI(temperature=0, retry_budget=RetryBudget())
+    with mock.patch(
+        "openai.ChatCompletion.create",
+        side_effect=[rate_limit_error({"retry-after": "2"}), {"choices": []}],
+    ) as create:
+        assert model.generate_with_retry(model="test") == {"choices": []}
+
+    assert create.call_count == 2
+    sleep.assert_called_once_with(2)
+
+
+@mock.patch("time.sleep")
+def test_generate_with_retry_budget_exhausted(sleep):
+    os.environ["OPENAI_API_KEY"] = "mock_api_key"
+    budget = RetryBudget(retry_ratio=0, max_tokens=1)
+    model = ChatOpenAI(temperature=0, retry_budget=budget, max_retries=6)
+    with mock.patch(
+        "openai.ChatCompletion.create", side_effect=rate_limit_error()
+    ) as create:
+        with pytest.raises(openai.error.RateLimitError):
+            model.generate_with_retry(model="test")
+
+    # one retry allowed by the budget instead of max_retries
+    assert create.call_count == 2
+    assert budget.num_exhausted == 1
@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 
 from autochain.tools.base import Tool
@@ -45,3 +47,20 @@ def test_arg_description():
             description="""This is just a dummy tool""",
             arg_description=invalid_arg_description,
         )
+
+
+def test_arun_tool():
+    async def async_sample_tool_func(k, *arg, **kwargs):
+        return f"async run with {k}"
+
+    tool = Tool(
+        func=sample_tool_func,
+        description="""This is just a dummy tool""",
+    )
+    assert asyncio.run(tool.arun("test")) == "run with test"
+
+    async_tool = Tool(
+        func=async_sample_tool_func,
+        description="""This is just a dummy async tool""",
+    )
+    assert asyncio.run(async_tool.arun("test")) == "async run with test"